@@ -0,0 +1,317 @@
+"""
+Benchmarks for the MQTT client hot paths, run on desktop CPython against an in-memory fake socket:
+publish at QoS 0 and 1, wait_msg parsing over a range of payload sizes, connect and subscribe, and the
+same for TBDeviceMqttClient when the sdk_core submodule is checked out.
+
+Every benchmark reports the time per operation and, measured in a separate pass under tracemalloc, the
+peak memory allocated while handling one operation and the memory blocks still held afterwards. Absolute
+numbers only mean something relative to a previous run on the same machine.
+
+    python benchmarks/bench_umqtt.py --output bench.json
+    python benchmarks/bench_umqtt.py --compare bench.json --tolerance 0.15
+
+With --compare the exit status is 1 when any benchmark got slower than the baseline by more than the
+tolerance, or allocates more per operation than it did.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+import upy_shim  # noqa: E402
+
+upy_shim.install()
+
+from fake_socket import FakeSocketModule  # noqa: E402
+from thingsboard_sdk import umqtt  # noqa: E402
+from thingsboard_sdk.umqtt import MQTTClient  # noqa: E402
+
+PAYLOAD_SIZES = (16, 128, 1024, 8192)
+TOPIC = b"v1/devices/me/telemetry"
+ATTRIBUTES_TOPIC = b"v1/devices/me/attributes"
+TB_SUBSCRIPTIONS = (
+    ("v1/devices/me/attributes", 1, None),
+    ("v1/devices/me/attributes/response/+", 1, None),
+    ("v1/devices/me/rpc/request/+", 1, None),
+    ("v1/devices/me/rpc/response/+", 1, None),
+)
+
+
+def _ignore(topic, msg):
+    pass
+
+
+def _connect(**kwargs):
+    umqtt.socket = FakeSocketModule()
+    client = MQTTClient("bench", "broker.local", **kwargs)
+    client.set_callback(_ignore)
+    client.connect()
+    return client
+
+
+def _publish_packet(topic, payload, qos=0, pid=1):
+    body = len(topic).to_bytes(2, "big") + topic
+    if qos:
+        body += pid.to_bytes(2, "big")
+    body += payload
+    size = len(body)
+    header = bytearray((0x30 | qos << 1,))
+    while size > 0x7F:
+        header.append(size & 0x7F | 0x80)
+        size >>= 7
+    header.append(size)
+    return bytes(header) + body
+
+
+# A benchmark is a setup(n) returning the operation to time; the
+# operation is then called n times on that setup
+class Benchmark:
+    def __init__(self, name, setup, params=None, payload=0):
+        self.name = name
+        self.setup = setup
+        self.params = params or {}
+        self.payload = payload
+
+    @property
+    def key(self):
+        return self.name + "".join("[%s=%s]" % item for item in sorted(self.params.items()))
+
+
+def _time(bench, n, repeat):
+    best = None
+    for _ in range(repeat):
+        op = bench.setup(n)
+        gc.collect()
+        t = time.perf_counter()
+        for _ in range(n):
+            op()
+        elapsed = time.perf_counter() - t
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / n
+
+
+def _allocations(bench, n):
+    op = bench.setup(n + 1)
+    # The first call may fill lazily allocated buffers and caches
+    op()
+    gc.collect()
+    tracemalloc.start()
+    peak_total = 0
+    peak_max = 0
+    blocks = sys.getallocatedblocks()
+    for _ in range(n):
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        op()
+        peak = tracemalloc.get_traced_memory()[1] - start
+        peak_total += peak
+        if peak > peak_max:
+            peak_max = peak
+    gc.collect()
+    retained = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+    return peak_total / n, peak_max, retained / n
+
+
+def publish(qos, size, max_inflight=0):
+    payload = b"x" * size
+
+    def setup(n):
+        client = _connect(max_inflight=max_inflight)
+        return lambda: client.publish(TOPIC, payload, qos=qos)
+
+    params = {"qos": qos, "payload": size}
+    if max_inflight:
+        params["inflight"] = max_inflight
+    return Benchmark("publish", setup, params, size)
+
+
+def wait_msg(qos, size, zero_copy=False):
+    payload = b"x" * size
+
+    def setup(n):
+        if zero_copy:
+            client = _connect(max_msg_size=size + 64, zero_copy=True)
+        else:
+            client = _connect()
+        sock = client.sock
+        sock.respond = False
+        packet = _publish_packet(TOPIC, payload, qos)
+        sock.feed(packet * n)
+        return client.wait_msg
+
+    params = {"qos": qos, "payload": size}
+    if zero_copy:
+        params["zero_copy"] = 1
+    return Benchmark("wait_msg", setup, params, size)
+
+
+def connect():
+    def setup(n):
+        client = _connect()
+        return client.connect
+
+    return Benchmark("connect", setup)
+
+
+def subscribe(count):
+    subscriptions = TB_SUBSCRIPTIONS[:count]
+
+    def setup(n):
+        client = _connect()
+        return lambda: client.subscribe_many(subscriptions)
+
+    return Benchmark("subscribe", setup, {"filters": count})
+
+
+def _tb_client(**kwargs):
+    from thingsboard_sdk.tb_device_mqtt import TBDeviceMqttClient
+
+    umqtt.socket = FakeSocketModule()
+    client = TBDeviceMqttClient("broker.local", access_token="bench", **kwargs)
+    client.connect()
+    return client
+
+
+def tb_send_telemetry(qos):
+    telemetry = {"temperature": 21.5, "humidity": 40, "status": "ok"}
+
+    def setup(n):
+        client = _tb_client(quality_of_service=qos)
+        return lambda: client.send_telemetry(telemetry)
+
+    return Benchmark("tb_send_telemetry", setup, {"qos": qos})
+
+
+def tb_send_telemetry_values(qos):
+    def setup(n):
+        client = _tb_client(quality_of_service=qos)
+        template = client.telemetry_template("temperature", "humidity", "status")
+        return lambda: client.send_telemetry_values(template, 21.5, 40, "ok")
+
+    return Benchmark("tb_send_telemetry_values", setup, {"qos": qos})
+
+
+def tb_attributes_update():
+    packet = _publish_packet(ATTRIBUTES_TOPIC, b'{"interval":60,"mode":"eco"}', 1)
+
+    def setup(n):
+        client = _tb_client()
+        client._client.sock.respond = False
+        client._client.sock.feed(packet * n)
+        return client.check_for_msg
+
+    return Benchmark("tb_attributes_update", setup)
+
+
+def benchmarks():
+    result = []
+    for size in PAYLOAD_SIZES:
+        result.append(publish(0, size))
+        result.append(publish(1, size))
+        result.append(publish(1, size, max_inflight=16))
+    for size in PAYLOAD_SIZES:
+        for qos in (0, 1):
+            result.append(wait_msg(qos, size))
+        result.append(wait_msg(0, size, zero_copy=True))
+    result.append(connect())
+    result.append(subscribe(1))
+    result.append(subscribe(len(TB_SUBSCRIPTIONS)))
+    try:
+        import sdk_core  # noqa: F401
+    except ImportError:
+        print("sdk_core is not checked out, skipping the TBDeviceMqttClient benchmarks", file=sys.stderr)
+    else:
+        result.extend((tb_send_telemetry(0), tb_send_telemetry(1), tb_send_telemetry_values(0),
+                       tb_attributes_update()))
+    return result
+
+
+def run(selected, n, repeat, alloc_n):
+    results = []
+    for bench in selected:
+        per_op = _time(bench, n, repeat)
+        peak_mean, peak_max, retained = _allocations(bench, alloc_n)
+        entry = {
+            "name": bench.name,
+            "key": bench.key,
+            "params": bench.params,
+            "ops": n,
+            "us_per_op": round(per_op * 1e6, 3),
+            "ops_per_s": round(1 / per_op),
+            "alloc_peak_bytes_per_op": round(peak_mean, 1),
+            "alloc_peak_bytes_max": peak_max,
+            "retained_blocks_per_op": round(retained, 3),
+        }
+        if bench.payload:
+            entry["payload_mb_per_s"] = round(bench.payload / per_op / 1e6, 2)
+        results.append(entry)
+        print("%-48s %10.2f us/op %10d op/s %8.0f B/op" % (bench.key, entry["us_per_op"], entry["ops_per_s"],
+                                                           peak_mean), file=sys.stderr)
+    return results
+
+
+# Returns the regressions of results against the baseline document
+def compare(results, baseline, tolerance):
+    previous = {entry["key"]: entry for entry in baseline["results"]}
+    regressions = []
+    for entry in results:
+        old = previous.get(entry["key"])
+        if old is None:
+            continue
+        change = entry["us_per_op"] / old["us_per_op"] - 1
+        if change > tolerance:
+            regressions.append("%s: %.2f -> %.2f us/op (+%.0f%%)" % (entry["key"], old["us_per_op"],
+                                                                    entry["us_per_op"], change * 100))
+        # A few bytes of slack for allocator rounding
+        if entry["alloc_peak_bytes_per_op"] > old["alloc_peak_bytes_per_op"] + 16:
+            regressions.append("%s: %.0f -> %.0f peak bytes/op" % (entry["key"], old["alloc_peak_bytes_per_op"],
+                                                                   entry["alloc_peak_bytes_per_op"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file instead of stdout")
+    parser.add_argument("-k", "--filter", help="run only benchmarks whose key contains this string")
+    parser.add_argument("-n", "--ops", type=int, default=20000, help="operations per timed run")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="timed runs per benchmark, the best counts")
+    parser.add_argument("--alloc-ops", type=int, default=200, help="operations traced for allocations")
+    parser.add_argument("--quick", action="store_true", help="fewer operations, for a smoke test")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON output of an earlier run to check against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+    if args.quick:
+        args.ops, args.repeat, args.alloc_ops = 1000, 1, 20
+
+    selected = [b for b in benchmarks() if not args.filter or args.filter in b.key]
+    document = {
+        "python": platform.python_implementation() + " " + platform.python_version(),
+        "machine": platform.machine(),
+        "timestamp": int(time.time()),
+        "results": run(selected, args.ops, args.repeat, args.alloc_ops),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(document, f, indent=1)
+    else:
+        json.dump(document, sys.stdout, indent=1)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(document["results"], json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+In-memory stand-in for a connected MicroPython socket. It answers what the client sends the way a broker
+would (CONNACK, SUBACK, PUBACK, PINGRESP) and can be preloaded with an incoming byte stream.
+"""
+
+import struct
+from errno import ETIMEDOUT
+
+_CONNACK = b"\x20\x02\x00\x00"
+_PINGRESP = b"\xd0\x00"
+
+
+class FakeSocket:
+    def __init__(self, incoming=b"", respond=True):
+        self._rx = bytearray(incoming)
+        self._rpos = 0
+        self.respond = respond
+        self.blocking = True
+        self.tx_bytes = 0
+        self.tx_writes = 0
+        # Bytes of the current outgoing packet that are still to come in later writes
+        self._left = 0
+
+    # Queue bytes for the client to read
+    def feed(self, data):
+        if self._rpos == len(self._rx):
+            self._rx[:] = data
+            self._rpos = 0
+        else:
+            self._rx += data
+
+    def connect(self, addr):
+        pass
+
+    def settimeout(self, timeout):
+        self.blocking = timeout != 0
+
+    def setblocking(self, flag):
+        self.blocking = flag
+
+    def close(self):
+        pass
+
+    def readinto(self, buf, n=None):
+        avail = len(self._rx) - self._rpos
+        if not avail:
+            if not self.blocking:
+                return None
+            # Nothing will ever arrive, so waiting would never end
+            raise OSError(ETIMEDOUT)
+        n = min(len(buf) if n is None else n, avail)
+        buf[:n] = memoryview(self._rx)[self._rpos:self._rpos + n]
+        self._rpos += n
+        return n
+
+    def read(self, n):
+        buf = bytearray(n)
+        return bytes(buf[:self.readinto(buf)])
+
+    def write(self, buf, n=None):
+        if n is None:
+            n = len(buf)
+        self.tx_bytes += n
+        self.tx_writes += 1
+        if self._left:
+            self._left -= n
+        elif self.respond:
+            self._answer(buf, n)
+        return n
+
+    def _answer(self, buf, n):
+        op = buf[0] & 0xF0
+        size = 0
+        shift = 0
+        i = 1
+        while 1:
+            b = buf[i]
+            size |= (b & 0x7F) << shift
+            i += 1
+            if not b & 0x80:
+                break
+            shift += 7
+        self._left = size + i - n
+        if op == 0x10:
+            self.feed(_CONNACK)
+        elif op == 0x30 and buf[0] & 6:
+            topic_len = buf[i] << 8 | buf[i + 1]
+            j = i + 2 + topic_len
+            self.feed(b"\x40\x02" + bytes(buf[j:j + 2]))
+        elif op == 0x80:
+            # One granted QoS per filter; count them from the packet
+            j = i + 2
+            codes = bytearray()
+            while j < i + size:
+                j += 2 + (buf[j] << 8 | buf[j + 1])
+                codes.append(buf[j])
+                j += 1
+            self.feed(struct.pack("!BBH", 0x90, 2 + len(codes), buf[i] << 8 | buf[i + 1]) + codes)
+        elif op == 0xC0:
+            self.feed(_PINGRESP)
+
+
+# Module-like object to put in place of thingsboard_sdk.umqtt.socket, so
+# that MQTTClient.connect() gets a FakeSocket (made by factory)
+class FakeSocketModule:
+    def __init__(self, factory=FakeSocket):
+        self.factory = factory
+        self.last = None
+
+    def socket(self, *args):
+        self.last = self.factory()
+        return self.last
+
+    def getaddrinfo(self, host, port, *args):
+        return [(2, 1, 0, "", (host, port))]
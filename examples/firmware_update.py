@@ -0,0 +1,63 @@
+"""
+This sketch demonstrates an over-the-air firmware update on ESP32: the image assigned to the device
+is streamed into the inactive OTA partition, verified and booted after a reset
+"""
+
+import machine
+import network
+from esp32 import Partition
+from thingsboard_sdk.tb_device_mqtt import TBDeviceMqttClient
+from thingsboard_sdk.firmware import PartitionWriter
+
+WIFI_SSID = "YOUR_SSID"
+WIFI_PASSWORD = "YOUR_PASSWORD"
+
+# Thingsboard we want to establish a connection to
+THINGSBOARD_HOST = "thingsboard.cloud"
+# MQTT port used to communicate with the server, 1883 is the default unencrypted MQTT port,
+# whereas 8883 would be the default encrypted SSL MQTT port
+THINGSBOARD_PORT = 1883
+# See https://thingsboard.io/docs/getting-started-guides/helloworld/
+# to understand how to obtain an access token
+ACCESS_TOKEN = "YOUR_ACCESS_TOKEN"
+# Title and version of the firmware this device is running
+FW_TITLE = "my_firmware"
+FW_VERSION = "1.0"
+
+# Enabling WLAN interface
+wlan = network.WLAN(network.STA_IF)
+wlan.active(True)
+
+# Establishing connection to the Wi-Fi
+if not wlan.isconnected():
+    print('Connecting to network...')
+    wlan.connect(WIFI_SSID, WIFI_PASSWORD)
+    while not wlan.isconnected():
+        pass
+
+print('Connected! Network config:', wlan.ifconfig())
+
+# The image booted fine, so keep it instead of rolling back on the next reset
+Partition.mark_app_valid_cancel_rollback()
+
+# Chunks of 4096 bytes are written to flash straight from the receive buffer, without being copied;
+# max_msg_size leaves room for the chunk topic
+client = TBDeviceMqttClient(host=THINGSBOARD_HOST, port=THINGSBOARD_PORT, access_token=ACCESS_TOKEN, chunk_size=4096,
+                            max_msg_size=4200, zero_copy=True)
+client.connect()
+client.send_telemetry({"current_fw_title": FW_TITLE, "current_fw_version": FW_VERSION, "fw_state": "UPDATED"})
+
+writer = PartitionWriter()
+# Blocks until the image is downloaded and verified; two chunk requests are kept in flight
+update = client.run_firmware_update(current_version=FW_VERSION, writer=writer, window=2)
+if update.error:
+    print("Firmware update failed:", update.error)
+elif update.received:
+    print("Firmware", update.info["fw_version"], "downloaded, rebooting")
+    client.send_telemetry({"fw_state": "UPDATING"})
+    client.disconnect()
+    writer.activate()
+    machine.reset()
+else:
+    print("Firmware is up to date")
+    client.disconnect()
@@ -0,0 +1,61 @@
+"""
+This sketch demonstrates a gateway that reports several sub-devices over a single connection: their telemetry is
+batched into shared messages, and RPC calls addressed to any of them are answered
+"""
+
+import time
+import network
+from thingsboard_sdk.tb_gateway_mqtt import TBGatewayMqttClient
+
+WIFI_SSID = "YOUR_SSID"
+WIFI_PASSWORD = "YOUR_PASSWORD"
+
+# Thingsboard we want to establish a connection to
+THINGSBOARD_HOST = "thingsboard.cloud"
+# MQTT port used to communicate with the server, 1883 is the default unencrypted MQTT port,
+# whereas 8883 would be the default encrypted SSL MQTT port
+THINGSBOARD_PORT = 1883
+# Access token of a device created with the "Is gateway" option enabled
+ACCESS_TOKEN = "YOUR_GATEWAY_ACCESS_TOKEN"
+# Sub-devices behind the gateway, they are created on the server when first connected
+SENSORS = ("Sensor A", "Sensor B", "Sensor C")
+
+# Enabling WLAN interface
+wlan = network.WLAN(network.STA_IF)
+wlan.active(True)
+
+# Establishing connection to the Wi-Fi
+if not wlan.isconnected():
+    print('Connecting to network...')
+    wlan.connect(WIFI_SSID, WIFI_PASSWORD)
+    while not wlan.isconnected():
+        pass
+
+print('Connected! Network config:', wlan.ifconfig())
+
+
+# Answers "getState" calls for every sub-device
+def on_rpc(device_name, request_id, request):
+    print(device_name, request_id, request)
+    if request["method"] == "getState":
+        gateway.gw_send_rpc_reply(device_name, request_id, {"online": True})
+
+
+gateway = TBGatewayMqttClient(host=THINGSBOARD_HOST, port=THINGSBOARD_PORT, access_token=ACCESS_TOKEN)
+gateway.gw_set_server_side_rpc_request_handler(on_rpc)
+gateway.enable_auto_reconnect()
+gateway.connect()
+for name in SENSORS:
+    gateway.gw_connect_device(name, "thermometer")
+
+# Samples of all sub-devices go out together, at the latest 10 seconds after the first one
+gateway.enable_telemetry_batching(max_bytes=1024, max_age_ms=10000)
+
+try:
+    while True:
+        for i, name in enumerate(SENSORS):
+            gateway.gw_send_telemetry(name, {"temperature": 20 + i})
+        gateway.check_for_msg()
+        time.sleep(1)
+finally:
+    gateway.disconnect()
@@ -39,8 +39,9 @@ print('Connected! Network config:', wlan.ifconfig())
 provision_request = TBDeviceMqttClientBase.get_provision_request(provision_device_key=PROVISION_DEVICE_KEY,
                                                                  provision_device_secret=PROVISION_DEVICE_SECRET,
                                                                  device_name=DEVICE_NAME)
-# Send provision device request
-provisioned_credentials = TBDeviceMqttClient.provision(THINGSBOARD_HOST, THINGSBOARD_PORT, provision_request)
+# Send provision device request. The credentials are stored on flash, so later boots skip provisioning
+provisioned_credentials = TBDeviceMqttClient.provision(THINGSBOARD_HOST, THINGSBOARD_PORT, provision_request,
+                                                       credentials_path="/tb_credentials")
 print(provisioned_credentials)
 
 if not provisioned_credentials:
@@ -54,12 +54,14 @@ client = TBDeviceMqttClient(host=THINGSBOARD_HOST, port=THINGSBOARD_PORT, access
 client.connect()
 # Sending data to retrieve it later
 client.send_attributes({"atr1": "value1", "atr2": "value2"})
-# Requesting attributes
-client.request_attributes(["atr1", "atr2"], callback=on_attributes_change)
+# Requesting attributes, the call returns right away and the callback is called
+# with the response (or with a timeout error after 10 seconds)
+client.request_attributes(["atr1", "atr2"], callback=on_attributes_change, timeout=10)
 
 # Wait until we receive the attributes from the server
 while not IS_ATTR_RECEIVED:
-    time.sleep(1)
+    client.check_for_msg()
+    time.sleep_ms(50)
 
 # Disconnect from ThingsBoard
 client.disconnect()
@@ -0,0 +1,64 @@
+"""
+This sketch demonstrates the uasyncio client: a sensor task sends telemetry while
+a background reader task serves server-side RPC requests, without any polling sleeps.
+"""
+
+import network
+import uasyncio as asyncio
+from thingsboard_sdk.tb_device_mqtt_async import TBDeviceMqttClientAsync
+
+WIFI_SSID = "YOUR_SSID"
+WIFI_PASSWORD = "YOUR_PASSWORD"
+
+# Thingsboard host we want to establish a connection to
+THINGSBOARD_HOST = "thingsboard.cloud"
+# MQTT port used to communicate with the server, 1883 is the default unencrypted MQTT port,
+# whereas 8883 would be the default encrypted SSL MQTT port
+THINGSBOARD_PORT = 1883
+# See https://thingsboard.io/docs/getting-started-guides/helloworld/
+# to understand how to obtain an access token
+ACCESS_TOKEN = "YOUR_ACCESS_TOKEN"
+
+# Enabling WLAN interface
+wlan = network.WLAN(network.STA_IF)
+wlan.active(True)
+
+# Establishing connection to the Wi-Fi
+if not wlan.isconnected():
+    print('Connecting to network...')
+    wlan.connect(WIFI_SSID, WIFI_PASSWORD)
+    while not wlan.isconnected():
+        pass
+
+print('Connected! Network config:', wlan.ifconfig())
+
+# Initialising client to communicate with ThingsBoard
+client = TBDeviceMqttClientAsync(THINGSBOARD_HOST, port=THINGSBOARD_PORT, access_token=ACCESS_TOKEN)
+
+
+# This callback is called from the reader task when an RPC request is received
+def on_server_side_rpc_request(request_id, request_body):
+    print("[RPC] id:", request_id, "body:", request_body)
+    client.send_rpc_reply(request_id, {"result": "ok"})
+
+
+async def sensor_task():
+    counter = 0
+    while True:
+        counter += 1
+        # Resumes once the server has acknowledged the message
+        await client.send_telemetry_async({"counter": counter})
+        await asyncio.sleep(5)
+
+
+async def main():
+    client.set_server_side_rpc_request_handler(on_server_side_rpc_request)
+    # Connect to ThingsBoard, incoming messages are handled by a background task from now on
+    await client.connect()
+    # Request attributes and wait for the response without blocking other tasks
+    response = await client.request_attributes_async(shared_keys=["targetFirmwareVersion"])
+    print("Attributes:", response)
+    await sensor_task()
+
+
+asyncio.run(main())
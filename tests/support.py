@@ -0,0 +1,215 @@
+"""
+Shared setup for the tests, which run on desktop CPython: the MicroPython stand-ins from tools/upy_shim.py
+are installed before anything from thingsboard_sdk is imported. Import this module first.
+
+FakeSocket is an in-memory connected socket that answers what the client sends the way a broker would
+(CONNACK, SUBACK, PUBACK, PINGRESP) and keeps everything the client wrote.
+"""
+
+import os
+import struct
+import sys
+import unittest
+from errno import ETIMEDOUT
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+import upy_shim  # noqa: E402
+
+upy_shim.install()
+
+from thingsboard_sdk import umqtt  # noqa: E402
+
+CONNACK = b"\x20\x02\x00\x00"
+PINGRESP = b"\xd0\x00"
+
+# Never written to, so polling it just waits out the timeout
+_IDLE_FD = os.pipe()[0]
+
+
+class FakeSocket:
+    def __init__(self, incoming=b"", respond=True):
+        self._rx = bytearray(incoming)
+        self._rpos = 0
+        # Answer CONNECT, SUBSCRIBE, QoS 1 PUBLISH and PINGREQ
+        self.respond = respond
+        self.blocking = True
+        self.closed = False
+        self.written = bytearray()
+        # Bytes of the current outgoing packet that are still to come in later writes
+        self._left = 0
+
+    # Queue bytes for the client to read
+    def feed(self, data):
+        if self._rpos == len(self._rx):
+            self._rx[:] = data
+            self._rpos = 0
+        else:
+            self._rx += data
+
+    # Bytes already in the buffer do not make the socket poll readable,
+    # like decrypted bytes held by a TLS socket
+    def pending(self):
+        return len(self._rx) - self._rpos
+
+    def fileno(self):
+        return _IDLE_FD
+
+    def connect(self, addr):
+        pass
+
+    def settimeout(self, timeout):
+        self.blocking = timeout != 0
+
+    def setblocking(self, flag):
+        self.blocking = flag
+
+    def close(self):
+        self.closed = True
+
+    def readinto(self, buf, n=None):
+        avail = len(self._rx) - self._rpos
+        if not avail:
+            if not self.blocking:
+                return None
+            # Nothing will ever arrive, so waiting would never end
+            raise OSError(ETIMEDOUT)
+        n = min(len(buf) if n is None else n, avail)
+        buf[:n] = memoryview(self._rx)[self._rpos:self._rpos + n]
+        self._rpos += n
+        return n
+
+    def read(self, n):
+        buf = bytearray(n)
+        return bytes(buf[:self.readinto(buf)])
+
+    def write(self, buf, n=None):
+        if n is None:
+            n = len(buf)
+        data = memoryview(buf)[:n]
+        self.written += data
+        if self._left:
+            self._left -= n
+        elif self.respond:
+            self._answer(data)
+        return n
+
+    def _answer(self, buf):
+        op = buf[0] & 0xF0
+        size = 0
+        shift = 0
+        i = 1
+        while 1:
+            b = buf[i]
+            size |= (b & 0x7F) << shift
+            i += 1
+            if not b & 0x80:
+                break
+            shift += 7
+        self._left = size + i - len(buf)
+        if op == 0x10:
+            self.feed(CONNACK)
+        elif op == 0x30 and buf[0] & 6:
+            topic_len = buf[i] << 8 | buf[i + 1]
+            j = i + 2 + topic_len
+            self.feed(b"\x40\x02" + bytes(buf[j:j + 2]))
+        elif op == 0x80:
+            # One granted QoS per filter; count them from the packet
+            j = i + 2
+            codes = bytearray()
+            while j < i + size:
+                j += 2 + (buf[j] << 8 | buf[j + 1])
+                codes.append(buf[j])
+                j += 1
+            self.feed(struct.pack("!BBH", 0x90, 2 + len(codes), buf[i] << 8 | buf[i + 1]) + codes)
+        elif op == 0xC0:
+            self.feed(PINGRESP)
+
+    # Remove and return the packets written so far, see packets()
+    def take_packets(self):
+        result = packets(self.written)
+        self.written[:] = b""
+        return result
+
+
+# Module-like object to put in place of thingsboard_sdk.umqtt.socket, so
+# that MQTTClient.connect() gets a FakeSocket (made by factory)
+class FakeSocketModule:
+    def __init__(self, factory=FakeSocket):
+        self.factory = factory
+        self.last = None
+
+    def socket(self, *args):
+        self.last = self.factory()
+        return self.last
+
+    def getaddrinfo(self, host, port, *args):
+        return [(2, 1, 0, "", (host, port))]
+
+
+def install_fake_socket(factory=FakeSocket):
+    module = umqtt.socket = FakeSocketModule(factory)
+    return module
+
+
+# A connected MQTTClient on a FakeSocket; returns (client, socket)
+def connect(received=None, **kwargs):
+    module = install_fake_socket()
+    client = umqtt.MQTTClient("test", "broker.local", **kwargs)
+    client.set_callback(received or (lambda topic, msg: None))
+    client.connect()
+    module.last.written[:] = b""
+    return client, module.last
+
+
+# (first byte, body) of each whole packet in data
+def packets(data):
+    result = []
+    i = 0
+    while i < len(data):
+        n = shift = 0
+        j = i + 1
+        while True:
+            n |= (data[j] & 0x7F) << shift
+            shift += 7
+            j += 1
+            if not data[j - 1] & 0x80:
+                break
+        result.append((data[i], bytes(data[j:j + n])))
+        i = j + n
+    return result
+
+
+# (topic, payload) of each PUBLISH in data
+def publishes(data):
+    result = []
+    for op, body in packets(data):
+        if op & 0xF0 == 0x30:
+            topic_len = body[0] << 8 | body[1]
+            start = 2 + topic_len + (2 if op & 6 else 0)
+            result.append((body[2:2 + topic_len].decode(), body[start:]))
+    return result
+
+
+def publish_packet(topic, payload, qos=0, pid=1):
+    body = len(topic).to_bytes(2, "big") + topic
+    if qos:
+        body += pid.to_bytes(2, "big")
+    body += payload
+    header = bytearray((0x30 | qos << 1,))
+    n = len(body)
+    while n > 0x7F:
+        header.append(n & 0x7F | 0x80)
+        n >>= 7
+    header.append(n)
+    return bytes(header) + body
+
+
+# TBDeviceMqttClient is built on the sdk_core submodule; its tests are
+# skipped when that is not checked out
+def require_sdk_core():
+    try:
+        import sdk_core  # noqa: F401
+    except ImportError:
+        raise unittest.SkipTest("sdk_core is not checked out")
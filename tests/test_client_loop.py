@@ -0,0 +1,81 @@
+"""
+PendingRequests deadlines, and ClientLoop.wait_for_msg() waiting no longer than until the next request timeout or
+batch flush is due.
+"""
+
+import json
+import time
+import unittest
+from errno import ETIMEDOUT
+
+import support
+from thingsboard_sdk.client_loop import PendingRequests
+
+
+class PendingRequestsTest(unittest.TestCase):
+    def setUp(self):
+        self.expired = []
+        self.pending = PendingRequests(lambda request_id, callback: self.expired.append(request_id))
+
+    def test_nothing_pending(self):
+        self.assertIsNone(self.pending.due_ms())
+        self.pending.expire()
+        self.assertEqual(self.expired, [])
+
+    def test_expire_in_deadline_order(self):
+        self.pending.add(1, None, 60)
+        self.pending.add(2, None, 0)
+        self.pending.add(3, None, 0)
+        self.assertEqual(self.pending.due_ms(), 0)
+        self.pending.expire()
+        self.assertEqual(sorted(self.expired), [2, 3])
+        self.assertEqual(len(self.pending), 1)
+        self.assertTrue(59000 <= self.pending.due_ms() <= 60000)
+
+    def test_answered_request_is_not_expired(self):
+        callback = object()
+        self.pending.add(1, callback, 0)
+        self.assertIs(self.pending.pop(1), callback)
+        self.assertIsNone(self.pending.pop(1))
+        self.pending.expire()
+        self.assertEqual(self.expired, [])
+        self.assertIsNone(self.pending.due_ms())
+
+
+class WaitForMsgTest(unittest.TestCase):
+    def setUp(self):
+        from thingsboard_sdk.tb_gateway_mqtt import TBGatewayMqttClient
+
+        self.sockets = support.install_fake_socket()
+        self.gateway = TBGatewayMqttClient("broker.local", access_token="token")
+        self.gateway.connect()
+
+    def test_until_request_timeout(self):
+        results = []
+        self.gateway.gw_request_attributes("A", ["k"], callback=lambda response, error: results.append(error),
+                                           timeout=0.05)
+        t = time.monotonic()
+        while not results:
+            self.gateway.wait_for_msg()
+        self.assertLess(time.monotonic() - t, 5)
+        self.assertEqual(results[0].args[0], ETIMEDOUT)
+
+    def test_until_batch_is_due(self):
+        self.gateway.enable_telemetry_batching(max_age_ms=50)
+        self.gateway.gw_send_telemetry("A", {"n": 1})
+        self.assertLessEqual(self.gateway._wait_ms(), 50)
+        t = time.monotonic()
+        while self.gateway._telemetry_batch:
+            self.gateway.wait_for_msg()
+        self.assertLess(time.monotonic() - t, 5)
+        sent = [json.loads(payload) for topic, payload in support.publishes(self.sockets.last.written)
+                if topic == "v1/gateway/telemetry"]
+        self.assertEqual(len(sent), 1)
+
+    def test_keepalive_when_idle(self):
+        wait = self.gateway._wait_ms()
+        self.assertGreater(wait, 60000)
+
+
+if __name__ == "__main__":
+    unittest.main()
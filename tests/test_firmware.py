@@ -0,0 +1,173 @@
+"""
+FirmwareUpdate: a download served chunk by chunk by the fake broker, and one interrupted after a checkpoint that
+a new FirmwareUpdate continues where the flash contents end.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+from binascii import crc32
+from unittest import mock
+
+import support
+from thingsboard_sdk.firmware import FirmwareUpdate
+
+BLOCK_SIZE = 1024
+CHUNK_SIZE = 1024
+IMAGE = bytes(i * 7 & 0xFF for i in range(5 * CHUNK_SIZE + 100))
+
+
+# Resumable writer on an in-memory "flash" shared between instances, like
+# a partition surviving a reboot
+class MemoryWriter:
+    def __init__(self, flash):
+        self.flash = flash
+        self._block = bytearray()
+
+    def write(self, data):
+        self._block += data
+        while len(self._block) >= BLOCK_SIZE:
+            self.flash += self._block[:BLOCK_SIZE]
+            del self._block[:BLOCK_SIZE]
+
+    @property
+    def flushed(self):
+        return len(self.flash)
+
+    def resume(self, offset):
+        aligned = offset - offset % BLOCK_SIZE
+        self._block = self.flash[aligned:offset]
+        del self.flash[aligned:]
+
+    def readinto(self, offset, buf):
+        n = min(len(buf), len(self.flash) - offset)
+        buf[:n] = self.flash[offset:offset + n]
+
+    def finish(self):
+        self.flash += self._block
+        self._block = bytearray()
+
+
+def image_info(algorithm="CRC32", version="1.1"):
+    if algorithm == "CRC32":
+        digest = crc32(IMAGE).to_bytes(4, "little").hex()
+    else:
+        digest = hashlib.sha256(IMAGE).hexdigest()
+    return {"fw_title": "sensor", "fw_version": version, "fw_size": len(IMAGE), "fw_checksum": digest,
+            "fw_checksum_algorithm": algorithm}
+
+
+class FirmwareUpdateTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.state_path = os.path.join(self._dir.name, "fw_state")
+        self.flash = bytearray()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def start(self, info, **kwargs):
+        self.client, self.sock = support.connect()
+        update = FirmwareUpdate(self.client, MemoryWriter(self.flash), chunk_size=CHUNK_SIZE, window=2,
+                                state_path=self.state_path, checkpoint_bytes=2 * CHUNK_SIZE, **kwargs)
+        update.start(1, info)
+        return update
+
+    # Answers the chunk requests written so far, stopping after chunk
+    # stop_after; returns the requested chunk numbers and the fw states
+    def serve(self, stop_after=None):
+        requested = []
+        states = []
+        while True:
+            sent = support.publishes(self.sock.written)
+            self.sock.written[:] = b""
+            if not sent:
+                break
+            for topic, payload in sent:
+                if topic == "v1/devices/me/telemetry":
+                    states.append(json.loads(payload)["fw_state"])
+                    continue
+                self.assertTrue(topic.startswith("v2/fw/request/1/chunk/"))
+                self.assertEqual(payload, str(CHUNK_SIZE).encode())
+                chunk = int(topic.rsplit("/", 1)[1])
+                requested.append(chunk)
+                if stop_after is not None and chunk > stop_after:
+                    continue
+                data = IMAGE[chunk * CHUNK_SIZE:(chunk + 1) * CHUNK_SIZE]
+                self.sock.feed(support.publish_packet(b"v2/fw/response/1/chunk/%d" % chunk, data))
+            while self.client.check_msg() is not None:
+                pass
+        return requested, states
+
+    def test_download(self):
+        update = self.start(image_info())
+        requested, states = self.serve()
+        self.assertTrue(update.done)
+        self.assertIsNone(update.error)
+        self.assertEqual(requested, [0, 1, 2, 3, 4, 5])
+        self.assertEqual(states, ["DOWNLOADING", "DOWNLOADED", "VERIFIED"])
+        self.assertEqual(bytes(self.flash), IMAGE)
+        self.assertFalse(os.path.exists(self.state_path))
+
+    def test_checksum_mismatch(self):
+        info = image_info()
+        info["fw_checksum"] = "00000000"
+        update = self.start(info)
+        _, states = self.serve()
+        self.assertEqual(update.error, "checksum mismatch")
+        self.assertEqual(states[-1], "FAILED")
+
+    # hashlib of some ports has no SHA384/SHA512
+    def test_algorithm_missing_from_hashlib(self):
+        info = image_info()
+        info["fw_checksum_algorithm"] = "SHA512"
+        with mock.patch.object(hashlib, "sha512"):
+            del hashlib.sha512
+            update = self.start(info)
+        _, states = self.serve()
+        self.assertTrue(update.done)
+        self.assertEqual(update.error, "checksum algorithm SHA512 not available on this port")
+        self.assertEqual(states, ["FAILED"])
+
+    def check_resume(self, algorithm):
+        update = self.start(image_info(algorithm))
+        self.serve(stop_after=2)
+        # Chunks 0 to 2 arrived, the checkpoint was taken after chunk 1
+        self.assertFalse(update.done)
+        self.assertEqual(update.received, 3 * CHUNK_SIZE)
+        with open(self.state_path) as f:
+            self.assertEqual(json.load(f)["offset"], 2 * CHUNK_SIZE)
+
+        # After a reboot the download continues at the checkpoint
+        update = self.start(image_info(algorithm))
+        self.assertEqual(update.received, 2 * CHUNK_SIZE)
+        requested, states = self.serve()
+        self.assertIsNone(update.error)
+        self.assertEqual(requested, [2, 3, 4, 5])
+        self.assertEqual(states, ["DOWNLOADING", "DOWNLOADED", "VERIFIED"])
+        self.assertEqual(bytes(self.flash), IMAGE)
+        self.assertFalse(os.path.exists(self.state_path))
+
+    def test_resume_crc32(self):
+        self.check_resume("CRC32")
+
+    def test_resume_sha256(self):
+        # Hash states cannot be saved, the part on flash is hashed again
+        self.check_resume("SHA256")
+
+    def test_other_image_starts_over(self):
+        update = self.start(image_info())
+        self.serve(stop_after=2)
+        self.flash[:] = b""
+        update = self.start(image_info(version="1.2"))
+        self.assertEqual(update.received, 0)
+        self.assertFalse(os.path.exists(self.state_path))
+        requested, _ = self.serve()
+        self.assertIsNone(update.error)
+        self.assertEqual(requested[0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+TBGatewayMqttClient: subscriptions and sub-device announcements on connect, attribute requests and updates, RPC
+requests and replies, and telemetry and attributes of sub-devices.
+"""
+
+import json
+import unittest
+from errno import ETIMEDOUT
+
+import support
+from thingsboard_sdk.tb_gateway_mqtt import TBGatewayMqttClient
+
+
+class GatewayTest(unittest.TestCase):
+    def setUp(self):
+        self.sockets = support.install_fake_socket()
+        self.gateway = TBGatewayMqttClient("broker.local", access_token="token")
+        self.assertTrue(self.gateway.connect())
+
+    def sent(self, topic):
+        return [json.loads(payload) for sent_topic, payload in support.publishes(self.sockets.last.written)
+                if sent_topic == topic]
+
+    def receive(self, topic, msg):
+        self.sockets.last.feed(support.publish_packet(topic, json.dumps(msg).encode()))
+        self.gateway.check_for_msg()
+
+    def test_subscribes_with_one_packet(self):
+        subscribes = [body for op, body in support.packets(self.sockets.last.written) if op & 0xF0 == 0x80]
+        self.assertEqual(len(subscribes), 1)
+        for topic in (b"v1/gateway/attributes", b"v1/gateway/attributes/response", b"v1/gateway/rpc"):
+            self.assertIn(topic, subscribes[0])
+
+    def test_devices_announced_again_on_reconnect(self):
+        self.gateway.gw_connect_device("A", "sensor")
+        self.gateway.gw_connect_device("B")
+        self.gateway.gw_disconnect_device("B")
+        self.assertEqual(self.sent("v1/gateway/disconnect"), [{"device": "B"}])
+        self.gateway.disconnect()
+        self.gateway.connect()
+        self.assertEqual(self.sent("v1/gateway/connect"), [{"device": "A", "type": "sensor"}])
+
+    def test_telemetry_and_attributes(self):
+        self.gateway.gw_send_telemetry("A", {"t": 1})
+        self.gateway.gw_send_telemetry("A", [{"ts": 5, "values": {"t": 2}}])
+        self.gateway.gw_send_attributes("A", {"fw": "1.0"})
+        (first, second) = self.sent("v1/gateway/telemetry")
+        self.assertEqual(first["A"][0]["values"], {"t": 1})
+        self.assertIn("ts", first["A"][0])
+        self.assertEqual(second, {"A": [{"ts": 5, "values": {"t": 2}}]})
+        self.assertEqual(self.sent("v1/gateway/attributes"), [{"A": {"fw": "1.0"}}])
+
+    def test_attribute_request(self):
+        results = []
+        request_id = self.gateway.gw_request_attributes("A", ["mode"], callback=lambda *args: results.append(args))
+        self.assertEqual(self.sent("v1/gateway/attributes/request"),
+                         [{"id": request_id, "device": "A", "client": False, "keys": ["mode"]}])
+        response = {"id": request_id, "device": "A", "value": "auto"}
+        self.receive(b"v1/gateway/attributes/response", response)
+        self.assertEqual(results, [(response, None)])
+        self.assertEqual(len(self.gateway._attr_requests), 0)
+
+    def test_attribute_request_timeout(self):
+        results = []
+        self.gateway.gw_request_attributes("A", ["mode"], callback=lambda *args: results.append(args), timeout=0)
+        self.gateway.check_for_msg()
+        ((response, error),) = results
+        self.assertIsNone(response)
+        self.assertEqual(error.args[0], ETIMEDOUT)
+
+    def test_rpc(self):
+        requests = []
+        self.gateway.gw_set_server_side_rpc_request_handler(lambda *args: requests.append(args))
+        self.receive(b"v1/gateway/rpc", {"device": "A", "data": {"id": 7, "method": "reboot", "params": {}}})
+        self.assertEqual(requests, [("A", 7, {"method": "reboot", "params": {}})])
+        self.gateway.gw_send_rpc_reply("A", 7, {"ok": True})
+        self.assertEqual(self.sent("v1/gateway/rpc"), [{"device": "A", "id": 7, "data": {"ok": True}}])
+
+    def test_attribute_update(self):
+        updates = []
+        self.gateway.gw_set_attributes_update_handler(lambda *args: updates.append(args))
+        self.receive(b"v1/gateway/attributes", {"device": "A", "data": {"interval": 60}})
+        self.assertEqual(updates, [("A", {"interval": 60})])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+Metrics counters and histograms as filled in by MQTTClient and MQTTClientAsync, including publishes taken out of
+the in-flight window before their PUBACK.
+"""
+
+import unittest
+
+import support
+from thingsboard_sdk.metrics import Histogram, Metrics
+
+
+def broken_write(buf, n=None):
+    raise OSError(104)
+
+
+class HistogramTest(unittest.TestCase):
+    def test_buckets(self):
+        histogram = Histogram((10, 100))
+        for value in (1, 10, 11, 500):
+            histogram.observe(value)
+        self.assertEqual(histogram.as_dict("x"), {"x_count": 4, "x_sum": 522, "x_max": 500, "x_le_10": 2,
+                                                  "x_le_100": 1, "x_le_inf": 1})
+
+
+class ClientMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.client, self.sock = support.connect(max_inflight=4)
+        self.metrics = self.client.metrics = Metrics()
+
+    def test_packets_and_puback(self):
+        self.client.publish("t", b"abc", qos=1)
+        self.assertEqual(self.metrics.counters["tx_publish"], 1)
+        self.assertEqual(self.metrics.counters["tx_publish_bytes"], 10)
+        self.client.wait_msg()
+        result = self.metrics.as_dict()
+        self.assertEqual(result["rx_puback"], 1)
+        self.assertEqual(result["puback_ms_count"], 1)
+        self.assertEqual(self.metrics._puback_start, {})
+
+    def test_discarded_publish(self):
+        self.sock.respond = False
+        pid = self.client.publish("t", b"abc", qos=1)
+        self.client.discard(pid)
+        self.assertEqual(self.client.inflight, {})
+        self.assertEqual(self.metrics._puback_start, {})
+        self.assertEqual(self.metrics.as_dict()["puback_ms_count"], 0)
+
+
+class GatewayMetricsTest(unittest.TestCase):
+    def test_failed_batch_publish(self):
+        from thingsboard_sdk.tb_gateway_mqtt import TBGatewayMqttClient
+
+        sockets = support.install_fake_socket()
+        gateway = TBGatewayMqttClient("broker.local", access_token="token")
+        gateway.connect()
+        metrics = gateway._client.metrics = Metrics()
+        gateway.enable_telemetry_batching(max_samples=1)
+        sockets.last.write = broken_write
+        gateway.gw_send_telemetry("A", {"n": 0})
+        self.assertFalse(gateway.connected)
+        self.assertEqual(metrics._puback_start, {})
+
+
+class DeviceMetricsTest(unittest.TestCase):
+    def test_failed_batch_publish(self):
+        support.require_sdk_core()
+        from thingsboard_sdk.tb_device_mqtt import TBDeviceMqttClient
+
+        sockets = support.install_fake_socket()
+        client = TBDeviceMqttClient("broker.local", access_token="token")
+        client.connect()
+        client.enable_metrics()
+        client.enable_telemetry_batching(max_samples=1)
+        sockets.last.write = broken_write
+        client.send_telemetry({"n": 0})
+        self.assertFalse(client.connected)
+        self.assertEqual(client._client.metrics._puback_start, {})
+
+
+class AsyncClientMetricsTest(unittest.TestCase):
+    def test_publish(self):
+        try:
+            from thingsboard_sdk.umqtt_async import MQTTClientAsync
+        except ImportError:
+            raise unittest.SkipTest("uasyncio is not available")
+
+        client = MQTTClientAsync("test", "broker.local")
+        client.sock = support.FakeSocket(respond=False)
+        metrics = client.metrics = Metrics()
+        pid = client.publish("t", b"abc", qos=1)
+        self.assertEqual(list(metrics._puback_start), [pid])
+        self.assertEqual(metrics.counters["tx_publish"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+"""
+OfflineQueue: segment rotation, commit of what was peeked, resuming at the persisted cursor after a reopen and the
+bound on the number of segments; and TBDeviceMqttClient storing while offline and draining in order.
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+import support
+from thingsboard_sdk.offline_queue import OfflineQueue
+
+
+class OfflineQueueTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, "queue")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.path) if name.endswith(".seg"))
+
+    def fill(self, queue, n, start=0):
+        for i in range(start, start + n):
+            queue.put("v1/devices/me/telemetry", '{"n": %d}' % i)
+
+    def numbers(self, records):
+        return [int(payload[6:-1]) for _, payload in records]
+
+    def test_empty(self):
+        queue = OfflineQueue(self.path)
+        self.assertFalse(queue)
+        self.assertEqual(queue.peek(), [])
+        queue.commit()
+        self.assertFalse(queue)
+
+    def test_peek_without_commit_returns_the_same_records(self):
+        queue = OfflineQueue(self.path)
+        queue.put("v1/devices/me/attributes", '{"a": "with spaces"}')
+        self.fill(queue, 2)
+        records = queue.peek(10)
+        self.assertEqual(records[0], ("v1/devices/me/attributes", '{"a": "with spaces"}'))
+        self.assertEqual(queue.peek(10), records)
+        self.assertTrue(queue)
+
+    def test_rotate_and_commit(self):
+        queue = OfflineQueue(self.path, segment_size=40)
+        self.fill(queue, 10)
+        # Every record is 35 bytes, so a segment holds two of them
+        self.assertEqual(self.segments(), ["%08d.seg" % i for i in range(5)])
+        self.assertEqual(self.numbers(queue.peek(3)), [0, 1, 2])
+        queue.commit()
+        # Segments consumed completely are deleted on commit
+        self.assertEqual(self.segments()[0], "00000001.seg")
+        self.assertEqual(self.numbers(queue.peek(5)), [3, 4, 5, 6, 7])
+        queue.commit()
+        # The cursor is at the end of segment 3 until the next peek moves on
+        self.assertEqual(self.segments()[0], "00000003.seg")
+        self.assertEqual(self.numbers(queue.peek(10)), [8, 9])
+        queue.commit()
+        self.assertFalse(queue)
+        self.assertEqual(self.segments(), [])
+        self.fill(queue, 1, 10)
+        self.assertEqual(self.numbers(queue.peek(10)), [10])
+
+    def test_reopen_continues_at_the_committed_cursor(self):
+        queue = OfflineQueue(self.path, segment_size=40)
+        self.fill(queue, 5)
+        queue.peek(3)
+        queue.commit()
+        # Sent but not acknowledged when the device rebooted
+        queue.peek(1)
+        queue = OfflineQueue(self.path, segment_size=40)
+        self.assertEqual(self.numbers(queue.peek(10)), [3, 4])
+        # Appending continues after the last record
+        self.fill(queue, 2, 5)
+        queue = OfflineQueue(self.path, segment_size=40)
+        self.assertEqual(self.numbers(queue.peek(10)), [3, 4, 5, 6])
+        queue.commit()
+        self.assertFalse(OfflineQueue(self.path, segment_size=40))
+
+    def test_oldest_segment_is_dropped_when_full(self):
+        queue = OfflineQueue(self.path, segment_size=40, max_segments=3)
+        self.fill(queue, 10)
+        self.assertEqual(len(self.segments()), 3)
+        self.assertEqual(self.numbers(queue.peek(20)), [4, 5, 6, 7, 8, 9])
+        # The records peeked above were partly dropped meanwhile, the
+        # commit must not skip the ones that were not
+        self.fill(queue, 2, 10)
+        queue.commit()
+        self.assertEqual(self.numbers(queue.peek(20)), [6, 7, 8, 9, 10, 11])
+
+
+class DeviceOfflineQueueTest(unittest.TestCase):
+    def setUp(self):
+        support.require_sdk_core()
+        from thingsboard_sdk.tb_device_mqtt import TBDeviceMqttClient
+
+        self._dir = tempfile.TemporaryDirectory()
+        self.sockets = support.install_fake_socket()
+        self.client = TBDeviceMqttClient("broker.local", access_token="token")
+        self.client.enable_offline_queue(os.path.join(self._dir.name, "queue"), drain_batch=2)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def sent_attributes(self):
+        return [json.loads(payload)["n"] for topic, payload in support.publishes(self.sockets.last.written)
+                if topic == "v1/devices/me/attributes"]
+
+    def test_live_messages_wait_behind_stored_ones(self):
+        for n in range(5):
+            self.client.send_attributes({"n": n})
+        self.client.connect()
+        # The first batch went out on connect, the rest is still stored
+        self.assertEqual(self.sent_attributes(), [0, 1])
+        self.client.send_attributes({"n": 5})
+        for _ in range(5):
+            self.client.check_for_msg()
+        self.assertEqual(self.sent_attributes(), [0, 1, 2, 3, 4, 5])
+        self.assertFalse(self.client._offline_queue)
+        # With the queue empty again messages go out directly
+        self.client.send_attributes({"n": 6})
+        self.assertEqual(self.sent_attributes()[-1], 6)
+
+    def test_stored_telemetry_is_drained_as_one_array(self):
+        self.client.send_telemetry({"t": 1})
+        self.client.send_telemetry({"t": 2})
+        self.client.connect()
+        (topic, payload), = support.publishes(self.sockets.last.written)
+        self.assertEqual(topic, "v1/devices/me/telemetry")
+        self.assertEqual([sample["values"] for sample in json.loads(payload)], [{"t": 1}, {"t": 2}])
+
+
+if __name__ == "__main__":
+    unittest.main()
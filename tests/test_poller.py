@@ -0,0 +1,197 @@
+"""
+Poller serving several connections from one thread: readable sockets, packets already buffered by the client or the
+TLS layer, keepalives, failed connections and sockets replaced by a reconnect.
+"""
+
+import socket
+import time
+import unittest
+
+import support
+import upy_shim
+from thingsboard_sdk import umqtt
+from thingsboard_sdk.poller import Poller
+
+
+# One end of a socket pair, so that it polls readable when the test
+# writes to the other end, the broker's. What the client sends is answered
+# there the way support.FakeSocket answers it.
+class PairSocket(upy_shim.Socket):
+    def __init__(self, *args):
+        self._sock, self.peer = socket.socketpair()
+        self._broker = support.FakeSocket()
+
+    def connect(self, addr):
+        pass
+
+    def write(self, buf, n=None):
+        n = super().write(buf, n)
+        broker = self._broker
+        broker.write(buf, n)
+        if broker.pending():
+            self.peer.sendall(broker.read(broker.pending()))
+        return n
+
+    # Packets the client sent, see support.packets()
+    def sent(self):
+        self.peer.setblocking(False)
+        try:
+            return support.packets(self.peer.recv(4096))
+        except BlockingIOError:
+            return []
+        finally:
+            self.peer.setblocking(True)
+
+
+class PollerTest(unittest.TestCase):
+    def setUp(self):
+        self.sockets = support.install_fake_socket(PairSocket)
+        self.poller = Poller(housekeeping_ms=60000)
+        self.received = []
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.sock.close()
+            client.sock.peer.close()
+
+    def connect(self, name, **kwargs):
+        client = umqtt.MQTTClient(name, "broker.local", **kwargs)
+        client.set_callback(lambda topic, msg: self.received.append((name, bytes(topic), bytes(msg))))
+        client.connect()
+        client.sock.sent()
+        self.clients.append(client)
+        return client
+
+    def test_idle(self):
+        self.poller.register(self.connect("a"))
+        t = time.monotonic()
+        self.assertEqual(self.poller.poll(50), 0)
+        self.assertGreaterEqual(time.monotonic() - t, 0.04)
+
+    def test_only_readable_served(self):
+        a = self.connect("a")
+        b = self.connect("b")
+        self.poller.register(a)
+        self.poller.register(b)
+        b.sock.peer.sendall(support.publish_packet(b"t", b"1"))
+        self.assertEqual(self.poller.poll(1000), 1)
+        self.assertEqual(self.received, [("b", b"t", b"1")])
+        self.assertEqual(len(self.poller), 2)
+
+    def test_buffered_packets_handled_together(self):
+        a = self.connect("a")
+        self.poller.register(a)
+        a.sock.peer.sendall(support.publish_packet(b"t", b"1") + support.publish_packet(b"t", b"2"))
+        self.poller.poll(1000)
+        self.assertEqual([msg for name, topic, msg in self.received], [b"1", b"2"])
+
+    def test_partial_packet_waits(self):
+        a = self.connect("a")
+        self.poller.register(a)
+        packet = support.publish_packet(b"t", b"payload")
+        a.sock.peer.sendall(packet + packet[:4])
+        self.poller.poll(1000)
+        self.assertEqual(len(self.received), 1)
+        a.sock.peer.sendall(packet[4:])
+        self.poller.poll(1000)
+        self.assertEqual(len(self.received), 2)
+
+    def test_keepalive(self):
+        a = self.connect("a", keepalive=1)
+        self.poller.register(a)
+        a._last_tx = a._last_rx = time.ticks_add(time.ticks_ms(), -2000)
+        self.poller.poll(0)
+        self.assertEqual(a.sock.sent(), [(0xC0, b"")])
+        self.poller.poll(1000)
+        self.assertIsNone(a._ping_sent)
+
+    def test_unregister(self):
+        a = self.connect("a")
+        self.poller.register(a)
+        self.poller.unregister(a)
+        a.sock.peer.sendall(support.publish_packet(b"t", b"1"))
+        self.assertEqual(self.poller.poll(0), 0)
+        self.assertEqual(len(self.poller), 0)
+
+    def test_failed_connection(self):
+        errors = []
+        a = self.connect("a")
+        b = self.connect("b")
+        self.poller.register(a, on_error=lambda client, error: errors.append(client))
+        self.poller.register(b)
+        a.sock.peer.close()
+        self.poller.poll(1000)
+        self.assertEqual(errors, [a])
+        # No longer polled, so b is served
+        b.sock.peer.sendall(support.publish_packet(b"t", b"1"))
+        self.assertEqual(self.poller.poll(1000), 1)
+        self.assertEqual(self.received, [("b", b"t", b"1")])
+
+    def test_error_raised_without_handler(self):
+        a = self.connect("a")
+        self.poller.register(a)
+        a.sock.peer.close()
+        with self.assertRaises(OSError):
+            self.poller.poll(1000)
+        self.assertEqual(self.poller.poll(0), 0)
+
+
+class BufferedSocketTest(unittest.TestCase):
+    # Bytes the socket holds do not make it poll readable, like decrypted
+    # bytes held by a TLS socket; pending() tells about them
+    def test_pending_bytes(self):
+        received = []
+        client, sock = support.connect(lambda topic, msg: received.append(bytes(msg)))
+        poller = Poller()
+        poller.register(client)
+        sock.feed(support.publish_packet(b"t", b"1"))
+        self.assertEqual(poller.poll(0), 1)
+        self.assertEqual(received, [b"1"])
+
+    # A whole packet in the client's receive buffer, read along with an
+    # earlier one
+    def test_msg_buffered(self):
+        received = []
+        client, sock = support.connect(lambda topic, msg: received.append(bytes(msg)))
+        sock.feed(support.publish_packet(b"t", b"1") + support.publish_packet(b"t", b"2"))
+        client.wait_msg()
+        sock.pending = lambda: 0
+        poller = Poller()
+        poller.register(client)
+        self.assertEqual(poller.poll(0), 1)
+        self.assertEqual(received, [b"1", b"2"])
+
+
+class ReconnectTest(unittest.TestCase):
+    def test_new_socket_picked_up(self):
+        from thingsboard_sdk.tb_gateway_mqtt import TBGatewayMqttClient
+
+        sockets = support.install_fake_socket(PairSocket)
+        gateway = TBGatewayMqttClient("broker.local", access_token="token")
+        gateway.connect()
+        gateway.enable_auto_reconnect(min_delay_ms=0)
+        first = sockets.last
+        poller = Poller(housekeeping_ms=10)
+        poller.register(gateway)
+        first.peer.close()
+        poller.poll(1000)
+        self.assertFalse(gateway.connected)
+        while not gateway.connected:
+            poller.poll(100)
+        second = sockets.last
+        self.assertIsNot(second, first)
+        received = []
+        gateway.gw_set_server_side_rpc_request_handler(lambda device, request_id, request: received.append(device))
+        second.sent()
+        second.peer.sendall(support.publish_packet(b"v1/gateway/rpc", b'{"device": "A", "data": {"id": 1}}'))
+        # Handled when readable or by the housekeeping check_for_msg()
+        poller.poll(1000)
+        self.assertEqual(received, ["A"])
+        for sock in (first, second):
+            sock.close()
+        second.peer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
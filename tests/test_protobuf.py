@@ -0,0 +1,86 @@
+"""
+protobuf.Message: the documented wire format and encode/decode round trips of scalar, nested and repeated fields.
+"""
+
+import unittest
+
+import support  # noqa: F401
+from thingsboard_sdk import protobuf
+from thingsboard_sdk.protobuf import Message
+
+SCALARS = {
+    "i32": (1, "int32"), "i64": (2, "int64"), "u32": (3, "uint32"), "u64": (4, "uint64"),
+    "s32": (5, "sint32"), "s64": (6, "sint64"), "flag": (7, "bool"), "kind": (8, "enum"),
+    "d": (9, "double"), "f": (10, "float"), "name": (11, "string"), "blob": (12, "bytes"),
+}
+
+
+class MessageTest(unittest.TestCase):
+    def test_wire_format(self):
+        # The examples from the protobuf encoding documentation
+        self.assertEqual(Message({"a": (1, "int32")}).encode({"a": 150}), b"\x08\x96\x01")
+        self.assertEqual(Message({"b": (2, "string")}).encode({"b": "testing"}), b"\x12\x07testing")
+        self.assertEqual(Message({"f": (4, ["int32"])}).encode({"f": [1, 2, 3]}), b"\x22\x03\x01\x02\x03")
+
+    def test_scalar_round_trip(self):
+        message = Message(SCALARS)
+        values = {
+            "i32": -5, "i64": -(1 << 40), "u32": 0xFFFFFFFF, "u64": (1 << 64) - 1, "s32": -1, "s64": -(1 << 62),
+            "flag": True, "kind": 3, "d": -2.5, "f": 0.5, "name": "Grüße", "blob": b"\x00\xff",
+        }
+        self.assertEqual(message.decode(message.encode(values)), values)
+
+    def test_float_precision(self):
+        message = Message({"f": (1, "float")})
+        self.assertAlmostEqual(message.decode(message.encode({"f": 21.7}))["f"], 21.7, places=5)
+
+    def test_missing_fields_are_not_sent(self):
+        message = Message(SCALARS)
+        self.assertEqual(message.encode({}), b"")
+        self.assertEqual(message.decode(message.encode({"i32": 0, "name": None})), {"i32": 0})
+
+    def test_nested_and_repeated(self):
+        message = Message({
+            "ts": (1, "int64"),
+            "values": (2, [{"key": (1, "string"), "value": (2, "double")}]),
+            "tags": (3, ["string"]),
+            "samples": (4, ["sint32"]),
+            "origin": (5, {"lat": (1, "double"), "lon": (2, "double")}),
+        })
+        values = {
+            "ts": 1700000000000,
+            "values": [{"key": "temperature", "value": 21.5}, {"key": "humidity", "value": 40.0}],
+            "tags": ["a", "", "c"],
+            "samples": [0, -1, 1, -300],
+            "origin": {"lat": 50.45, "lon": 30.52},
+        }
+        self.assertEqual(message.decode(message.encode(values)), values)
+
+    def test_unknown_fields_are_skipped(self):
+        encoded = Message(SCALARS).encode({"i64": 7, "d": 1.0, "name": "x", "f": 2.0, "u32": 9})
+        self.assertEqual(Message({"name": (11, "string"), "u32": (3, "uint32")}).decode(encoded),
+                         {"name": "x", "u32": 9})
+
+    def test_decode_slice(self):
+        message = Message({"a": (1, "int32")})
+        buf = b"junk" + message.encode({"a": 1}) + b"more"
+        self.assertEqual(message.decode(memoryview(buf), 4, len(buf) - 4), {"a": 1})
+
+    def test_attributes_response(self):
+        message = Message(protobuf.ATTRIBUTES_RESPONSE)
+        response = message.decode(message.encode({
+            "requestId": 3,
+            "sharedAttributeList": [
+                {"ts": 1, "kv": {"key": "fw_version", "type": 3, "string_v": "1.2"}},
+                {"ts": 1, "kv": {"key": "interval", "type": 1, "long_v": 60}},
+                {"ts": 1, "kv": {"key": "enabled", "type": 0}},
+                {"ts": 1, "kv": {"key": "config", "type": 4, "json_v": '{"a": [1]}'}},
+            ],
+        }))
+        self.assertEqual(response["requestId"], 3)
+        self.assertEqual(protobuf.kv_dict(response["sharedAttributeList"]),
+                         {"fw_version": "1.2", "interval": 60, "enabled": False, "config": {"a": [1]}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+Backoff delays, and ClientLoop reconnecting by itself once auto reconnect is enabled.
+"""
+
+import unittest
+from errno import ECONNREFUSED
+from unittest import mock
+
+import support
+from thingsboard_sdk.reconnect import Backoff
+
+
+class BackoffTest(unittest.TestCase):
+    def test_first_attempt_within_min(self):
+        for _ in range(20):
+            self.assertLessEqual(Backoff(500, 8000).wait_ms(), 500)
+
+    def test_schedule_is_kept(self):
+        backoff = Backoff(0, 8000)
+        backoff.failed()
+        first = backoff.wait_ms()
+        self.assertLessEqual(backoff.wait_ms(), first)
+
+    def test_delay_doubles_with_equal_jitter(self):
+        backoff = Backoff(1000, 8000)
+        delays = []
+        for _ in range(6):
+            backoff.failed()
+            delays.append(backoff.wait_ms())
+        self.assertEqual(backoff.attempts, 6)
+        for delay, full in zip(delays, (1000, 2000, 4000, 8000, 8000, 8000)):
+            self.assertTrue(full // 2 - 5 <= delay <= full, (delay, full))
+
+    def test_reset(self):
+        backoff = Backoff(0, 8000)
+        for _ in range(3):
+            backoff.failed()
+        backoff.reset()
+        self.assertEqual(backoff.attempts, 0)
+        self.assertEqual(backoff.wait_ms(), 0)
+
+
+class RefusingSocket(support.FakeSocket):
+    def connect(self, addr):
+        raise OSError(ECONNREFUSED)
+
+
+class AutoReconnectTest(unittest.TestCase):
+    def setUp(self):
+        from thingsboard_sdk.tb_gateway_mqtt import TBGatewayMqttClient
+
+        self.sockets = support.install_fake_socket()
+        self.gateway = TBGatewayMqttClient("broker.local", access_token="token")
+        self.gateway.connect()
+
+    def drop_link(self):
+        self.sockets.last.readinto = lambda buf, n=None: 0
+
+    def test_without_auto_reconnect(self):
+        self.drop_link()
+        with self.assertRaises(OSError):
+            self.gateway.check_for_msg()
+        self.assertFalse(self.gateway.connected)
+
+    def test_reconnects(self):
+        self.gateway.enable_auto_reconnect(min_delay_ms=0)
+        first = self.sockets.last
+        self.drop_link()
+        self.gateway.check_for_msg()
+        self.assertFalse(self.gateway.connected)
+        self.gateway.check_for_msg()
+        self.assertTrue(self.gateway.connected)
+        self.assertIsNot(self.sockets.last, first)
+        self.assertEqual(self.gateway._backoff.attempts, 0)
+
+    # Without jitter the first attempt is made right away and the next
+    # one after half the minimum delay
+    @mock.patch("thingsboard_sdk.reconnect.getrandbits", return_value=0)
+    def test_failed_attempt_backs_off(self, getrandbits):
+        self.gateway.enable_auto_reconnect(min_delay_ms=1000)
+        self.drop_link()
+        self.gateway.check_for_msg()
+        self.sockets.factory = RefusingSocket
+        self.gateway.check_for_msg()
+        self.assertFalse(self.gateway.connected)
+        self.assertEqual(self.gateway._backoff.attempts, 1)
+        self.assertTrue(450 <= self.gateway._backoff.wait_ms() <= 500)
+        self.gateway.check_for_msg()
+        self.assertEqual(self.gateway._backoff.attempts, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+ReportFilter deadbands and full reports, and report-by-exception in TBDeviceMqttClient.
+"""
+
+import json
+import time
+import unittest
+
+import support
+from thingsboard_sdk.report_filter import ReportFilter
+
+
+class ReportFilterTest(unittest.TestCase):
+    def test_first_values_reported(self):
+        report = ReportFilter()
+        self.assertEqual(report.filter({"a": 1, "b": "x"}), {"a": 1, "b": "x"})
+        self.assertEqual(report.filter({"a": 1, "b": "x"}), {})
+
+    def test_absolute_deadband(self):
+        report = ReportFilter({"t": 0.5})
+        report.filter({"t": 20.0})
+        self.assertEqual(report.filter({"t": 20.4}), {})
+        # Measured against the last reported value, so slow drift is reported too
+        self.assertEqual(report.filter({"t": 20.6}), {"t": 20.6})
+        self.assertEqual(report.filter({"t": 20.0}), {"t": 20.0})
+
+    def test_percent_deadband(self):
+        report = ReportFilter({"p": "10%"})
+        report.filter({"p": 200})
+        self.assertEqual(report.filter({"p": 219}), {})
+        self.assertEqual(report.filter({"p": 179}), {"p": 179})
+
+    def test_any_change_without_deadband(self):
+        report = ReportFilter({"t": 1})
+        report.filter({"n": 1, "s": "on", "t": 5})
+        self.assertEqual(report.filter({"n": 2, "s": "off", "t": 5}), {"n": 2, "s": "off"})
+
+    def test_full_report(self):
+        report = ReportFilter(full_report_ms=20)
+        report.filter({"a": 1, "b": 2})
+        time.sleep(0.03)
+        self.assertEqual(report.filter({"a": 1}), {"a": 1, "b": 2})
+        self.assertEqual(report.filter({"a": 1}), {})
+
+    def test_reset(self):
+        report = ReportFilter()
+        report.filter({"a": 1})
+        report.reset()
+        self.assertEqual(report.filter({"a": 1}), {"a": 1})
+
+
+class DeviceReportByExceptionTest(unittest.TestCase):
+    def setUp(self):
+        support.require_sdk_core()
+        from thingsboard_sdk.tb_device_mqtt import TBDeviceMqttClient
+
+        self.sockets = support.install_fake_socket()
+        self.client = TBDeviceMqttClient("broker.local", access_token="token")
+        self.client.connect()
+        self.client.enable_report_by_exception({"t": 1})
+
+    def sent(self, topic):
+        return [json.loads(payload) for sent_topic, payload in support.publishes(self.sockets.last.written)
+                if sent_topic == topic]
+
+    def test_telemetry(self):
+        self.client.send_telemetry({"t": 20})
+        self.client.send_telemetry({"t": 20.5})
+        self.client.send_telemetry({"ts": 5, "values": {"t": 22}})
+        self.assertEqual(self.sent("v1/devices/me/telemetry"), [{"t": 20}, {"ts": 5, "values": {"t": 22}}])
+
+    def test_attributes(self):
+        self.client.send_attributes({"mode": "a"})
+        self.client.send_attributes({"mode": "a"})
+        self.client.send_attributes({"mode": "b"})
+        self.assertEqual(self.sent("v1/devices/me/attributes"), [{"mode": "a"}, {"mode": "b"}])
+
+    def test_disable(self):
+        self.client.send_telemetry({"t": 20})
+        self.client.disable_report_by_exception()
+        self.client.send_telemetry({"t": 20})
+        self.assertEqual(len(self.sent("v1/devices/me/telemetry")), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
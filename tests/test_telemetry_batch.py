@@ -0,0 +1,206 @@
+"""
+TelemetryBatch and GatewayTelemetryBatch: payloads within the limits, trimming and putting samples back; and the
+device and gateway clients keeping batched samples while they cannot be sent. TelemetryTemplate rendering and
+send_telemetry_values().
+"""
+
+import json
+import unittest
+
+import support
+from thingsboard_sdk.telemetry_batch import GatewayTelemetryBatch, TelemetryBatch, TelemetryTemplate
+
+
+def values(payload):
+    return [sample["values"]["n"] for sample in json.loads(payload)]
+
+
+def broken_write(buf, n=None):
+    raise OSError(104)
+
+
+class TelemetryBatchTest(unittest.TestCase):
+    def test_due_at_sample_limit(self):
+        batch = TelemetryBatch(max_samples=3, max_age_ms=60000)
+        self.assertFalse(batch.add({"n": 0}))
+        self.assertFalse(batch.add({"n": 1}, ts=5))
+        self.assertTrue(batch.add({"n": 2}))
+        samples = json.loads(batch.take())
+        self.assertEqual([sample["values"]["n"] for sample in samples], [0, 1, 2])
+        self.assertEqual(samples[1]["ts"], 5)
+        self.assertFalse(batch)
+
+    def test_take_within_max_bytes(self):
+        batch = TelemetryBatch(max_bytes=60, max_age_ms=60000)
+        for n in range(5):
+            batch.add({"ts": 1, "values": {"n": n}})
+        payloads = []
+        while batch:
+            payloads.append(batch.take())
+        self.assertTrue(all(len(payload) <= 60 for payload in payloads))
+        self.assertEqual(sum((values(payload) for payload in payloads), []), [0, 1, 2, 3, 4])
+
+    def test_trim_keeps_latest(self):
+        batch = TelemetryBatch(max_samples=2)
+        for n in range(5):
+            batch.add({"n": n})
+        self.assertEqual(batch.trim(), 3)
+        self.assertEqual(values(batch.take()), [3, 4])
+
+    def test_restore(self):
+        batch = TelemetryBatch(max_bytes=60, max_age_ms=60000)
+        for n in range(3):
+            batch.add({"ts": 1, "values": {"n": n}})
+        payload = batch.take()
+        batch.add({"ts": 1, "values": {"n": 3}})
+        batch.restore(payload)
+        taken = []
+        while batch:
+            taken += values(batch.take())
+        self.assertEqual(taken, [0, 1, 2, 3])
+        self.assertEqual(batch._size, 1)
+
+
+class GatewayTelemetryBatchTest(unittest.TestCase):
+    def test_devices_share_a_payload(self):
+        batch = GatewayTelemetryBatch(max_age_ms=60000)
+        batch.add("A", {"n": 0})
+        batch.add("B", [{"n": 1}, {"n": 2}])
+        payload = json.loads(batch.take())
+        self.assertEqual({device: [s["values"]["n"] for s in samples] for device, samples in payload.items()},
+                         {"A": [0], "B": [1, 2]})
+
+    def test_trim_and_restore(self):
+        batch = GatewayTelemetryBatch(max_samples=2)
+        for n in range(3):
+            batch.add("A", {"n": n})
+        self.assertEqual(batch.trim(), 1)
+        payload = batch.take()
+        batch.add("B", {"n": 3})
+        batch.restore(payload)
+        self.assertEqual(len(batch), 3)
+        restored = json.loads(batch.take())
+        self.assertEqual([s["values"]["n"] for s in restored["A"]], [1, 2])
+        self.assertEqual(batch._size, 2)
+
+
+class GatewayBatchingTest(unittest.TestCase):
+    def setUp(self):
+        from thingsboard_sdk.tb_gateway_mqtt import TBGatewayMqttClient
+
+        self.sockets = support.install_fake_socket()
+        self.gateway = TBGatewayMqttClient("broker.local", access_token="token")
+        self.gateway.enable_telemetry_batching(max_samples=2, max_age_ms=60000)
+
+    def sent(self):
+        return [[s["values"]["n"] for s in json.loads(payload)["A"]]
+                for topic, payload in support.publishes(self.sockets.last.written)
+                if topic == "v1/gateway/telemetry"]
+
+    def test_kept_before_connect(self):
+        for n in range(5):
+            self.gateway.gw_send_telemetry("A", {"n": n})
+        self.gateway.connect()
+        self.gateway.flush_telemetry()
+        self.assertEqual(self.sent(), [[3, 4]])
+
+    def test_kept_after_link_drop(self):
+        self.gateway.connect()
+        self.sockets.last.write = broken_write
+        self.gateway.gw_send_telemetry("A", {"n": 0})
+        self.gateway.gw_send_telemetry("A", {"n": 1})
+        self.assertFalse(self.gateway.connected)
+        self.assertEqual(len(self.gateway._telemetry_batch), 2)
+        self.gateway.connect()
+        self.gateway.flush_telemetry()
+        self.assertEqual(self.sent(), [[0, 1]])
+
+    def test_disable_while_disconnected(self):
+        self.gateway.gw_send_telemetry("A", {"n": 0})
+        self.gateway.disable_telemetry_batching()
+        self.gateway.connect()
+        self.gateway.check_for_msg()
+        self.assertEqual(self.sent(), [[0]])
+        self.assertIsNone(self.gateway._telemetry_batch)
+
+
+class DeviceBatchingTest(unittest.TestCase):
+    def setUp(self):
+        support.require_sdk_core()
+        from thingsboard_sdk.tb_device_mqtt import TBDeviceMqttClient
+
+        self.sockets = support.install_fake_socket()
+        self.client = TBDeviceMqttClient("broker.local", access_token="token")
+        self.client.enable_telemetry_batching(max_samples=2, max_age_ms=60000)
+
+    def sent(self):
+        return [values(payload) for topic, payload in support.publishes(self.sockets.last.written)
+                if topic == "v1/devices/me/telemetry"]
+
+    def test_kept_before_connect(self):
+        for n in range(5):
+            self.client.send_telemetry({"n": n})
+        self.client.connect()
+        self.client.flush_telemetry()
+        self.assertEqual(self.sent(), [[3, 4]])
+
+    def test_kept_after_link_drop(self):
+        self.client.connect()
+        self.sockets.last.write = broken_write
+        self.client.send_telemetry({"n": 0})
+        self.client.send_telemetry({"n": 1})
+        self.assertFalse(self.client.connected)
+        self.assertEqual(self.client._client.inflight, {})
+        self.client.connect()
+        self.client.flush_telemetry()
+        self.assertEqual(self.sent(), [[0, 1]])
+
+    def test_disable_while_disconnected(self):
+        self.client.send_telemetry({"n": 0})
+        self.client.disable_telemetry_batching()
+        self.client.connect()
+        self.client.check_for_msg()
+        self.assertEqual(self.sent(), [[0]])
+        self.assertIsNone(self.client._telemetry_batch)
+
+
+class TelemetryTemplateTest(unittest.TestCase):
+    def test_render(self):
+        template = TelemetryTemplate(("t", "on", "name", "none", "n"))
+        values = (21.5, True, 'a "b"', None, -3)
+        self.assertEqual(json.loads(bytes(template.render(values))), dict(zip(template.keys, values)))
+
+    def test_buffer_grows(self):
+        template = TelemetryTemplate(("s",), size=4)
+        self.assertEqual(bytes(template.render(("x" * 100,))), b'{"s":"' + b"x" * 100 + b'"}')
+        self.assertEqual(bytes(template.render((1,))), b'{"s":1}')
+
+
+class TelemetryValuesTest(unittest.TestCase):
+    def setUp(self):
+        support.require_sdk_core()
+        from thingsboard_sdk.tb_device_mqtt import TBDeviceMqttClient
+
+        self.sockets = support.install_fake_socket()
+        self.client = TBDeviceMqttClient("broker.local", access_token="token")
+        self.client.connect()
+        self.template = self.client.telemetry_template("t", "h")
+
+    def sent(self):
+        return [json.loads(payload) for topic, payload in support.publishes(self.sockets.last.written)
+                if topic == "v1/devices/me/telemetry"]
+
+    def test_rendered_payload(self):
+        self.client.send_telemetry_values(self.template, 21.5, 40)
+        self.assertEqual(self.sent(), [{"t": 21.5, "h": 40}])
+
+    def test_batched(self):
+        self.client.enable_telemetry_batching(max_samples=2)
+        self.client.send_telemetry_values(self.template, 1, 2)
+        self.client.send_telemetry_values(self.template, 3, 4)
+        (samples,) = self.sent()
+        self.assertEqual([sample["values"] for sample in samples], [{"t": 1, "h": 2}, {"t": 3, "h": 4}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,337 @@
+"""
+MQTTClient packet framing against the fake socket, and timed reads over TLS through the ussl stand-in,
+whose socket has no settimeout() just like MicroPython's.
+"""
+
+import support  # noqa: F401  (installs the MicroPython stand-ins)
+
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from errno import ETIMEDOUT
+
+import usocket
+from support import FakeSocket, connect, publish_packet
+from thingsboard_sdk import umqtt
+
+
+# Hands out at most chunk bytes per read, as a slow network would
+class TrickleSocket(FakeSocket):
+    chunk = 1
+
+    def readinto(self, buf, n=None):
+        return super().readinto(buf, min(len(buf) if n is None else n, self.chunk))
+
+
+class FramingTest(unittest.TestCase):
+    def setUp(self):
+        self.received = []
+        self.client, self.sock = connect(lambda topic, msg: self.received.append((topic, msg)))
+
+    def test_packets_in_one_read(self):
+        self.sock.feed(publish_packet(b"a/1", b"one") + publish_packet(b"a/2", b"two"))
+        self.client.wait_msg()
+        self.assertTrue(self.client.msg_buffered())
+        self.client.wait_msg()
+        self.assertFalse(self.client.msg_buffered())
+        self.assertEqual(self.received, [(b"a/1", b"one"), (b"a/2", b"two")])
+
+    def test_packet_split_across_reads(self):
+        self.client.sock = sock = TrickleSocket()
+        sock.feed(publish_packet(b"a/b", b"x" * 200, qos=1, pid=7))
+        self.client.wait_msg()
+        self.assertEqual(self.received, [(b"a/b", b"x" * 200)])
+        self.assertEqual(sock.take_packets(), [(0x40, b"\x00\x07")])
+
+    def test_multi_byte_remaining_length(self):
+        payload = bytes(range(256)) * 4
+        self.sock.feed(publish_packet(b"big", payload))
+        self.client.wait_msg()
+        self.assertEqual(self.received, [(b"big", payload)])
+
+    def test_check_msg_without_data(self):
+        self.assertIsNone(self.client.check_msg())
+        self.assertEqual(self.received, [])
+
+    def test_timed_wait_without_data(self):
+        t = time.monotonic()
+        self.assertIsNone(self.client.wait_msg(timeout_ms=30))
+        self.assertGreaterEqual(time.monotonic() - t, 0.025)
+
+    def test_timed_wait_with_buffered_data(self):
+        self.sock.feed(publish_packet(b"a/b", b"1"))
+        self.client.wait_msg(timeout_ms=1000)
+        self.assertEqual(self.received, [(b"a/b", b"1")])
+
+    def test_connection_closed(self):
+        self.client.sock = sock = FakeSocket()
+        sock.readinto = lambda buf, n=None: 0
+        with self.assertRaises(OSError):
+            self.client.wait_msg()
+
+
+class PacketAssemblyTest(unittest.TestCase):
+    def setUp(self):
+        self.client, self.sock = connect(wbuf_size=64)
+        self.writes = []
+        write = self.sock.write
+        self.sock.write = lambda buf, n=None: self.writes.append(n) or write(buf, n)
+
+    def test_publish_in_one_write(self):
+        self.client.publish("a/b", b"hello")
+        self.assertEqual(bytes(self.sock.written), b"\x30\x0a\x00\x03a/bhello")
+        self.assertEqual(len(self.writes), 1)
+
+    def test_qos1_publish(self):
+        pid = self.client.publish(b"a/b", "hi", retain=True, qos=1)
+        self.assertEqual(self.sock.take_packets(), [(0x33, b"\x00\x03a/b" + pid.to_bytes(2, "big") + b"hi")])
+
+    def test_large_payload_follows_header(self):
+        payload = b"p" * 200
+        self.client.publish("a/b", payload)
+        self.assertEqual(self.sock.take_packets(), [(0x30, b"\x00\x03a/b" + payload)])
+        self.assertEqual(self.writes, [8, 200])
+
+    def test_long_topic_grows_buffer(self):
+        topic = "t" * 100
+        self.client.publish(topic, b"x")
+        self.assertEqual(self.sock.take_packets(), [(0x30, b"\x00\x64" + topic.encode() + b"x")])
+
+    def test_subscribe_in_one_write(self):
+        self.client.subscribe("a/+", qos=1)
+        op, body = support.packets(self.sock.written)[0]
+        self.assertEqual(op, 0x82)
+        self.assertEqual(body[2:], b"\x00\x03a/+\x01")
+        self.assertEqual(len(self.writes), 1)
+
+
+class InflightTest(unittest.TestCase):
+    def setUp(self):
+        self.client, self.sock = connect(max_inflight=2)
+        self.sock.respond = False
+        self.acked = []
+        self.client.set_puback_callback(self.acked.append)
+
+    def test_window(self):
+        first = self.client.publish("a", b"1", qos=1)
+        second = self.client.publish("a", b"2", qos=1)
+        self.assertEqual(set(self.client.inflight), {first, second})
+        # The third publish has to wait for a PUBACK to make room
+        self.sock.feed(b"\x40\x02" + first.to_bytes(2, "big"))
+        third = self.client.publish("a", b"3", qos=1)
+        self.assertEqual(self.acked, [first])
+        self.assertEqual(set(self.client.inflight), {second, third})
+        self.assertEqual([body[-1:] for op, body in self.sock.take_packets()], [b"1", b"2", b"3"])
+
+    def test_retransmit_after_reconnect(self):
+        pids = [self.client.publish("a", payload, qos=1) for payload in (b"1", b"2")]
+        self.client.connect(clean_session=False)
+        sock = support.umqtt.socket.last
+        sent = sock.take_packets()
+        self.assertEqual(sent[0][0], 0x10)
+        self.assertEqual(sent[1:], [(0x3A, b"\x00\x01a" + pid.to_bytes(2, "big") + payload)
+                                    for pid, payload in zip(pids, (b"1", b"2"))])
+        while self.client.inflight:
+            self.client.wait_msg()
+        self.assertEqual(self.acked, pids)
+
+    def test_pids_in_flight_are_skipped(self):
+        self.client.pid = 0xFFFE
+        self.assertEqual(self.client.publish("a", b"1", qos=1), 0xFFFF)
+        self.client.inflight[1] = (b"a", b"old", False)
+        self.client.inflight.pop(0xFFFF)
+        self.assertEqual(self.client.publish("a", b"2", qos=1), 2)
+
+
+class ReceiveLimitTest(unittest.TestCase):
+    def connect(self, **kwargs):
+        self.received = []
+        self.client, self.sock = connect(lambda topic, msg: self.received.append((topic, msg)), **kwargs)
+
+    def test_oversized_message_dropped_and_acked(self):
+        self.connect(max_msg_size=100)
+        self.sock.feed(publish_packet(b"a/b", b"x" * 2000, qos=1, pid=9) + publish_packet(b"a/b", b"small"))
+        self.client.wait_msg()
+        self.assertEqual(self.received, [])
+        self.assertEqual(self.sock.take_packets(), [(0x40, b"\x00\x09")])
+        self.client.wait_msg()
+        self.assertEqual(self.received, [(b"a/b", b"small")])
+
+    def test_zero_copy_views(self):
+        self.connect(max_msg_size=100, zero_copy=True)
+        self.sock.feed(publish_packet(b"a/b", b"hello"))
+        self.client.wait_msg()
+        (topic, msg), = self.received
+        self.assertIsInstance(topic, memoryview)
+        self.assertIsInstance(msg, memoryview)
+        self.assertEqual((bytes(topic), bytes(msg)), (b"a/b", b"hello"))
+
+    def test_zero_copy_routes(self):
+        self.connect(max_msg_size=100, zero_copy=True)
+        routed = []
+        self.client.route("rpc/request/+", lambda topic, msg: routed.append(bytes(topic)))
+        self.client.route(b"attributes", lambda topic, msg: routed.append(bytes(msg)))
+        self.sock.feed(publish_packet(b"rpc/request/5", b"{}") + publish_packet(b"attributes", b"a")
+                       + publish_packet(b"rpc/response/5", b"{}"))
+        for _ in range(3):
+            self.client.wait_msg()
+        self.assertEqual(routed, [b"rpc/request/5", b"a"])
+        self.assertEqual([bytes(topic) for topic, msg in self.received], [b"rpc/response/5"])
+
+
+class SubscribeManyTest(unittest.TestCase):
+    def setUp(self):
+        self.client, self.sock = connect()
+
+    def test_one_packet_one_suback(self):
+        routed = []
+        self.client.subscribe_many((("a", 0, None), ("b/+", 1, lambda topic, msg: routed.append(topic))))
+        (op, body), = self.sock.take_packets()
+        self.assertEqual(op, 0x82)
+        self.assertEqual(body[2:], b"\x00\x01a\x00\x00\x03b/+\x01")
+        self.sock.feed(publish_packet(b"b/1", b"{}"))
+        self.client.wait_msg()
+        self.assertEqual(routed, [b"b/1"])
+
+    def test_refused_filter(self):
+        self.sock.respond = False
+        self.sock.feed(b"\x90\x04\x00\x01\x00\x80")
+        with self.assertRaises(umqtt.MQTTException):
+            self.client.subscribe_many((("a", 0, None), ("b", 0, None)))
+
+
+class KeepaliveTest(unittest.TestCase):
+    def setUp(self):
+        self.client, self.sock = connect(keepalive=60)
+
+    # Pretend nothing was sent or received for ms
+    def idle(self, ms):
+        self.client._last_tx = self.client._last_rx = time.ticks_add(time.ticks_ms(), -ms)
+
+    def test_disabled(self):
+        self.client.keepalive = 0
+        self.assertIsNone(self.client.check_keepalive())
+
+    def test_no_ping_while_active(self):
+        self.idle(10000)
+        left = self.client.check_keepalive()
+        self.assertTrue(40000 <= left <= 45000, left)
+        self.assertEqual(self.sock.written, b"")
+
+    def test_ping_and_rtt(self):
+        self.idle(56000)
+        self.assertEqual(self.client.check_keepalive(), 30000)
+        self.assertEqual(self.sock.take_packets(), [(0xC0, b"")])
+        self.assertIsNone(self.client.wait_msg())
+        self.assertIsNotNone(self.client.rtt_ms)
+        self.assertIsNone(self.client._ping_sent)
+
+    def test_timeout_floor_is_half_the_period(self):
+        self.client.rtt_ms = 5
+        self.assertEqual(self.client._ping_timeout(), 30000)
+        self.client.rtt_ms = 10000
+        self.assertEqual(self.client._ping_timeout(), 40000)
+
+    def test_overdue_pingresp(self):
+        self.client.rtt_ms = 5
+        self.idle(60000)
+        self.client.check_keepalive()
+        self.client._ping_sent = time.ticks_add(time.ticks_ms(), -31000)
+        with self.assertRaises(OSError) as cm:
+            self.client.check_keepalive()
+        self.assertEqual(cm.exception.args[0], ETIMEDOUT)
+
+
+# A one-connection TLS broker on localhost that answers CONNECT when
+# connack is set, and then sends whatever is put in outgoing
+class TLSBroker(threading.Thread):
+    def __init__(self, context, connack=True):
+        super().__init__(daemon=True)
+        self.context = context
+        self.connack = connack
+        self.outgoing = []
+        self.ready = threading.Event()
+        self.done = threading.Event()
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        conn, _ = self.listener.accept()
+        with self.context.wrap_socket(conn, server_side=True) as tls:
+            tls.recv(256)
+            if self.connack:
+                tls.sendall(support.CONNACK)
+            while not self.done.is_set():
+                if self.ready.wait(0.01):
+                    self.ready.clear()
+                    for data, delay in self.outgoing:
+                        time.sleep(delay)
+                        tls.sendall(data)
+                    self.outgoing = []
+        self.listener.close()
+
+    def send(self, *parts, delay=0):
+        self.outgoing = [(part, delay) for part in parts]
+        self.ready.set()
+
+
+@unittest.skipIf(shutil.which("openssl") is None, "needs openssl to make a test certificate")
+class TLSTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        cert = os.path.join(cls.tmp, "cert.pem")
+        key = os.path.join(cls.tmp, "key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj",
+                        "/CN=localhost", "-keyout", key, "-out", cert], check=True, capture_output=True)
+        cls.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        cls.context.load_cert_chain(cert, key)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp)
+
+    def setUp(self):
+        # Other tests leave the fake socket module in place
+        umqtt.socket = usocket
+
+    def start(self, connack=True):
+        broker = TLSBroker(self.context, connack)
+        broker.start()
+        self.addCleanup(broker.done.set)
+        return broker
+
+    def test_timed_reads(self):
+        broker = self.start()
+        received = []
+        client = umqtt.MQTTClient("test", "127.0.0.1", port=broker.port, ssl=True)
+        client.set_callback(lambda topic, msg: received.append((topic, msg)))
+        client.connect()
+        self.addCleanup(client.sock.close)
+        self.assertFalse(hasattr(client.sock, "settimeout"))
+        self.assertIsNone(client.wait_msg(timeout_ms=30))
+        packet = publish_packet(b"a/b", b"x" * 100)
+        broker.send(packet[:5], packet[5:], delay=0.05)
+        while not received:
+            client.wait_msg(timeout_ms=1000)
+        self.assertEqual(received, [(b"a/b", b"x" * 100)])
+
+    def test_connack_timeout(self):
+        broker = self.start(connack=False)
+        client = umqtt.MQTTClient("test", "127.0.0.1", port=broker.port, ssl=True)
+        with self.assertRaises(OSError) as cm:
+            client.connect(timeout=0.1)
+        client.sock.close()
+        self.assertEqual(cm.exception.args[0], ETIMEDOUT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+#      Copyright 2026. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+#
+
+import time
+from errno import ETIMEDOUT
+
+from .reconnect import Backoff
+
+
+# The sooner of two delays in ms, None meaning none
+def _earlier(a, b):
+    return b if a is None or b is not None and b < a else a
+
+
+# Callbacks of outstanding requests by request id, each with a deadline.
+# expire() hands the ones past their deadline to on_timeout(request_id,
+# callback); the earliest deadline is kept, so a call with nothing due
+# costs a single comparison.
+class PendingRequests:
+    def __init__(self, on_timeout):
+        self.on_timeout = on_timeout
+        # request_id -> (callback, deadline in ticks_ms)
+        self._pending = {}
+        self._next_expiry = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, request_id, callback, timeout):
+        deadline = time.ticks_add(time.ticks_ms(), int(timeout * 1000))
+        self._pending[request_id] = (callback, deadline)
+        if self._next_expiry is None or time.ticks_diff(deadline, self._next_expiry) < 0:
+            self._next_expiry = deadline
+
+    # Remove the request and return its callback
+    def pop(self, request_id, default=None):
+        entry = self._pending.pop(request_id, None)
+        return default if entry is None else entry[0]
+
+    # ms until the earliest deadline, None with nothing pending. Answered
+    # requests may leave it earlier than needed, never later.
+    def due_ms(self):
+        if self._next_expiry is None:
+            return None
+        return max(time.ticks_diff(self._next_expiry, time.ticks_ms()), 0)
+
+    def expire(self):
+        if self._next_expiry is None or time.ticks_diff(time.ticks_ms(), self._next_expiry) < 0:
+            return
+        now = time.ticks_ms()
+        self._next_expiry = None
+        pending = self._pending
+        for request_id in list(pending):
+            callback, deadline = pending[request_id]
+            if time.ticks_diff(now, deadline) >= 0:
+                del pending[request_id]
+                self.on_timeout(request_id, callback)
+            elif self._next_expiry is None or time.ticks_diff(deadline, self._next_expiry) < 0:
+                self._next_expiry = deadline
+
+
+# on_timeout for attribute requests, whose callbacks take (response, error)
+def _attributes_timeout(request_id, callback):
+    callback(None, OSError(ETIMEDOUT))
+
+
+# Connection handling shared by TBDeviceMqttClient and
+# TBGatewayMqttClient: auto reconnect with backoff, request timeouts and
+# the wait_for_msg()/check_for_msg() loop. A client using it provides
+# _client (its MQTTClient), connected, connect(), request_timeout,
+# _requests (a tuple of its PendingRequests) and _housekeeping(), the
+# periodic work done after each check; the parts of it that publish
+# have to check connected themselves. _due_ms() tells when that work is
+# due next.
+class ClientLoop:
+    _backoff = None
+
+    # Once enabled, wait_for_msg/check_for_msg reconnect by themselves
+    # after the link was lost instead of raising. The first attempt is
+    # made after a random delay of up to min_delay_ms, failed ones are
+    # retried with a jittered delay doubling up to max_delay_ms.
+    def enable_auto_reconnect(self, min_delay_ms=1000, max_delay_ms=60000):
+        self._backoff = Backoff(min_delay_ms, max_delay_ms)
+
+    def disable_auto_reconnect(self):
+        self._backoff = None
+
+    # One non-blocking reconnect attempt if it is due; returns whether
+    # the client is connected afterwards
+    def _reconnect(self):
+        backoff = self._backoff
+        if backoff.wait_ms():
+            return False
+        self._count("reconnect_attempts")
+        self.connect()
+        if self.connected:
+            self._count("reconnects")
+            backoff.reset()
+        else:
+            backoff.failed()
+        return self.connected
+
+    def _count(self, name):
+        if self._client.metrics is not None:
+            self._client.metrics.count(name)
+
+    # timeout in seconds, default request_timeout
+    def _add_pending(self, pending, request_id, callback, timeout):
+        pending.add(request_id, callback, self.request_timeout if timeout is None else timeout)
+
+    def _expire_requests(self):
+        for pending in self._requests:
+            pending.expire()
+
+    # Delays in ms until the parts of _housekeeping() beyond request
+    # timeouts have work to do, None for parts with nothing scheduled
+    def _due_ms(self):
+        return ()
+
+    # ms until the keepalive check, a request timeout or other
+    # housekeeping is due, None if nothing is scheduled
+    def _wait_ms(self):
+        wait = self._client.check_keepalive()
+        for pending in self._requests:
+            wait = _earlier(wait, pending.due_ms())
+        for ms in self._due_ms():
+            wait = _earlier(wait, ms)
+        return wait
+
+    # Waits for a message at most until the next keepalive check or other
+    # housekeeping is due, so a loop calling only this still pings an idle
+    # connection, times out requests and flushes batches on time.
+    # _housekeeping() publishes as well, so an OSError from it is handled
+    # like one from reading: with auto reconnect it is not raised.
+    def wait_for_msg(self):
+        if not self.connected and self._backoff is not None:
+            time.sleep_ms(self._backoff.wait_ms())
+        try:
+            if self.connected or self._backoff is None or self._reconnect():
+                self._client.wait_msg(timeout_ms=self._wait_ms())
+            self._housekeeping()
+        except OSError:
+            self.connected = False
+            if self._backoff is None:
+                raise
+
+    def check_for_msg(self):
+        try:
+            if self.connected or self._backoff is None or self._reconnect():
+                self._client.check_keepalive()
+                self._client.check_msg()
+            self._housekeeping()
+        except OSError:
+            self.connected = False
+            if self._backoff is None:
+                raise
@@ -0,0 +1,315 @@
+#      Copyright 2026. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+#
+
+import os
+import time
+from binascii import hexlify
+from json import dumps, loads
+
+FW_REQUEST_TOPIC = "v2/fw/request/"
+FW_RESPONSE_TOPIC = "v2/fw/response/"
+FW_ATTRIBUTES = ("fw_title", "fw_version", "fw_size", "fw_checksum", "fw_checksum_algorithm")
+
+_TELEMETRY_TOPIC = "v1/devices/me/telemetry"
+
+
+# Writes the image to the OTA partition that is not running (esp32 port),
+# one 4 KiB flash block at a time. Chunks that are whole blocks and
+# arrive block aligned are written without being copied.
+#
+# Writers that also provide flushed, resume() and readinto() let an
+# interrupted download continue where it stopped: flushed is the number
+# of bytes already on flash, resume(offset) continues writing at offset
+# (at most flushed) and readinto(offset, buf) reads back a block.
+class PartitionWriter:
+    BLOCK_SIZE = 4096
+
+    def __init__(self):
+        from esp32 import Partition
+
+        self.partition = Partition(Partition.RUNNING).get_next_update()
+        self._block = bytearray(self.BLOCK_SIZE)
+        self._fill = 0
+        self._index = 0
+
+    def write(self, data):
+        size = self.BLOCK_SIZE
+        data = memoryview(data)
+        if not self._fill and not len(data) % size:
+            self.partition.writeblocks(self._index, data)
+            self._index += len(data) // size
+            return
+        while data:
+            n = min(size - self._fill, len(data))
+            self._block[self._fill:self._fill + n] = data[:n]
+            self._fill += n
+            data = data[n:]
+            if self._fill == size:
+                self.partition.writeblocks(self._index, self._block)
+                self._index += 1
+                self._fill = 0
+
+    @property
+    def flushed(self):
+        return self._index * self.BLOCK_SIZE
+
+    def resume(self, offset):
+        self._index, self._fill = divmod(offset, self.BLOCK_SIZE)
+        if self._fill:
+            self.partition.readblocks(self._index, self._block)
+
+    def readinto(self, offset, buf):
+        self.partition.readblocks(offset // self.BLOCK_SIZE, buf)
+
+    def finish(self):
+        if self._fill:
+            for i in range(self._fill, self.BLOCK_SIZE):
+                self._block[i] = 0xFF
+            self.partition.writeblocks(self._index, self._block)
+            self._fill = 0
+
+    # Boot the new image on the next reset
+    def activate(self):
+        self.partition.set_boot()
+
+
+class _Crc32:
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        from binascii import crc32
+
+        self.value = crc32(data, self.value)
+
+    # ThingsBoard prints the CRC bytes in little-endian order
+    def hexdigest(self):
+        v = self.value
+        return "%02x%02x%02x%02x" % (v & 0xFF, v >> 8 & 0xFF, v >> 16 & 0xFF, v >> 24)
+
+
+# Which of these hashlib has depends on the port and its build options
+class _Hash:
+    def __init__(self, name):
+        import hashlib
+
+        if not hasattr(hashlib, name):
+            raise ValueError("checksum algorithm %s not available on this port" % name.upper())
+        self._h = getattr(hashlib, name)()
+
+    def update(self, data):
+        self._h.update(data)
+
+    def hexdigest(self):
+        return hexlify(self._h.digest()).decode()
+
+
+def checksum(algorithm):
+    algorithm = algorithm.upper()
+    if algorithm == "CRC32":
+        return _Crc32()
+    if algorithm in ("SHA256", "SHA384", "SHA512", "MD5"):
+        return _Hash(algorithm.lower())
+    raise ValueError("unsupported checksum algorithm " + algorithm)
+
+
+# Downloads the firmware image described by the fw_* shared attributes
+# passed to start(). window chunk requests are kept outstanding: each chunk is hashed and
+# handed to the writer straight from the receive path, and the request
+# for a later chunk is already out while it is written, so the transfer
+# is paced by bandwidth rather than by round trips. Requests and state
+# reports go out at QoS 0 because they are sent from inside the receive
+# callback, where waiting for a PUBACK would re-enter it. A chunk that
+# does not arrive within chunk_timeout_ms is requested again, retries
+# times at most. callback(update) runs once done is set; error is None
+# on success and also when no update was needed (received stays 0).
+#
+# With state_path and a resumable writer the progress is checkpointed
+# to that file about every checkpoint_bytes, at points where everything
+# received is on flash, which is after every block-aligned chunk when
+# chunk_size is a multiple of the flash block size. A later update of the same image (a new
+# FirmwareUpdate, e.g. after a reboot) continues from the checkpoint. A
+# CRC32 is stored with it; hash states cannot be saved, so the other
+# algorithms hash the part already on flash again on resume.
+class FirmwareUpdate:
+    def __init__(self, mqtt, writer, chunk_size=4096, window=2, chunk_timeout_ms=10000, retries=3, callback=None,
+                 state_path=None, checkpoint_bytes=32768):
+        self.mqtt = mqtt
+        self.writer = writer
+        self.chunk_size = chunk_size
+        self.window = window
+        self.chunk_timeout_ms = chunk_timeout_ms
+        self.retries = retries
+        self.callback = callback
+        self.info = None
+        self.size = 0
+        self.chunks = 0
+        self.received = 0
+        self.done = False
+        self.error = None
+        self._response_filter = None
+        self._next_chunk = 0
+        self._requested = 0
+        self._tries = 0
+        self.state_path = state_path if hasattr(writer, "resume") else None
+        self.checkpoint_bytes = checkpoint_bytes
+        self._checkpoint = 0
+
+    def start(self, request_id, info):
+        self.info = info
+        self.size = info["fw_size"]
+        self.chunks = (self.size + self.chunk_size - 1) // self.chunk_size
+        try:
+            self._checksum = checksum(info.get("fw_checksum_algorithm", "SHA256"))
+        except ValueError as e:
+            return self.fail(str(e))
+        if self.state_path is not None:
+            self._resume()
+        self._request_topic = "%s%d/chunk/" % (FW_REQUEST_TOPIC, request_id)
+        self._response_filter = "%s%d/chunk/+" % (FW_RESPONSE_TOPIC, request_id)
+        self.mqtt.route(self._response_filter, self._on_chunk)
+        self._report("DOWNLOADING")
+        if self._next_chunk == self.chunks:
+            return self._verify()
+        self._request_more()
+
+    def _state_key(self):
+        info = self.info
+        return [info.get("fw_title"), info.get("fw_version"), info.get("fw_checksum"), self.size, self.chunk_size]
+
+    def _resume(self):
+        try:
+            with open(self.state_path) as f:
+                state = loads(f.read())
+        except (OSError, ValueError):
+            return
+        if state.get("key") != self._state_key():
+            return self._clear_state()
+        offset = state["offset"]
+        self.writer.resume(offset)
+        if isinstance(self._checksum, _Crc32):
+            self._checksum.value = state["crc"]
+        else:
+            buf = bytearray(PartitionWriter.BLOCK_SIZE)
+            pos = 0
+            while pos < offset:
+                self.writer.readinto(pos, buf)
+                n = min(len(buf), offset - pos)
+                self._checksum.update(memoryview(buf)[:n])
+                pos += n
+        self.received = self._checkpoint = offset
+        self._next_chunk = self._requested = offset // self.chunk_size
+
+    def _save_state(self):
+        state = {"key": self._state_key(), "offset": self.received}
+        if isinstance(self._checksum, _Crc32):
+            state["crc"] = self._checksum.value
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(dumps(state))
+        os.rename(tmp, self.state_path)
+        self._checkpoint = self.received
+
+    def _clear_state(self):
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+
+    def _request_more(self):
+        payload = str(self.chunk_size)
+        while self._requested < self.chunks and self._requested < self._next_chunk + self.window:
+            self.mqtt.publish(self._request_topic + str(self._requested), payload)
+            self._requested += 1
+        self._deadline = time.ticks_add(time.ticks_ms(), self.chunk_timeout_ms)
+
+    def _on_chunk(self, topic, msg):
+        if self.done:
+            return
+        index = 0
+        for c in topic[len(self._response_filter) - 1:]:
+            index = index * 10 + c - 48
+        # Chunks answering a repeated request may arrive twice
+        if index != self._next_chunk:
+            return
+        if not msg:
+            return self._finish("empty chunk %d" % index)
+        try:
+            self._checksum.update(msg)
+            self.writer.write(msg)
+        except Exception as e:
+            return self._finish("write failed: %s" % e)
+        self.received += len(msg)
+        self._next_chunk += 1
+        self._tries = 0
+        if (self.state_path is not None and self.received - self._checkpoint >= self.checkpoint_bytes
+                and self.writer.flushed == self.received):
+            self._save_state()
+        if self._next_chunk < self.chunks:
+            self._request_more()
+        else:
+            self._verify()
+
+    def _verify(self):
+        self.writer.finish()
+        if self.received != self.size:
+            return self._finish("size mismatch")
+        self._report("DOWNLOADED")
+        if self._checksum.hexdigest() != self.info["fw_checksum"].lower():
+            return self._finish("checksum mismatch")
+        self._report("VERIFIED")
+        self._finish(None)
+
+    # Call periodically; re-requests outstanding chunks after a timeout
+    def check(self):
+        if self.done or self._response_filter is None or time.ticks_diff(time.ticks_ms(), self._deadline) < 0:
+            return
+        self._tries += 1
+        if self._tries > self.retries:
+            return self._finish("timed out waiting for chunk %d" % self._next_chunk)
+        self._requested = self._next_chunk
+        self._request_more()
+
+    # ms until check() has work to do, None once it never will
+    def due_ms(self):
+        if self.done or self._response_filter is None:
+            return None
+        return max(time.ticks_diff(self._deadline, time.ticks_ms()), 0)
+
+    def fail(self, error):
+        self._finish(error)
+
+    # End without downloading anything, e.g. when already up to date
+    def skip(self):
+        self._finish(None)
+
+    def _finish(self, error):
+        self.done = True
+        self.error = error
+        if self._response_filter is not None:
+            self.mqtt.route(self._response_filter, None)
+        # Keep the checkpoint only for interrupted downloads
+        if self.state_path is not None and (error is None or self._next_chunk == self.chunks):
+            self._clear_state()
+        if error is not None:
+            self._report("FAILED", error)
+        if self.callback is not None:
+            self.callback(self)
+
+    def _report(self, state, error=None):
+        telemetry = {"fw_state": state}
+        if error is not None:
+            telemetry["fw_error"] = error
+        self.mqtt.publish(_TELEMETRY_TOPIC, dumps(telemetry))
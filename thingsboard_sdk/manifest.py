@@ -16,6 +16,18 @@
 metadata(description="ThingsBoard uPython Client SDK", version="0.0.1")
 include("$(BOARD_DIR)/manifest.py")
 module("umqtt.py")
+module("umqtt_async.py")
 module("sdk_utils.py")
 module("tb_device_mqtt.py")
+module("tb_device_mqtt_async.py")
+module("tb_gateway_mqtt.py")
+module("telemetry_batch.py")
+module("offline_queue.py")
 module("provision_client.py")
+module("reconnect.py")
+module("client_loop.py")
+module("protobuf.py")
+module("report_filter.py")
+module("firmware.py")
+module("metrics.py")
+module("poller.py")
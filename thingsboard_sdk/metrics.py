@@ -0,0 +1,117 @@
+#      Copyright 2026. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+#
+
+import gc
+import time
+
+_PACKET_NAMES = ("reserved", "connect", "connack", "publish", "puback", "pubrec", "pubrel", "pubcomp",
+                 "subscribe", "suback", "unsubscribe", "unsuback", "pingreq", "pingresp", "disconnect", "auth")
+# Counter names per packet type, built once so counting does not allocate
+_COUNTERS = {
+    direction: [(direction + "_" + name, direction + "_" + name + "_bytes") for name in _PACKET_NAMES]
+    for direction in ("tx", "rx")
+}
+_mem_free = getattr(gc, "mem_free", None)
+
+
+# Bucketed distribution of a value, e.g. a latency in ms
+class Histogram:
+    def __init__(self, bounds=(5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        i = 0
+        for bound in self.bounds:
+            if value <= bound:
+                break
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def as_dict(self, name):
+        result = {name + "_count": self.count, name + "_sum": self.sum, name + "_max": self.max}
+        for bound, n in zip(self.bounds, self.counts):
+            result["%s_le_%d" % (name, bound)] = n
+        result[name + "_le_inf"] = self.counts[-1]
+        return result
+
+
+# Counters and histograms filled in by MQTTClient and TBDeviceMqttClient
+# while metrics are enabled on them:
+# - tx_<packet>/rx_<packet> and ..._bytes per MQTT packet type
+# - puback_ms and ping_rtt_ms histograms
+# - wait_msg_calls and wait_msg_us, time spent inside wait_msg()
+# - heap_free_before_publish/heap_free_after_publish and their minimum
+#   (ports with gc.mem_free() only)
+# - connects, reconnect_attempts, reconnects
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {"puback_ms": Histogram(), "ping_rtt_ms": Histogram()}
+        self.gauges = {}
+        self._puback_start = {}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def packet(self, direction, op, size):
+        packets, size_name = _COUNTERS[direction][op >> 4]
+        counters = self.counters
+        counters[packets] = counters.get(packets, 0) + 1
+        counters[size_name] = counters.get(size_name, 0) + size
+
+    def observe(self, name, value):
+        self.histograms[name].observe(value)
+
+    def publish_sent(self, pid):
+        self._puback_start[pid] = time.ticks_ms()
+
+    # A QoS 1 publish taken out of the in-flight window unacknowledged
+    def publish_dropped(self, pid):
+        self._puback_start.pop(pid, None)
+
+    def puback_received(self, pid):
+        start = self._puback_start.pop(pid, None)
+        if start is not None:
+            self.histograms["puback_ms"].observe(time.ticks_diff(time.ticks_ms(), start))
+
+    def heap(self, name):
+        if _mem_free is None:
+            return
+        free = _mem_free()
+        self.gauges[name] = free
+        low = name + "_min"
+        if free < self.gauges.get(low, free + 1):
+            self.gauges[low] = free
+
+    # Flat {name: number} dict, ready to be sent as telemetry
+    def as_dict(self):
+        result = dict(self.counters)
+        result.update(self.gauges)
+        for name, histogram in self.histograms.items():
+            result.update(histogram.as_dict(name))
+        return result
+
+    def reset(self):
+        self.counters = {}
+        self.histograms = {"puback_ms": Histogram(), "ping_rtt_ms": Histogram()}
+        self.gauges = {}
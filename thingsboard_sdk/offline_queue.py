@@ -0,0 +1,121 @@
+#      Copyright 2026. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+#
+
+import os
+
+
+# Append-only message queue on flash. Records are "<topic> <payload>\n"
+# lines spread over numbered segment files of about segment_size bytes.
+# A cursor (segment, offset) marks the first unacknowledged record; it
+# is persisted on commit() and fully consumed segments are deleted then.
+# When max_segments is exceeded the oldest segment is dropped, so flash
+# usage stays bounded during long outages.
+class OfflineQueue:
+    def __init__(self, path="/tb_queue", segment_size=8192, max_segments=16):
+        self.path = path
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        try:
+            os.mkdir(path)
+        except OSError:
+            pass
+        self._segments = sorted(int(name[:-4]) for name in os.listdir(path) if name.endswith(".seg"))
+        self._next_id = self._segments[-1] + 1 if self._segments else 0
+        self._write_size = os.stat(self._name(self._segments[-1]))[6] if self._segments else 0
+        self._cursor = self._load_cursor()
+        self._pending = None
+
+    def _name(self, seg):
+        return "%s/%08d.seg" % (self.path, seg)
+
+    def _load_cursor(self):
+        try:
+            with open(self.path + "/cursor") as f:
+                seg, pos = f.read().split()
+            seg = int(seg)
+            if seg in self._segments:
+                return seg, int(pos)
+        except (OSError, ValueError):
+            pass
+        return (self._segments[0] if self._segments else self._next_id), 0
+
+    def _save_cursor(self):
+        tmp = self.path + "/cursor.tmp"
+        with open(tmp, "w") as f:
+            f.write("%d %d" % self._cursor)
+        os.rename(tmp, self.path + "/cursor")
+
+    def __bool__(self):
+        if not self._segments:
+            return False
+        seg, pos = self._cursor
+        return seg != self._segments[-1] or pos < self._write_size
+
+    def put(self, topic, payload):
+        line = ("%s %s\n" % (topic, payload)).encode()
+        if not self._segments or self._write_size >= self.segment_size:
+            self._rotate()
+        with open(self._name(self._segments[-1]), "ab") as f:
+            f.write(line)
+        self._write_size += len(line)
+
+    def _rotate(self):
+        self._segments.append(self._next_id)
+        self._next_id += 1
+        self._write_size = 0
+        if len(self._segments) > self.max_segments:
+            dropped = self._segments.pop(0)
+            os.remove(self._name(dropped))
+            if self._cursor[0] <= dropped:
+                self._cursor = (self._segments[0], 0)
+                self._pending = None
+
+    # Return up to max_records (topic, payload) pairs from the cursor on
+    # without consuming them; commit() acknowledges what was returned.
+    def peek(self, max_records=20):
+        records = []
+        seg, pos = self._cursor
+        while len(records) < max_records and seg in self._segments:
+            with open(self._name(seg), "rb") as f:
+                f.seek(pos)
+                while len(records) < max_records:
+                    line = f.readline()
+                    if not line:
+                        break
+                    pos += len(line)
+                    topic, _, payload = line[:-1].decode().partition(" ")
+                    records.append((topic, payload))
+            if len(records) < max_records and seg != self._segments[-1]:
+                seg = self._segments[self._segments.index(seg) + 1]
+                pos = 0
+            else:
+                break
+        self._pending = (seg, pos)
+        return records
+
+    def commit(self):
+        if self._pending is None:
+            return
+        self._cursor = self._pending
+        self._pending = None
+        seg, pos = self._cursor
+        while self._segments and self._segments[0] < seg:
+            os.remove(self._name(self._segments.pop(0)))
+        if self._segments == [seg] and pos >= self._write_size:
+            # Everything was delivered, start over with an empty queue
+            os.remove(self._name(self._segments.pop(0)))
+            self._cursor = (self._next_id, 0)
+            self._write_size = 0
+        self._save_cursor()
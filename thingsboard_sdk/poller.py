@@ -0,0 +1,182 @@
+#      Copyright 2026. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+#
+
+import select
+import time
+
+
+class _Entry:
+    def __init__(self, client, on_error):
+        self.client = client
+        self.on_error = on_error
+        # A TBDeviceMqttClient wraps its MQTTClient
+        self.device = hasattr(client, "check_for_msg")
+        self.mqtt = client._client if self.device else client
+        self.sock = None
+        self.fd = None
+        # sock.pending if the socket has it (TLS on some ports): bytes
+        # already decrypted, which poll() does not report as readable
+        self.pending = None
+        # Socket that failed; polled again only once the client replaced it
+        self.failed = None
+        self.due = time.ticks_ms()
+
+    # Whether there is something to read without waiting for the socket
+    def buffered(self):
+        return self.mqtt.msg_buffered() or self.pending is not None and self.pending() > 0
+
+
+# Serves many MQTTClient and TBDeviceMqttClient connections from one
+# thread with select.poll: wait_msg() runs only for sockets that are
+# readable (or hold a whole buffered packet or decrypted TLS bytes), and
+# keepalives are sent when due, so nothing blocks on an idle connection.
+#
+# Every housekeeping_ms, or sooner when a keepalive needs it, each
+# MQTTClient gets check_keepalive() and each TBDeviceMqttClient
+# check_for_msg(), which also expires requests, flushes batched telemetry
+# and reconnects with backoff. Sockets replaced by a reconnect are picked
+# up automatically. OSError from a connection goes to on_error(client,
+# error) if given; otherwise its socket leaves the poll set and the error
+# is raised from poll(). A TBDeviceMqttClient with auto reconnect enabled
+# handles its errors itself.
+class Poller:
+    def __init__(self, housekeeping_ms=1000):
+        self.housekeeping_ms = housekeeping_ms
+        self._poll = select.poll()
+        self._entries = []
+        # Registered socket -> entry; CPython's poll() reports file
+        # descriptors instead of objects, so those are keys as well
+        self._socks = {}
+        self._next_due = time.ticks_ms()
+
+    def register(self, client, on_error=None):
+        entry = _Entry(client, on_error)
+        self._entries.append(entry)
+        self._sync(entry)
+        self._next_due = time.ticks_ms()
+
+    def unregister(self, client):
+        for entry in self._entries:
+            if entry.client is client:
+                self._drop_sock(entry)
+                self._entries.remove(entry)
+                return
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Register the client's current socket if it changed
+    def _sync(self, entry):
+        sock = entry.mqtt.sock if not entry.device or entry.client.connected else None
+        if sock is entry.failed:
+            sock = None
+        if sock is entry.sock:
+            return
+        self._drop_sock(entry)
+        if sock is not None:
+            self._poll.register(sock, select.POLLIN)
+            self._socks[sock] = entry
+            fileno = getattr(sock, "fileno", None)
+            if fileno is not None:
+                entry.fd = fileno()
+                self._socks[entry.fd] = entry
+            entry.pending = getattr(sock, "pending", None)
+        entry.sock = sock
+
+    def _drop_sock(self, entry):
+        if entry.sock is None:
+            return
+        try:
+            self._poll.unregister(entry.sock)
+        except (OSError, KeyError, ValueError):
+            pass
+        self._socks.pop(entry.sock, None)
+        if entry.fd is not None and self._socks.get(entry.fd) is entry:
+            del self._socks[entry.fd]
+        entry.sock = None
+        entry.fd = None
+        entry.pending = None
+
+    def _failed(self, entry, error):
+        entry.failed = entry.mqtt.sock
+        self._drop_sock(entry)
+        if entry.on_error is None:
+            raise error
+        entry.on_error(entry.client, error)
+
+    # Handle one readable connection: everything it has buffered, but
+    # nothing that would have to wait for more data
+    def _read(self, entry):
+        mqtt = entry.mqtt
+        try:
+            while True:
+                if entry.device:
+                    entry.client.check_for_msg()
+                    # Reconnected sockets are picked up by _sync
+                    if not entry.client.connected or mqtt.sock is not entry.sock:
+                        break
+                else:
+                    mqtt.wait_msg()
+                if not entry.buffered():
+                    break
+        except OSError as e:
+            return self._failed(entry, e)
+        self._sync(entry)
+
+    def _housekeeping(self):
+        now = time.ticks_ms()
+        next_due = time.ticks_add(now, self.housekeeping_ms)
+        for entry in self._entries:
+            if time.ticks_diff(entry.due, now) <= 0:
+                left = self.housekeeping_ms
+                try:
+                    if entry.device:
+                        entry.client.check_for_msg()
+                    elif entry.sock is not None:
+                        keepalive = entry.mqtt.check_keepalive()
+                        if keepalive is not None and keepalive < left:
+                            left = keepalive
+                except OSError as e:
+                    self._failed(entry, e)
+                self._sync(entry)
+                entry.due = time.ticks_add(now, left)
+            if time.ticks_diff(entry.due, next_due) < 0:
+                next_due = entry.due
+        self._next_due = next_due
+
+    # Wait up to timeout_ms (-1: until there is something to do) for
+    # incoming packets and handle them. Returns the number of
+    # connections that were served.
+    def poll(self, timeout_ms=-1):
+        if time.ticks_diff(self._next_due, time.ticks_ms()) <= 0:
+            self._housekeeping()
+        ready = [entry for entry in self._entries if entry.sock is not None and entry.buffered()]
+        wait = max(0, time.ticks_diff(self._next_due, time.ticks_ms()))
+        if ready:
+            wait = 0
+        elif 0 <= timeout_ms < wait:
+            wait = timeout_ms
+        for event in self._poll.poll(wait):
+            entry = self._socks.get(event[0])
+            if entry is not None and entry not in ready:
+                ready.append(entry)
+        for entry in ready:
+            self._read(entry)
+        return len(ready)
+
+    # Serve the registered clients until none is left
+    def run(self):
+        while self._entries:
+            self.poll()
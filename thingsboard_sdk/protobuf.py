@@ -0,0 +1,203 @@
+#      Copyright 2026. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+#
+
+import struct
+from json import loads
+
+# Wire type of every supported field type; a nested Message is length-delimited
+_WIRE_TYPES = {
+    "int32": 0, "int64": 0, "uint32": 0, "uint64": 0, "sint32": 0, "sint64": 0, "bool": 0, "enum": 0,
+    "double": 1, "float": 5, "string": 2, "bytes": 2,
+}
+_FIXED = {"double": "<d", "float": "<f"}
+
+
+def _put_varint(out, n):
+    if n < 0:
+        n &= 0xFFFFFFFFFFFFFFFF
+    while n > 0x7F:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(buf, i):
+    n = 0
+    shift = 0
+    while 1:
+        b = buf[i]
+        i += 1
+        n |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return n, i
+        shift += 7
+
+
+# Proto3 message described by a dict of name -> (field number, type).
+# type is one of the names in _WIRE_TYPES, a nested field dict or
+# Message, or either of those in a one-element list for a repeated
+# field. Field tags are computed once here, so encoding only appends
+# values. Fields missing from the values are not sent, unknown fields
+# are skipped when decoding.
+class Message:
+    def __init__(self, fields):
+        self._fields = []
+        self._numbers = {}
+        for name, (number, kind) in fields.items():
+            repeated = isinstance(kind, list)
+            if repeated:
+                kind = kind[0]
+            if isinstance(kind, dict):
+                kind = Message(kind)
+            wire = 2 if isinstance(kind, Message) else _WIRE_TYPES[kind]
+            # Repeated numbers are packed, as proto3 does by default
+            tag = number << 3 | (2 if repeated and wire != 2 else wire)
+            field = (name, kind, repeated, wire, bytes(_tag_bytes(tag)))
+            self._fields.append(field)
+            self._numbers[number] = field
+
+    def encode(self, values):
+        out = bytearray()
+        for name, kind, repeated, wire, tag in self._fields:
+            value = values.get(name)
+            if value is None:
+                continue
+            if not repeated:
+                out += tag
+                _put_value(out, kind, wire, value)
+            elif wire == 2:
+                for item in value:
+                    out += tag
+                    _put_value(out, kind, wire, item)
+            else:
+                packed = bytearray()
+                for item in value:
+                    _put_value(packed, kind, wire, item)
+                out += tag
+                _put_varint(out, len(packed))
+                out += packed
+        return bytes(out)
+
+    def decode(self, buf, start=0, end=None):
+        values = {}
+        i = start
+        end = len(buf) if end is None else end
+        while i < end:
+            key, i = _get_varint(buf, i)
+            wire = key & 7
+            field = self._numbers.get(key >> 3)
+            if field is None:
+                i = _skip(buf, i, wire)
+                continue
+            name, kind, repeated, field_wire, _ = field
+            if wire == 2 and field_wire != 2:
+                # Packed repeated numbers
+                n, i = _get_varint(buf, i)
+                stop = i + n
+                items = values.setdefault(name, [])
+                while i < stop:
+                    value, i = _get_value(buf, i, kind, field_wire)
+                    items.append(value)
+                continue
+            if wire != field_wire:
+                i = _skip(buf, i, wire)
+                continue
+            value, i = _get_value(buf, i, kind, wire)
+            if repeated:
+                values.setdefault(name, []).append(value)
+            else:
+                values[name] = value
+        return values
+
+
+def _tag_bytes(tag):
+    out = bytearray()
+    _put_varint(out, tag)
+    return out
+
+
+def _put_value(out, kind, wire, value):
+    if wire == 0:
+        if kind == "sint32" or kind == "sint64":
+            value = value << 1 ^ -(value < 0)
+        _put_varint(out, int(value))
+    elif wire == 2:
+        if isinstance(kind, Message):
+            value = kind.encode(value)
+        elif isinstance(value, str):
+            value = value.encode()
+        _put_varint(out, len(value))
+        out += value
+    else:
+        out += struct.pack(_FIXED[kind], value)
+
+
+def _get_value(buf, i, kind, wire):
+    if wire == 0:
+        n, i = _get_varint(buf, i)
+        if kind == "bool":
+            return n != 0, i
+        if kind == "sint32" or kind == "sint64":
+            return n >> 1 ^ -(n & 1), i
+        if n >> 63 and kind[0] != "u":
+            n -= 1 << 64
+        return n, i
+    if wire == 2:
+        n, i = _get_varint(buf, i)
+        if isinstance(kind, Message):
+            return kind.decode(buf, i, i + n), i + n
+        value = bytes(buf[i:i + n])
+        return (value.decode() if kind == "string" else value), i + n
+    fmt = _FIXED[kind]
+    return struct.unpack_from(fmt, buf, i)[0], i + (8 if wire == 1 else 4)
+
+
+def _skip(buf, i, wire):
+    if wire == 0:
+        return _get_varint(buf, i)[1]
+    if wire == 2:
+        n, i = _get_varint(buf, i)
+        return i + n
+    return i + (8 if wire == 1 else 4)
+
+
+# Fixed ThingsBoard transport messages (transport.proto); the RPC
+# request/response ones are the device profile defaults and may be
+# replaced through TBDeviceMqttClient.use_protobuf()
+KEY_VALUE = {"key": (1, "string"), "type": (2, "enum"), "bool_v": (3, "bool"), "long_v": (4, "int64"),
+             "double_v": (5, "double"), "string_v": (6, "string"), "json_v": (7, "string")}
+TS_KV = {"ts": (1, "int64"), "kv": (2, KEY_VALUE)}
+ATTRIBUTES_REQUEST = {"clientKeys": (1, "string"), "sharedKeys": (2, "string")}
+ATTRIBUTES_RESPONSE = {"requestId": (1, "int32"), "clientAttributeList": (2, [TS_KV]),
+                       "sharedAttributeList": (3, [TS_KV]), "error": (5, "string")}
+ATTRIBUTES_UPDATE = {"sharedUpdated": (1, [TS_KV]), "sharedDeleted": (2, ["string"])}
+RPC_REQUEST = {"method": (1, "string"), "requestId": (2, "int32"), "params": (3, "string")}
+RPC_RESPONSE = {"payload": (1, "string")}
+CLIENT_RPC_REQUEST = {"requestId": (1, "int32"), "methodName": (2, "string"), "params": (3, "string")}
+CLIENT_RPC_RESPONSE = {"requestId": (1, "int32"), "payload": (2, "string"), "error": (3, "string")}
+
+_KV_FIELDS = ("bool_v", "long_v", "double_v", "string_v", "json_v")
+_KV_DEFAULTS = (False, 0, 0.0, "", "null")
+
+
+# {key: value} dict from a decoded list of TsKvProto
+def kv_dict(ts_kv_list):
+    result = {}
+    for ts_kv in ts_kv_list:
+        kv = ts_kv.get("kv", {})
+        kind = kv.get("type", 0)
+        value = kv.get(_KV_FIELDS[kind], _KV_DEFAULTS[kind])
+        result[kv.get("key", "")] = loads(value) if kind == 4 else value
+    return result
@@ -5,10 +5,13 @@ from .umqtt import MQTTClient
 
 
 class ProvisionClient(ProvisionClientBase):
-    def __init__(self, host, port, provision_request):
+    def __init__(self, host, port, provision_request, ssl=False, ssl_params={}):
         super().__init__(host, port, provision_request)
 
-        mqtt_client = MQTTClient(self._client_id, self._host, self._port, keepalive=10)
+        # The resolved address and TLS session are cached by umqtt, so the
+        # device connection that follows provisioning reuses them
+        mqtt_client = MQTTClient(self._client_id, self._host, self._port, keepalive=10, ssl=ssl,
+                                 ssl_params=ssl_params)
         mqtt_client.set_callback(self.on_message_callback)
         self.set_client(mqtt_client)
 
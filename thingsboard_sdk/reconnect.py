@@ -0,0 +1,49 @@
+#      Copyright 2026. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+#
+
+import time
+from random import getrandbits
+
+
+# Exponential backoff with "equal jitter": after each failure the delay
+# doubles up to max_ms and the next attempt is scheduled at a random
+# point in the upper half of it, so devices that lost the server at the
+# same moment do not come back at the same moment. The first attempt
+# after a reset is spread over 0..min_ms the same way; its clock starts
+# with the first wait_ms() call, i.e. when the link was found lost.
+class Backoff:
+    def __init__(self, min_ms=1000, max_ms=60000):
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.attempts = 0
+        self._delay = min_ms
+        self._next = None
+
+    def reset(self):
+        self.attempts = 0
+        self._delay = self.min_ms
+        self._next = None
+
+    # ms until the next attempt is allowed, 0 when it is due
+    def wait_ms(self):
+        if self._next is None:
+            self._next = time.ticks_add(time.ticks_ms(), getrandbits(16) % (self.min_ms + 1))
+        return max(0, time.ticks_diff(self._next, time.ticks_ms()))
+
+    def failed(self):
+        self.attempts += 1
+        half = self._delay // 2
+        self._next = time.ticks_add(time.ticks_ms(), half + getrandbits(16) % (half + 1))
+        self._delay = min(self._delay * 2, self.max_ms)
@@ -0,0 +1,61 @@
+#      Copyright 2026. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+#
+
+import time
+
+
+# Report-by-exception: remembers the last reported value of every key
+# and lets a key through only when it moved beyond its deadband. A
+# deadband is an absolute number or a string such as "2.5%" (relative
+# to the last reported value); keys without one are reported on any
+# change. Every full_report_ms all known keys are reported again so the
+# server can tell a quiet device from a dead one.
+class ReportFilter:
+    def __init__(self, deadbands=None, full_report_ms=300000):
+        self._absolute = {}
+        self._percent = {}
+        for key, band in (deadbands or {}).items():
+            if isinstance(band, str):
+                self._percent[key] = float(band.rstrip("%")) / 100
+            else:
+                self._absolute[key] = band
+        self.full_report_ms = full_report_ms
+        self._last = {}
+        self._full_at = time.ticks_ms()
+
+    # Returns the part of values that should be reported (may be empty)
+    def filter(self, values):
+        last = self._last
+        if time.ticks_diff(time.ticks_ms(), self._full_at) >= self.full_report_ms:
+            self._full_at = time.ticks_ms()
+            last.update(values)
+            return dict(last)
+        changed = {}
+        for key, value in values.items():
+            if key not in last or self._moved(key, last[key], value):
+                changed[key] = last[key] = value
+        return changed
+
+    def _moved(self, key, old, new):
+        if isinstance(new, (int, float)) and isinstance(old, (int, float)):
+            if key in self._percent:
+                return abs(new - old) > abs(old) * self._percent[key]
+            return abs(new - old) > self._absolute.get(key, 0)
+        return new != old
+
+    # Forget everything, so the next call reports all keys
+    def reset(self):
+        self._last = {}
+        self._full_at = time.ticks_ms()
@@ -13,28 +13,121 @@
 #      limitations under the License.
 #
 
+import os
+import time
+from errno import ETIMEDOUT
+from json import dumps, loads
+
 from sdk_core.device_mqtt import TBDeviceMqttClientBase
+from .client_loop import ClientLoop, PendingRequests, _attributes_timeout
 from .provision_client import ProvisionClient
 from .umqtt import MQTTClient, MQTTException
 
+TELEMETRY_TOPIC = "v1/devices/me/telemetry"
+ATTRIBUTES_TOPIC = "v1/devices/me/attributes"
+ATTRIBUTES_REQUEST_TOPIC = ATTRIBUTES_TOPIC + "/request/"
+ATTRIBUTES_RESPONSE_TOPIC = ATTRIBUTES_TOPIC + "/response/"
+RPC_REQUEST_TOPIC = "v1/devices/me/rpc/request/"
+RPC_RESPONSE_TOPIC = "v1/devices/me/rpc/response/"
+_TELEMETRY_TOPIC = TELEMETRY_TOPIC.encode()
+
+
+# Request id at the end of a topic, parsed straight from the bytes
+def _request_id(topic, start):
+    n = 0
+    for c in topic[start:]:
+        n = n * 10 + c - 48
+    return n
+
+
+def _load_credentials(path, host, port):
+    try:
+        with open(path) as f:
+            stored = loads(f.read())
+    except (OSError, ValueError):
+        return None
+    if stored.get("host") == host and stored.get("port") == port:
+        return stored.get("credentials")
+
+
+def _save_credentials(path, host, port, credentials):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(dumps({"host": host, "port": port, "credentials": credentials}))
+    os.rename(tmp, path)
+
+
+def _rpc_call_timeout(request_id, callback):
+    callback(request_id, None, OSError(ETIMEDOUT))
+
 
-class TBDeviceMqttClient(TBDeviceMqttClientBase):
+# With zero_copy the client hands out memoryviews of its receive buffer;
+# handlers that parse the payload as text or keep it get bytes copies
+def _copied(handler):
+    return lambda topic, msg: handler(bytes(topic), bytes(msg))
+
+
+# The optional features (protobuf, batching, report-by-exception, the
+# offline queue, metrics and firmware updates) import their modules when
+# first enabled, so a client that does not use them never loads them.
+class TBDeviceMqttClient(ClientLoop, TBDeviceMqttClientBase):
+    client_class = MQTTClient
+
+    # max_msg_size, zero_copy and rbuf_size go to the MQTTClient. With
+    # zero_copy, firmware chunks are hashed and written to flash straight
+    # from the receive buffer; max_msg_size has to leave room for a chunk
+    # of chunk_size plus its topic, larger messages are dropped.
     def __init__(self, host, port=1883, access_token=None, quality_of_service=None,
-                 client_id=None, chunk_size=0):
+                 client_id=None, chunk_size=0, max_inflight=0, persistent_session=False,
+                 ssl=False, ssl_params={}, max_msg_size=0, zero_copy=False, rbuf_size=512):
         super().__init__(host, port, access_token, quality_of_service, client_id, chunk_size)
-        client = MQTTClient(
-            self._client_id, self._host, self._port, self._access_token, 'pswd', keepalive=120
+        client = self.client_class(
+            self._client_id, self._host, self._port, self._access_token, 'pswd', keepalive=120,
+            ssl=ssl, ssl_params=ssl_params, max_inflight=max_inflight, max_msg_size=max_msg_size,
+            zero_copy=zero_copy, rbuf_size=rbuf_size
         )
         self.set_client(client)
+        self._qos = 1 if quality_of_service is None else quality_of_service
+        self._chunk_size = chunk_size
+        self._telemetry_batch = None
+        self._batching = False
+        self._telemetry_filter = None
+        self._attributes_filter = None
+        self._offline_queue = None
+        self._drain_batch = 20
+        # Packet ids of the offline batch awaiting PUBACKs, None if none
+        self._drain_pids = None
+        # Outstanding requests by request id
+        self.request_timeout = 10
+        self._attr_request_id = 0
+        self._attr_requests = PendingRequests(_attributes_timeout)
+        self._rpc_call_id = 0
+        self._rpc_calls = PendingRequests(_rpc_call_timeout)
+        self._requests = (self._attr_requests, self._rpc_calls)
+        self._rpc_request_handler = None
+        # With persistent_session the server keeps subscriptions and
+        # undelivered QoS 1 messages across reconnects
+        self._persistent_session = persistent_session
+        self._firmware = None
+        self._fw_request_id = 0
+        self._metrics_interval = 0
+        self._metrics_due = 0
+        # Message name -> protobuf.Message once use_protobuf() was called
+        self._proto = None
+        client.set_callback(_copied(self.all_subscribed_topics_callback) if zero_copy
+                            else self.all_subscribed_topics_callback)
 
     def connect(self, timeout=5):
         try:
-            response = self._client.connect(timeout=timeout)
-            self._client.set_callback(self.all_subscribed_topics_callback)
+            response = self._client.connect(clean_session=not self._persistent_session, timeout=timeout)
 
-            self.__subscribe_all_required_topics()
+            if response:
+                self._route_required_topics()
+            else:
+                self.__subscribe_all_required_topics()
 
             self.connected = True
+            self._drain_offline()
             return response
         except MQTTException as e:
             self.connected = False
@@ -43,27 +136,534 @@ class TBDeviceMqttClient(TBDeviceMqttClientBase):
             self.connected = False
             print(f"Unexpected connection error: {e}")
 
-    def request_attributes(self, client_keys=None, shared_keys=None, callback=None):
-        super().request_attributes(client_keys=client_keys, shared_keys=shared_keys, callback=callback)
-        self._client.wait_msg()
+    # Collect metrics.Metrics for this client. With publish_interval_ms
+    # they are also sent as telemetry (QoS 0) that often from
+    # check_for_msg/wait_for_msg.
+    def enable_metrics(self, publish_interval_ms=0):
+        from .metrics import Metrics
+
+        self._client.metrics = Metrics()
+        self._metrics_interval = publish_interval_ms
+        self._metrics_due = time.ticks_add(time.ticks_ms(), publish_interval_ms)
+
+    def disable_metrics(self):
+        self._client.metrics = None
+        self._metrics_interval = 0
+
+    # Current metrics as a flat dict, None while disabled
+    def get_metrics(self):
+        metrics = self._client.metrics
+        return None if metrics is None else metrics.as_dict()
+
+    def publish_metrics(self):
+        metrics = self.get_metrics()
+        if metrics is not None:
+            self._client.publish(_TELEMETRY_TOPIC, dumps(metrics))
+
+    def _publish_due_metrics(self):
+        if not self._metrics_interval or not self.connected:
+            return
+        if time.ticks_diff(time.ticks_ms(), self._metrics_due) >= 0:
+            self._metrics_due = time.ticks_add(time.ticks_ms(), self._metrics_interval)
+            self.publish_metrics()
+
+    # Responses and RPC requests are routed by topic bytes straight to
+    # their handlers; attribute updates go through the base callback.
+    # Firmware chunks are routed by the running FirmwareUpdate itself.
+    def _required_subscriptions(self):
+        subscriptions = [
+            (ATTRIBUTES_TOPIC, None if self._proto is None else self._on_attributes_update),
+            (ATTRIBUTES_RESPONSE_TOPIC + "+", self._on_attributes_response),
+            (RPC_REQUEST_TOPIC + "+", self._on_rpc_request),
+            (RPC_RESPONSE_TOPIC + "+", self._on_rpc_response),
+        ]
+        if self._client.zero_copy:
+            subscriptions = [(topic, handler and _copied(handler)) for topic, handler in subscriptions]
+        if self._firmware is not None and not self._firmware.done:
+            from .firmware import FW_RESPONSE_TOPIC
+
+            subscriptions.append((FW_RESPONSE_TOPIC + "+/chunk/+", None))
+        return subscriptions
 
-    def send_rpc_call(self, method, params, callback):
-        super().send_rpc_call(method=method, params=params, callback=callback)
-        self._client.wait_msg()
+    # The server still has our subscriptions when it resumed the session,
+    # only the local routes may be missing (e.g. after a reboot)
+    def _route_required_topics(self):
+        for topic, handler in self._required_subscriptions():
+            if handler is not None:
+                self._client.route(topic, handler)
 
-    def wait_for_msg(self):
-        self._client.wait_msg()
+    def __subscribe_all_required_topics(self):
+        self._client.subscribe_many([(topic, 1, handler) for topic, handler in self._required_subscriptions()])
+
+    def _on_attributes_response(self, topic, msg):
+        callback = self._attr_requests.pop(_request_id(topic, len(ATTRIBUTES_RESPONSE_TOPIC)))
+        if callback is None:
+            return
+        if self._proto is None:
+            return callback(loads(msg), None)
+        from .protobuf import kv_dict
+
+        response = self._proto["attributes_response"].decode(msg)
+        if "error" in response:
+            return callback(None, Exception(response["error"]))
+        callback({"client": kv_dict(response.get("clientAttributeList", ())),
+                    "shared": kv_dict(response.get("sharedAttributeList", ()))}, None)
+
+    # Shared attribute updates are handed to the base callback as the
+    # JSON it would have received without protobuf
+    def _on_attributes_update(self, topic, msg):
+        from .protobuf import kv_dict
+
+        update = self._proto["attributes_update"].decode(msg)
+        values = kv_dict(update.get("sharedUpdated", ()))
+        if "sharedDeleted" in update:
+            values["deleted"] = update["sharedDeleted"]
+        self.all_subscribed_topics_callback(topic, dumps(values).encode())
+
+    def _on_rpc_request(self, topic, msg):
+        if self._proto is not None:
+            request = self._proto["rpc_request"].decode(msg)
+            params = request.get("params")
+            msg = {"method": request.get("method", ""), "params": loads(params) if params else {}}
+            if self._rpc_request_handler is None:
+                return self.all_subscribed_topics_callback(topic, dumps(msg).encode())
+        elif self._rpc_request_handler is None:
+            return self.all_subscribed_topics_callback(topic, msg)
+        else:
+            msg = loads(msg)
+        self._rpc_request_handler(_request_id(topic, len(RPC_REQUEST_TOPIC)), msg)
+
+    def _on_rpc_response(self, topic, msg):
+        request_id = _request_id(topic, len(RPC_RESPONSE_TOPIC))
+        callback = self._rpc_calls.pop(request_id)
+        if callback is None:
+            return
+        if self._proto is None:
+            return callback(request_id, loads(msg), None)
+        response = self._proto["client_rpc_response"].decode(msg)
+        if "error" in response:
+            return callback(request_id, None, Exception(response["error"]))
+        payload = response.get("payload")
+        callback(request_id, loads(payload) if payload else None, None)
+
+    # Switch this client to the protobuf payload format of a ThingsBoard
+    # device profile. telemetry and attributes are the profile's schemas
+    # as protobuf field dicts, e.g. {"temperature": (1, "double")}; the
+    # RPC schemas default to the profile defaults. Protobuf telemetry is
+    # published right away, without batching or the offline queue, which
+    # both store JSON. Call before connect().
+    def use_protobuf(self, telemetry, attributes, rpc_request=None, rpc_response=None):
+        from . import protobuf
+
+        if rpc_request is None:
+            rpc_request = protobuf.RPC_REQUEST
+        if rpc_response is None:
+            rpc_response = protobuf.RPC_RESPONSE
+        self._proto = {
+            "telemetry": protobuf.Message(telemetry),
+            "attributes": protobuf.Message(attributes),
+            "rpc_request": protobuf.Message(rpc_request),
+            "rpc_response": protobuf.Message(rpc_response),
+            "attributes_request": protobuf.Message(protobuf.ATTRIBUTES_REQUEST),
+            "attributes_response": protobuf.Message(protobuf.ATTRIBUTES_RESPONSE),
+            "attributes_update": protobuf.Message(protobuf.ATTRIBUTES_UPDATE),
+            "client_rpc_request": protobuf.Message(protobuf.CLIENT_RPC_REQUEST),
+            "client_rpc_response": protobuf.Message(protobuf.CLIENT_RPC_RESPONSE),
+        }
+
+    def set_server_side_rpc_request_handler(self, handler):
+        super().set_server_side_rpc_request_handler(handler)
+        self._rpc_request_handler = handler
+
+    # While batching is enabled send_telemetry only timestamps and buffers
+    # samples; they are published together once one of the limits is hit.
+    # The byte limit never exceeds chunk_size when that is set. Without
+    # the offline queue the batch keeps the latest samples up to the
+    # limits while disconnected and drops older ones.
+    def enable_telemetry_batching(self, max_bytes=1024, max_samples=50, max_age_ms=5000):
+        if self._chunk_size:
+            max_bytes = min(max_bytes, self._chunk_size)
+        batch = self._telemetry_batch
+        if batch is None:
+            from .telemetry_batch import TelemetryBatch
+
+            self._telemetry_batch = TelemetryBatch(max_bytes, max_samples, max_age_ms)
+        else:
+            batch.max_bytes, batch.max_samples, batch.max_age_ms = max_bytes, max_samples, max_age_ms
+        self._batching = True
+
+    # Samples that cannot be sent now are kept and sent once connected
+    def disable_telemetry_batching(self):
+        self._batching = False
+        self.flush_telemetry()
+
+    # Report-by-exception for send_telemetry and send_attributes, see
+    # ReportFilter. Sends left with no keys to report are skipped.
+    def enable_report_by_exception(self, deadbands=None, full_report_ms=300000):
+        from .report_filter import ReportFilter
+
+        self._telemetry_filter = ReportFilter(deadbands, full_report_ms)
+        self._attributes_filter = ReportFilter(deadbands, full_report_ms)
+
+    def disable_report_by_exception(self):
+        self._telemetry_filter = None
+        self._attributes_filter = None
+
+    def _filter_telemetry(self, telemetry):
+        if isinstance(telemetry, list):
+            telemetry = [item for item in (self._filter_telemetry(item) for item in telemetry) if item]
+        elif "ts" in telemetry and "values" in telemetry:
+            values = self._telemetry_filter.filter(telemetry["values"])
+            telemetry = {"ts": telemetry["ts"], "values": values} if values else None
+        else:
+            telemetry = self._telemetry_filter.filter(telemetry)
+        return telemetry
 
-    def check_for_msg(self):
-        self._client.check_msg()
+    # With the offline queue enabled telemetry and attributes sent while
+    # disconnected are stored on flash (telemetry with a device timestamp)
+    # and drained in batches of drain_batch records after reconnecting.
+    # Until it is empty again new messages are stored behind them, so an
+    # attribute value never overtakes an older one.
+    def enable_offline_queue(self, path="/tb_queue", segment_size=8192, max_segments=16, drain_batch=20):
+        from .offline_queue import OfflineQueue
 
+        self._offline_queue = OfflineQueue(path, segment_size, max_segments)
+        self._drain_batch = drain_batch
+
+    def send_telemetry(self, telemetry, *args, **kwargs):
+        if self._telemetry_filter is not None:
+            telemetry = self._filter_telemetry(telemetry)
+            if not telemetry:
+                return
+        if self._proto is not None:
+            return self._client.publish(TELEMETRY_TOPIC, self._proto["telemetry"].encode(telemetry), qos=self._qos)
+        if self._batching:
+            if self._telemetry_batch.add(telemetry):
+                self.flush_telemetry()
+            return
+        if self._offline_queue is None:
+            return super().send_telemetry(telemetry, *args, **kwargs)
+        if not self._store_offline():
+            pid = self._client.pid
+            try:
+                return super().send_telemetry(telemetry, *args, **kwargs)
+            except OSError:
+                self._publish_failed(pid)
+        from .telemetry_batch import stamp
+
+        self._offline_queue.put(TELEMETRY_TOPIC, dumps(stamp(telemetry)))
+
+    def send_attributes(self, attributes, *args, **kwargs):
+        if self._attributes_filter is not None:
+            attributes = self._attributes_filter.filter(attributes)
+            if not attributes:
+                return
+        if self._proto is not None:
+            return self._client.publish(ATTRIBUTES_TOPIC, self._proto["attributes"].encode(attributes), qos=self._qos)
+        if self._offline_queue is None:
+            return super().send_attributes(attributes, *args, **kwargs)
+        if not self._store_offline():
+            pid = self._client.pid
+            try:
+                return super().send_attributes(attributes, *args, **kwargs)
+            except OSError:
+                self._publish_failed(pid)
+        self._offline_queue.put(ATTRIBUTES_TOPIC, dumps(attributes))
+
+    # For telemetry sent with the same keys every cycle:
+    #   template = client.telemetry_template("temperature", "humidity")
+    #   client.send_telemetry_values(template, 21.5, 40)
+    # The payload is formatted straight into the template's buffer.
+    # Batching, filtering, protobuf and storing while offline go through
+    # send_telemetry() as usual.
+    def telemetry_template(self, *keys):
+        from .telemetry_batch import TelemetryTemplate
+
+        return TelemetryTemplate(keys)
+
+    def send_telemetry_values(self, template, *values):
+        if (self._batching or self._telemetry_filter is not None or self._proto is not None
+                or self._store_offline()):
+            return self.send_telemetry(dict(zip(template.keys, values)))
+        payload = template.render(values)
+        if self._qos:
+            # Kept for retransmission until acknowledged
+            payload = bytes(payload)
+        pid = self._client.pid
+        try:
+            return self._client.publish(_TELEMETRY_TOPIC, payload, qos=self._qos)
+        except OSError:
+            if self._offline_queue is None:
+                raise
+            self._publish_failed(pid)
+        self.send_telemetry(dict(zip(template.keys, values)))
+
+    # Publishes the batched samples while connected (or stores them in the
+    # offline queue). The samples of a publish that fails are put back
+    # and the client counts as disconnected, so none of them are lost.
+    def flush_telemetry(self):
+        batch = self._telemetry_batch
+        if batch is None:
+            return
+        if self._offline_queue is not None:
+            while batch:
+                self._publish_or_store(TELEMETRY_TOPIC, batch.take())
+        elif self.connected:
+            while batch:
+                payload = batch.take()
+                pid = self._client.pid
+                try:
+                    self._client.publish(TELEMETRY_TOPIC, payload, qos=self._qos)
+                except OSError as e:
+                    self._publish_failed(pid)
+                    batch.restore(payload)
+                    print(f"Telemetry batch kept for later: {e}")
+                    break
+        batch.trim()
+        if not batch and not self._batching:
+            self._telemetry_batch = None
+
+    def _publish_or_store(self, topic, payload):
+        queue = self._offline_queue
+        if queue is None:
+            return self._client.publish(topic, payload, qos=self._qos)
+        if not self._store_offline():
+            pid = self._client.pid
+            try:
+                return self._client.publish(topic, payload, qos=self._qos)
+            except OSError:
+                self._publish_failed(pid)
+        queue.put(topic, payload)
+
+    # Whether a message has to go to the offline queue: while offline and
+    # while older messages are still waiting there
+    def _store_offline(self):
+        queue = self._offline_queue
+        return queue is not None and (not self.connected or bool(queue))
+
+    # After a failed publish of a message that is kept to be sent later,
+    # in the offline queue or the telemetry batch. If publish() got as far as taking a packet id (pid is the
+    # one from before), the message is in the client's in-flight window,
+    # which is retransmitted after reconnecting; it is taken out again so
+    # it is not delivered twice.
+    def _publish_failed(self, pid):
+        self.connected = False
+        client = self._client
+        if client.pid != pid:
+            client.discard(client.pid)
+
+    # Send stored records in batches. Telemetry records carry their own
+    # timestamps, so they are merged into a single array publish. A batch
+    # is acknowledged on flash once the server confirmed all of its
+    # messages, which is checked on later calls instead of waiting here.
+    # Should the link drop before, the in-flight window retransmits them
+    # after the reconnect, so they are not sent from flash again.
+    def _drain_offline(self):
+        pids = self._drain_pids
+        if pids is not None:
+            inflight = self._client.inflight
+            for pid in pids:
+                if pid in inflight:
+                    return
+            self._drain_pids = None
+            self._offline_queue.commit()
+        try:
+            self._send_offline_batch()
+        except OSError as e:
+            self.connected = False
+            print(f"Offline queue drain interrupted: {e}")
+
+    # A batch that could not be sent completely is taken out of the
+    # in-flight window and sent from flash again after the reconnect
+    def _send_offline_batch(self):
+        queue = self._offline_queue
+        if queue is None or not self.connected or not queue:
+            return False
+        client = self._client
+        pids = []
+        pid = client.pid
+        try:
+            telemetry = []
+            for topic, payload in queue.peek(self._drain_batch):
+                if topic == TELEMETRY_TOPIC:
+                    payload = payload[1:-1] if payload[0] == "[" else payload
+                    if payload:
+                        telemetry.append(payload)
+                else:
+                    pids.append(client.publish(topic, payload, qos=self._qos))
+                    pid = client.pid
+            if telemetry:
+                pids.append(client.publish(TELEMETRY_TOPIC, "[" + ",".join(telemetry) + "]", qos=self._qos))
+        except OSError:
+            if client.pid != pid:
+                pids.append(client.pid)
+            for pid in pids:
+                client.discard(pid)
+            raise
+        self._drain_pids = [pid for pid in pids if pid is not None]
+        return True
+
+    # Without an offline queue samples stay batched while disconnected.
+    # Those left when batching was disabled go out as soon as possible.
+    def _flush_due_telemetry(self):
+        batch = self._telemetry_batch
+        if (batch is not None and (self.connected or self._offline_queue is not None)
+                and (not self._batching or batch.due())):
+            self.flush_telemetry()
+
+    def disconnect(self, *args, **kwargs):
+        if self.connected:
+            self.flush_telemetry()
+        return super().disconnect(*args, **kwargs)
+
+    # Requests return their request id right away. The callback runs from
+    # check_for_msg/wait_for_msg when the response arrives, or with an
+    # OSError(ETIMEDOUT) once timeout seconds (default request_timeout)
+    # have passed without one.
+
+    # callback(result, exception) receives the requested attributes
+    def request_attributes(self, client_keys=None, shared_keys=None, callback=None, timeout=None):
+        msg = {}
+        if client_keys:
+            msg["clientKeys"] = ",".join(client_keys)
+        if shared_keys:
+            msg["sharedKeys"] = ",".join(shared_keys)
+        self._attr_request_id += 1
+        request_id = self._attr_request_id
+        if callback is not None:
+            self._add_pending(self._attr_requests, request_id, callback, timeout)
+        payload = dumps(msg) if self._proto is None else self._proto["attributes_request"].encode(msg)
+        self._client.publish(ATTRIBUTES_REQUEST_TOPIC + str(request_id), payload, qos=self._qos)
+        return request_id
+
+    # callback(request_id, response, exception) receives the server reply
+    def send_rpc_call(self, method, params, callback, timeout=None):
+        self._rpc_call_id += 1
+        request_id = self._rpc_call_id
+        self._add_pending(self._rpc_calls, request_id, callback, timeout)
+        if self._proto is None:
+            payload = dumps({"method": method, "params": params})
+        else:
+            payload = self._proto["client_rpc_request"].encode(
+                {"requestId": request_id, "methodName": method, "params": dumps(params)})
+        self._client.publish(RPC_REQUEST_TOPIC + str(request_id), payload, qos=self._qos)
+        return request_id
+
+    def send_rpc_reply(self, req_id, resp, *args, **kwargs):
+        if self._proto is None:
+            return super().send_rpc_reply(req_id, resp, *args, **kwargs)
+        return self._client.publish(RPC_RESPONSE_TOPIC + str(req_id),
+                                    self._proto["rpc_response"].encode({"payload": dumps(resp)}), qos=self._qos)
+
+    # Firmware update over the v2/fw chunk topics, see FirmwareUpdate.
+    # The image goes to writer (default: the inactive OTA partition) in
+    # chunk_size pieces (default 4096). Nothing is downloaded when the
+    # assigned fw_version equals current_version. The update progresses
+    # from check_for_msg/wait_for_msg; run_firmware_update() blocks until
+    # it is done. Neither activates the new image, see
+    # PartitionWriter.activate(). Progress is checkpointed to state_path,
+    # so an interrupted download of the same image continues from there
+    # on the next call, also after a reboot; pass None to disable.
+    def start_firmware_update(self, current_version=None, writer=None, window=2, callback=None,
+                              state_path="/tb_fw_state"):
+        from .firmware import FW_RESPONSE_TOPIC
+
+        self._client.subscribe(FW_RESPONSE_TOPIC + "+/chunk/+")
+        return self._request_firmware(current_version, writer, window, callback, state_path)
+
+    def run_firmware_update(self, current_version=None, writer=None, window=2, state_path="/tb_fw_state"):
+        update = self.start_firmware_update(current_version, writer, window, state_path=state_path)
+        while not update.done:
+            self.check_for_msg()
+            time.sleep_ms(5)
+        return update
+
+    def _request_firmware(self, current_version, writer, window, callback, state_path):
+        from .firmware import FW_ATTRIBUTES, FirmwareUpdate, PartitionWriter
+
+        update = FirmwareUpdate(self._client, writer or PartitionWriter(), self._chunk_size or 4096, window,
+                                callback=callback, state_path=state_path)
+
+        def on_info(result, error):
+            info = result and result.get("shared")
+            if error is not None:
+                update.fail("no firmware info: %s" % error)
+            elif not info or "fw_size" not in info:
+                update.fail("no firmware assigned")
+            elif info.get("fw_version") == current_version:
+                update.skip()
+            else:
+                self._fw_request_id += 1
+                update.start(self._fw_request_id, info)
+
+        self._firmware = update
+        self.request_attributes(shared_keys=FW_ATTRIBUTES, callback=on_info)
+        return update
+
+    def _check_firmware(self):
+        if self._firmware is not None:
+            self._firmware.check()
+            if self._firmware.done:
+                self._firmware = None
+
+    def set_delivery_callback(self, callback):
+        # callback(pid) fires when a QoS 1 message is acknowledged by the server
+        self._client.set_puback_callback(callback)
+
+    # Smoothed PINGREQ round-trip time in ms, None until the first ping
+    @property
+    def ping_rtt_ms(self):
+        return self._client.rtt_ms
+
+    # Duration of the last TLS handshake in ms, None without TLS
+    @property
+    def tls_handshake_ms(self):
+        return self._client.handshake_ms
+
+    # Run after every wait_for_msg/check_for_msg, see ClientLoop
+    def _housekeeping(self):
+        self._expire_requests()
+        self._flush_due_telemetry()
+        if self.connected:
+            self._check_firmware()
+            self._drain_offline()
+            self._publish_due_metrics()
+
+    # See ClientLoop._due_ms. Batched samples left after batching was
+    # disabled, and the next offline batch once the previous one needs
+    # no more PUBACKs, are due right away.
+    def _due_ms(self):
+        due = []
+        batch = self._telemetry_batch
+        if batch is not None:
+            due.append(batch.due_ms() if self._batching else 0)
+        if self._firmware is not None:
+            due.append(self._firmware.due_ms())
+        if self.connected:
+            if self._metrics_interval:
+                due.append(max(time.ticks_diff(self._metrics_due, time.ticks_ms()), 0))
+            if self._offline_queue and not self._drain_pids:
+                due.append(0)
+        return due
+
+    # With credentials_path the credentials are stored on flash (written
+    # atomically) and returned from there on later calls for the same
+    # server, without connecting. Remove the file to provision again.
     @staticmethod
-    def provision(host, port, provision_request):
-        provision_client = ProvisionClient(host=host, port=port, provision_request=provision_request)
+    def provision(host, port, provision_request, credentials_path=None, ssl=False, ssl_params={}):
+        if credentials_path is not None:
+            credentials = _load_credentials(credentials_path, host, port)
+            if credentials:
+                return credentials
+
+        provision_client = ProvisionClient(host=host, port=port, provision_request=provision_request, ssl=ssl,
+                                           ssl_params=ssl_params)
         provision_client.provision()
 
         if provision_client.credentials:
             print("Provisioning successful. Credentials obtained.")
+            if credentials_path is not None:
+                _save_credentials(credentials_path, host, port, provision_client.credentials)
             return provision_client.credentials
         else:
             print("Provisioning failed. No credentials obtained.")
@@ -0,0 +1,171 @@
+#      Copyright 2026. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+#
+
+import uasyncio as asyncio
+
+from .tb_device_mqtt import TBDeviceMqttClient
+from .umqtt import MQTTException
+from .umqtt_async import MQTTClientAsync
+
+
+# Same API as TBDeviceMqttClient, but connect/disconnect and the
+# firmware update methods are coroutines. Incoming messages are handled
+# by the reader task of the client, and the periodic work of
+# wait_for_msg()/check_for_msg() (request timeouts, firmware chunk
+# retries, the batch age limit, draining the offline queue and scheduled
+# metrics) by a housekeeping task every housekeeping_ms, which runs from
+# connect() until disconnect().
+class TBDeviceMqttClientAsync(TBDeviceMqttClient):
+    client_class = MQTTClientAsync
+
+    housekeeping_ms = 100
+    _supervisor = None
+    _housekeeper = None
+
+    async def connect(self, timeout=5):
+        try:
+            response = await self._client.connect(clean_session=not self._persistent_session, timeout=timeout)
+            if response:
+                self._route_required_topics()
+            else:
+                await self._client.subscribe_many([(topic, 1, handler)
+                                                   for topic, handler in self._required_subscriptions()])
+
+            self.connected = True
+            if self._backoff is not None and self._supervisor is None:
+                self._supervisor = asyncio.create_task(self._supervise(timeout))
+            if self._housekeeper is None:
+                self._housekeeper = asyncio.create_task(self._housekeep())
+            return response
+        except MQTTException as e:
+            self.connected = False
+            print(f"MQTT connection error: {e}")
+        except Exception as e:
+            self.connected = False
+            print(f"Unexpected connection error: {e}")
+
+    # With auto reconnect enabled this task waits for the reader to stop
+    # and then reconnects with the same backoff as the blocking client
+    async def _supervise(self, timeout):
+        backoff = self._backoff
+        try:
+            while self._backoff is backoff:
+                await self._client.lost()
+                self.connected = False
+                while not self.connected and self._backoff is backoff:
+                    await asyncio.sleep_ms(backoff.wait_ms())
+                    self._count("reconnect_attempts")
+                    await self.connect(timeout)
+                    if self.connected:
+                        self._count("reconnects")
+                        backoff.reset()
+                    else:
+                        backoff.failed()
+        finally:
+            self._supervisor = None
+
+    async def _housekeep(self):
+        try:
+            while True:
+                try:
+                    self._housekeeping()
+                    if self.connected:
+                        await self._client.sock.drain()
+                except OSError as e:
+                    self.connected = False
+                    print(f"Housekeeping interrupted: {e}")
+                await asyncio.sleep_ms(self.housekeeping_ms)
+        finally:
+            self._housekeeper = None
+
+    async def disconnect(self):
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+        if self._housekeeper is not None:
+            self._housekeeper.cancel()
+        if self.connected:
+            self.flush_telemetry()
+        self.connected = False
+        await self._client.disconnect()
+
+    # Nothing to wait for here, both only run the housekeeping once more
+    def check_for_msg(self):
+        self._housekeeping()
+
+    wait_for_msg = check_for_msg
+
+    # The *_async methods wrap the regular API: the request goes out
+    # through the regular method and the coroutine resumes once the reader
+    # task has seen the PUBACK or the response.
+    async def send_telemetry_async(self, telemetry):
+        await self._delivered(self.send_telemetry, telemetry)
+
+    async def send_attributes_async(self, attributes):
+        await self._delivered(self.send_attributes, attributes)
+
+    # Returns (result, exception) as the request_attributes callback gets them
+    async def request_attributes_async(self, client_keys=None, shared_keys=None, timeout=10):
+        return await self._response(
+            self._attr_requests,
+            lambda callback: self.request_attributes(client_keys, shared_keys, callback, timeout), timeout)
+
+    # Returns (request_id, response, exception) as the send_rpc_call callback gets them
+    async def send_rpc_call_async(self, method, params, timeout=10):
+        return await self._response(
+            self._rpc_calls, lambda callback: self.send_rpc_call(method, params, callback, timeout), timeout)
+
+    # Coroutines here, unlike in TBDeviceMqttClient: the chunk subscription
+    # has to be awaited, and waiting for the update must not block the
+    # reader task. Chunk retries and the timeout of the info request are
+    # handled by the housekeeping task; without it, or without a way back
+    # online, the update would never end.
+    async def start_firmware_update(self, current_version=None, writer=None, window=2, callback=None,
+                                    state_path="/tb_fw_state"):
+        from .firmware import FW_RESPONSE_TOPIC
+
+        await self._client.subscribe(FW_RESPONSE_TOPIC + "+/chunk/+")
+        return self._request_firmware(current_version, writer, window, callback, state_path)
+
+    async def run_firmware_update(self, current_version=None, writer=None, window=2, state_path="/tb_fw_state"):
+        update = await self.start_firmware_update(current_version, writer, window, state_path=state_path)
+        while not update.done:
+            await asyncio.sleep_ms(self.housekeeping_ms)
+            if self._housekeeper is None or not self.connected and self._backoff is None:
+                update.fail("connection lost")
+        return update
+
+    run_firmware_update_async = run_firmware_update
+
+    async def _delivered(self, send, payload):
+        pid = self._client.pid
+        send(payload)
+        await self._client.delivered(self._client.pid if self._client.pid != pid else None)
+
+    async def _response(self, pending, request, timeout):
+        done = asyncio.Event()
+        result = []
+
+        def callback(*args):
+            result.extend(args)
+            done.set()
+
+        request_id = request(callback)
+        await self._client.delivered()
+        try:
+            await asyncio.wait_for(done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pending.pop(request_id, None)
+            raise
+        return tuple(result)
@@ -0,0 +1,220 @@
+#      Copyright 2026. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+#
+
+import os
+from binascii import hexlify
+from json import dumps, loads
+
+from .client_loop import ClientLoop, PendingRequests, _attributes_timeout
+from .telemetry_batch import GatewayTelemetryBatch, stamp
+from .umqtt import MQTTClient, MQTTException
+
+GATEWAY_CONNECT_TOPIC = "v1/gateway/connect"
+GATEWAY_DISCONNECT_TOPIC = "v1/gateway/disconnect"
+GATEWAY_TELEMETRY_TOPIC = "v1/gateway/telemetry"
+GATEWAY_ATTRIBUTES_TOPIC = "v1/gateway/attributes"
+GATEWAY_ATTRIBUTES_REQUEST_TOPIC = "v1/gateway/attributes/request"
+GATEWAY_ATTRIBUTES_RESPONSE_TOPIC = "v1/gateway/attributes/response"
+GATEWAY_RPC_TOPIC = "v1/gateway/rpc"
+
+
+# Client for the ThingsBoard Gateway MQTT API: one connection, one TLS
+# handshake and one keepalive carry the data of many sub-devices, which
+# are addressed by name. Sub-devices announced with gw_connect_device()
+# are announced again after every reconnect. Reconnecting, request
+# timeouts and wait_for_msg/check_for_msg work as in TBDeviceMqttClient.
+class TBGatewayMqttClient(ClientLoop):
+    client_class = MQTTClient
+
+    def __init__(self, host, port=1883, access_token=None, quality_of_service=None, client_id=None,
+                 max_inflight=0, ssl=False, ssl_params={}):
+        if client_id is None:
+            client_id = "tb_gw_" + hexlify(os.urandom(4)).decode()
+        self._client = self.client_class(
+            client_id, host, port, access_token, 'pswd', keepalive=120, ssl=ssl, ssl_params=ssl_params,
+            max_inflight=max_inflight
+        )
+        self._client.set_callback(self._on_unrouted)
+        self._qos = 1 if quality_of_service is None else quality_of_service
+        self.connected = False
+        # Connected sub-devices: name -> device type
+        self._devices = {}
+        self._telemetry_batch = None
+        self._batching = False
+        # Outstanding attribute requests by request id
+        self.request_timeout = 10
+        self._attr_request_id = 0
+        self._attr_requests = PendingRequests(_attributes_timeout)
+        self._requests = (self._attr_requests,)
+        self._rpc_request_handler = None
+        self._attributes_update_handler = None
+
+    def connect(self, timeout=5):
+        try:
+            self._client.connect(timeout=timeout)
+            self._client.subscribe_many((
+                (GATEWAY_ATTRIBUTES_TOPIC, 1, self._on_attributes_update),
+                (GATEWAY_ATTRIBUTES_RESPONSE_TOPIC, 1, self._on_attributes_response),
+                (GATEWAY_RPC_TOPIC, 1, self._on_rpc_request),
+            ))
+            self.connected = True
+            for name, device_type in self._devices.items():
+                self._client.publish(GATEWAY_CONNECT_TOPIC, dumps({"device": name, "type": device_type}),
+                                     qos=self._qos)
+            return True
+        except MQTTException as e:
+            self.connected = False
+            print(f"MQTT connection error: {e}")
+        except Exception as e:
+            self.connected = False
+            print(f"Unexpected connection error: {e}")
+
+    def disconnect(self):
+        if self.connected:
+            self.flush_telemetry()
+            self._client.disconnect()
+        self.connected = False
+
+    # Tell the server that a sub-device is online; it is created on first use
+    def gw_connect_device(self, device_name, device_type="default"):
+        self._devices[device_name] = device_type
+        return self._client.publish(GATEWAY_CONNECT_TOPIC, dumps({"device": device_name, "type": device_type}),
+                                    qos=self._qos)
+
+    def gw_disconnect_device(self, device_name):
+        self._devices.pop(device_name, None)
+        return self._client.publish(GATEWAY_DISCONNECT_TOPIC, dumps({"device": device_name}), qos=self._qos)
+
+    # While batching is enabled gw_send_telemetry only timestamps and
+    # buffers samples; the samples of all sub-devices are published
+    # together once one of the limits is hit, see GatewayTelemetryBatch.
+    # While disconnected the batch keeps the latest samples up to the
+    # limits and drops older ones, so it cannot exhaust the heap during
+    # a long outage.
+    def enable_telemetry_batching(self, max_bytes=1024, max_samples=50, max_age_ms=5000):
+        batch = self._telemetry_batch
+        if batch is None:
+            self._telemetry_batch = GatewayTelemetryBatch(max_bytes, max_samples, max_age_ms)
+        else:
+            batch.max_bytes, batch.max_samples, batch.max_age_ms = max_bytes, max_samples, max_age_ms
+        self._batching = True
+
+    # Samples that cannot be sent now are kept and sent once connected
+    def disable_telemetry_batching(self):
+        self._batching = False
+        self.flush_telemetry()
+
+    # telemetry is a values dict, a {"ts", "values"} dict or a list of those
+    def gw_send_telemetry(self, device_name, telemetry):
+        if self._batching:
+            if self._telemetry_batch.add(device_name, telemetry):
+                self.flush_telemetry()
+            return
+        if not isinstance(telemetry, list):
+            telemetry = [telemetry]
+        return self._client.publish(GATEWAY_TELEMETRY_TOPIC, dumps({device_name: stamp(telemetry)}), qos=self._qos)
+
+    def gw_send_attributes(self, device_name, attributes):
+        return self._client.publish(GATEWAY_ATTRIBUTES_TOPIC, dumps({device_name: attributes}), qos=self._qos)
+
+    # Publishes the batched samples while connected. The samples of a
+    # publish that fails are put back and the client counts as
+    # disconnected, so none of them are lost.
+    def flush_telemetry(self):
+        batch = self._telemetry_batch
+        if batch is None:
+            return
+        client = self._client
+        while self.connected and batch:
+            payload = batch.take()
+            pid = client.pid
+            try:
+                client.publish(GATEWAY_TELEMETRY_TOPIC, payload, qos=self._qos)
+            except OSError as e:
+                self.connected = False
+                # Not retransmitted after the reconnect, it is sent again from the batch
+                if client.pid != pid:
+                    client.discard(client.pid)
+                batch.restore(payload)
+                print(f"Telemetry batch kept for later: {e}")
+        batch.trim()
+        if not batch and not self._batching:
+            self._telemetry_batch = None
+
+    # callback(response, exception) receives the server's response, e.g.
+    # {"id": 1, "device": "Sensor A", "values": {"interval": 60}}
+    def gw_request_attributes(self, device_name, keys, client=False, callback=None, timeout=None):
+        self._attr_request_id += 1
+        request_id = self._attr_request_id
+        if callback is not None:
+            self._add_pending(self._attr_requests, request_id, callback, timeout)
+        msg = {"id": request_id, "device": device_name, "client": client, "keys": list(keys)}
+        self._client.publish(GATEWAY_ATTRIBUTES_REQUEST_TOPIC, dumps(msg), qos=self._qos)
+        return request_id
+
+    # handler(device_name, request_id, {"method": .., "params": ..}); the
+    # reply goes out with gw_send_rpc_reply()
+    def gw_set_server_side_rpc_request_handler(self, handler):
+        self._rpc_request_handler = handler
+
+    def gw_send_rpc_reply(self, device_name, request_id, response):
+        return self._client.publish(GATEWAY_RPC_TOPIC, dumps({"device": device_name, "id": request_id,
+                                                              "data": response}), qos=self._qos)
+
+    # handler(device_name, attributes) receives shared attribute updates
+    def gw_set_attributes_update_handler(self, handler):
+        self._attributes_update_handler = handler
+
+    def set_delivery_callback(self, callback):
+        self._client.set_puback_callback(callback)
+
+    def _on_unrouted(self, topic, msg):
+        pass
+
+    def _on_attributes_update(self, topic, msg):
+        if self._attributes_update_handler is not None:
+            update = loads(msg)
+            self._attributes_update_handler(update.get("device"), update.get("data"))
+
+    def _on_attributes_response(self, topic, msg):
+        response = loads(msg)
+        callback = self._attr_requests.pop(response.get("id"))
+        if callback is not None:
+            callback(response, None)
+
+    def _on_rpc_request(self, topic, msg):
+        request = loads(msg)
+        data = request.get("data", {})
+        if self._rpc_request_handler is not None:
+            self._rpc_request_handler(request.get("device"), data.get("id"),
+                                      {"method": data.get("method"), "params": data.get("params")})
+
+    # Samples left when batching was disabled go out as soon as possible
+    def _flush_due_telemetry(self):
+        batch = self._telemetry_batch
+        if batch is not None and self.connected and (not self._batching or batch.due()):
+            self.flush_telemetry()
+
+    # See ClientLoop._due_ms
+    def _due_ms(self):
+        batch = self._telemetry_batch
+        if batch is None:
+            return ()
+        return (batch.due_ms() if self._batching else 0,)
+
+    # Run after every wait_for_msg/check_for_msg, see ClientLoop
+    def _housekeeping(self):
+        self._expire_requests()
+        self._flush_due_telemetry()
@@ -0,0 +1,266 @@
+#      Copyright 2026. ThingsBoard
+#  #
+#      Licensed under the Apache License, Version 2.0 (the "License");
+#      you may not use this file except in compliance with the License.
+#      You may obtain a copy of the License at
+#  #
+#          http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#      Unless required by applicable law or agreed to in writing, software
+#      distributed under the License is distributed on an "AS IS" BASIS,
+#      WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#      See the License for the specific language governing permissions and
+#      limitations under the License.
+#
+
+import time
+from json import dumps, loads
+
+# Some ports count time from 2000-01-01 instead of the Unix epoch
+_EPOCH_OFFSET_MS = 946684800000 if time.gmtime(0)[0] == 2000 else 0
+
+
+def now_ms():
+    return time.time_ns() // 1000000 + _EPOCH_OFFSET_MS
+
+
+# Attach a device-side timestamp unless the sample already carries one
+def stamp(telemetry, ts=None):
+    if isinstance(telemetry, list):
+        return [stamp(item, ts) for item in telemetry]
+    if "ts" in telemetry and "values" in telemetry:
+        return telemetry
+    return {"ts": ts or now_ms(), "values": telemetry}
+
+
+# Collects timestamped telemetry samples as ready-made JSON fragments and
+# hands them out as '[{"ts":..,"values":{..}},..]' payloads, which
+# ThingsBoard accepts in a single publish.
+class TelemetryBatch:
+    def __init__(self, max_bytes=1024, max_samples=50, max_age_ms=5000):
+        self.max_bytes = max_bytes
+        self.max_samples = max_samples
+        self.max_age_ms = max_age_ms
+        self._parts = []
+        self._size = 1
+        self._since = 0
+
+    def __len__(self):
+        return len(self._parts)
+
+    # Add a sample (values dict, {"ts", "values"} dict or a list of
+    # those). Returns True when the batch should be flushed.
+    def add(self, telemetry, ts=None):
+        if isinstance(telemetry, list):
+            for item in telemetry:
+                self.add(item, ts)
+            return self.due()
+        part = dumps(stamp(telemetry, ts))
+        if not self._parts:
+            self._since = time.ticks_ms()
+        self._parts.append(part)
+        self._size += len(part) + 1
+        return self.due()
+
+    def due(self):
+        if not self._parts:
+            return False
+        return (len(self._parts) >= self.max_samples or self._size >= self.max_bytes
+                or time.ticks_diff(time.ticks_ms(), self._since) >= self.max_age_ms)
+
+    # ms until the batch is due by age, None while empty
+    def due_ms(self):
+        if not self._parts:
+            return None
+        return max(self.max_age_ms - time.ticks_diff(time.ticks_ms(), self._since), 0)
+
+    # Drop the oldest samples until at most max_samples and max_bytes are
+    # left (a single sample is kept even if larger); for samples that
+    # cannot be sent, e.g. while disconnected. Returns the number dropped.
+    def trim(self):
+        parts = self._parts
+        n = 0
+        while len(parts) - n > 1 and (len(parts) - n > self.max_samples or self._size > self.max_bytes):
+            self._size -= len(parts[n]) + 1
+            n += 1
+        del parts[:n]
+        return n
+
+    # Put the samples of a payload from take() back in front, after it
+    # could not be published
+    def restore(self, payload):
+        parts = [dumps(item) for item in loads(payload)]
+        if not self._parts:
+            self._since = time.ticks_ms()
+        self._parts[:0] = parts
+        for part in parts:
+            self._size += len(part) + 1
+
+    # Remove and return the oldest samples that fit into max_bytes as one
+    # JSON array. A single sample larger than max_bytes is returned alone.
+    def take(self):
+        parts = self._parts
+        n = 0
+        size = 1
+        for part in parts:
+            if n and size + len(part) + 1 > self.max_bytes:
+                break
+            size += len(part) + 1
+            n += 1
+        payload = "[" + ",".join(parts[:n]) + "]"
+        del parts[:n]
+        self._size -= size - 1
+        self._since = time.ticks_ms()
+        return payload
+
+
+# TelemetryBatch for a gateway: samples of many sub-devices, handed out
+# as '{"device":[{"ts":..,"values":{..}},..],..}' payloads for
+# v1/gateway/telemetry, so they share one publish.
+class GatewayTelemetryBatch:
+    def __init__(self, max_bytes=1024, max_samples=50, max_age_ms=5000):
+        self.max_bytes = max_bytes
+        self.max_samples = max_samples
+        self.max_age_ms = max_age_ms
+        # Device name -> JSON fragments of its samples
+        self._devices = {}
+        self._count = 0
+        self._size = 2
+        self._since = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, device, telemetry, ts=None):
+        if isinstance(telemetry, list):
+            for item in telemetry:
+                self.add(device, item, ts)
+            return self.due()
+        part = dumps(stamp(telemetry, ts))
+        if not self._count:
+            self._since = time.ticks_ms()
+        parts = self._devices.get(device)
+        if parts is None:
+            parts = self._devices[device] = []
+            # '"device":[' and '],'
+            self._size += len(dumps(device)) + 4
+        parts.append(part)
+        self._size += len(part) + 1
+        self._count += 1
+        return self.due()
+
+    def due(self):
+        if not self._count:
+            return False
+        return (self._count >= self.max_samples or self._size >= self.max_bytes
+                or time.ticks_diff(time.ticks_ms(), self._since) >= self.max_age_ms)
+
+    def due_ms(self):
+        if not self._count:
+            return None
+        return max(self.max_age_ms - time.ticks_diff(time.ticks_ms(), self._since), 0)
+
+    # Drop samples, the oldest of each device in turn, until at most
+    # max_samples and max_bytes are left (a single sample is kept even if
+    # larger); for samples that cannot be sent, e.g. while disconnected.
+    # Returns the number of samples dropped.
+    def trim(self):
+        dropped = 0
+        while self._count > 1 and (self._count > self.max_samples or self._size > self.max_bytes):
+            for device in list(self._devices):
+                parts = self._devices[device]
+                self._size -= len(parts.pop(0)) + 1
+                self._count -= 1
+                dropped += 1
+                if not parts:
+                    del self._devices[device]
+                    self._size -= len(dumps(device)) + 4
+                if self._count <= 1 or self._count <= self.max_samples and self._size <= self.max_bytes:
+                    break
+        return dropped
+
+    # Put the samples of a payload from take() back in front of those of
+    # their devices, after it could not be published
+    def restore(self, payload):
+        if not self._count:
+            self._since = time.ticks_ms()
+        for device, samples in loads(payload).items():
+            parts = [dumps(item) for item in samples]
+            old = self._devices.get(device)
+            if old is None:
+                self._devices[device] = old = []
+                self._size += len(dumps(device)) + 4
+            old[:0] = parts
+            for part in parts:
+                self._size += len(part) + 1
+            self._count += len(parts)
+
+    # Remove and return the oldest samples that fit into max_bytes as one
+    # JSON object. A single sample larger than max_bytes is returned alone.
+    def take(self):
+        entries = []
+        size = 2
+        taken = 0
+        for device in list(self._devices):
+            parts = self._devices[device]
+            head = dumps(device) + ":["
+            n = 0
+            part_size = len(head) + 2
+            for part in parts:
+                if (taken or n) and size + part_size + len(part) + 1 > self.max_bytes:
+                    break
+                part_size += len(part) + 1
+                n += 1
+            if n:
+                entries.append(head + ",".join(parts[:n]) + "]")
+                del parts[:n]
+                size += part_size
+                taken += n
+                self._size -= part_size - len(head) - 2
+            if parts:
+                break
+            del self._devices[device]
+            self._size -= len(head) + 2
+        self._count -= taken
+        self._since = time.ticks_ms()
+        return "{" + ",".join(entries) + "}"
+
+
+_LITERALS = {True: b"true", False: b"false", None: b"null"}
+
+
+# A telemetry object whose keys never change. The '{"key":' and
+# ',"key":' fragments are encoded once; render() only formats the values
+# into a reusable buffer, without building a dict or re-encoding keys.
+class TelemetryTemplate:
+    def __init__(self, keys, size=128):
+        assert keys
+        self.keys = keys
+        self._parts = [(("," if i else "{") + dumps(key) + ":").encode() for i, key in enumerate(keys)]
+        self._buf = bytearray(size)
+        self._mv = memoryview(self._buf)
+
+    # Returns a memoryview of the JSON object, valid until the next call
+    def render(self, values):
+        assert len(values) == len(self._parts)
+        n = 0
+        for part, value in zip(self._parts, values):
+            n = self._put(n, part)
+            if value is True or value is False or value is None:
+                n = self._put(n, _LITERALS[value])
+            elif isinstance(value, int):
+                n = self._put(n, b"%d" % value)
+            else:
+                n = self._put(n, dumps(value).encode())
+        n = self._put(n, b"}")
+        return self._mv[:n]
+
+    def _put(self, n, data):
+        end = n + len(data)
+        if end > len(self._buf):
+            buf = bytearray(max(end, 2 * len(self._buf)))
+            buf[:n] = self._buf[:n]
+            self._buf = buf
+            self._mv = memoryview(buf)
+        self._buf[n:end] = data
+        return end
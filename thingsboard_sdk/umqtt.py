@@ -1,11 +1,39 @@
+import uselect as select
 import usocket as socket
 import ustruct as struct
+import utime as time
+from uerrno import ETIMEDOUT
 
 
 class MQTTException(Exception):
     pass
 
 
+def _b(s):
+    # Strings are sent as UTF-8, so lengths must be taken on the encoded form
+    return s.encode() if isinstance(s, str) else s
+
+
+# Resolved addresses shared by all clients: (host, port) -> (addr, expiry in ticks_ms)
+_addr_cache = {}
+# Last TLS session per server and credentials, so a new client to the
+# same server (e.g. the device connection after provisioning) can resume
+# it too, while one with other credentials does a full handshake
+_tls_sessions = {}
+_TLS_KEY_PARAMS = ("key", "cert", "keyfile", "certfile", "cadata", "cert_reqs", "server_hostname")
+
+
+# getaddrinfo() result cached for ttl seconds
+def resolve(host, port, ttl=300):
+    key = (host, port)
+    entry = _addr_cache.get(key)
+    if entry is not None and time.ticks_diff(entry[1], time.ticks_ms()) > 0:
+        return entry[0]
+    addr = socket.getaddrinfo(host, port)[0][-1]
+    _addr_cache[key] = (addr, time.ticks_add(time.ticks_ms(), ttl * 1000))
+    return addr
+
+
 class MQTTClient:
     def __init__(
         self,
@@ -17,9 +45,18 @@ class MQTTClient:
         keepalive=0,
         ssl=False,
         ssl_params={},
+        wbuf_size=512,
+        rbuf_size=512,
+        max_inflight=0,
+        max_msg_size=0,
+        zero_copy=False,
+        dns_ttl=300,
     ):
         if port == 0:
             port = 8883 if ssl else 1883
+        if zero_copy:
+            assert max_msg_size, "zero_copy needs max_msg_size"
+            rbuf_size = max(rbuf_size, max_msg_size)
         self.client_id = client_id
         self.sock = None
         self.server = server
@@ -28,6 +65,10 @@ class MQTTClient:
         self.ssl_params = ssl_params
         self.pid = 0
         self.cb = None
+        # Topic -> callback. Filters ending in "/+" are stored as their
+        # prefix, so a message is routed with at most two dict lookups;
+        # unrouted messages go to the callback from set_callback()
+        self._routes = {}
         self.user = user
         self.pswd = password
         self.keepalive = keepalive
@@ -35,24 +76,243 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
+        # QoS 1 messages awaiting PUBACK: pid -> (topic, msg, retain).
+        # With max_inflight=0 publish() waits for each PUBACK itself,
+        # otherwise up to max_inflight messages are pipelined and acked
+        # from wait_msg()/check_msg(). msg is kept by reference until acked.
+        self.max_inflight = max_inflight
+        self.inflight = {}
+        self.puback_cb = None
+        # Keepalive bookkeeping, see check_keepalive(). rtt_ms is the
+        # smoothed PINGREQ/PINGRESP round-trip time once measured.
+        self.rtt_ms = None
+        self._ping_sent = None
+        self._last_tx = 0
+        self._last_rx = 0
+        # Outgoing packets are assembled here and sent with a single write
+        self._wbuf = bytearray(wbuf_size)
+        # PUBLISH packets whose remaining length exceeds max_msg_size are
+        # skipped (and acknowledged) without being buffered. With
+        # zero_copy the callback gets memoryview slices of the receive
+        # buffer instead of bytes copies; they are valid only until the
+        # callback returns and must not be used after the callback calls
+        # anything that reads from the connection (wait_msg, check_msg,
+        # subscribe or a QoS 1 publish waiting for its PUBACK).
+        self.max_msg_size = max_msg_size
+        self.zero_copy = zero_copy
+        # Incoming bytes are read in bulk into here and parsed in place;
+        # _rpos.._rend is the unparsed part
+        self._rbuf = bytearray(rbuf_size)
+        self._rmv = memoryview(self._rbuf)
+        self._rpos = 0
+        self._rend = 0
+        self._rtimeout = None
+        self._body = 0
+        self._body_len = 0
+        # Server addresses are cached for dns_ttl seconds. handshake_ms is
+        # the duration of the last TLS handshake; ports whose TLS sockets
+        # expose their session resume it on the next connect
+        self.dns_ttl = dns_ttl
+        self.handshake_ms = None
+        # A metrics.Metrics instance to fill in, None disables collection
+        self.metrics = None
+
+    def _wreserve(self, n):
+        if n > len(self._wbuf):
+            self._wbuf = bytearray(n)
+        return self._wbuf
+
+    def _wlen(self, i, sz):
+        buf = self._wbuf
+        while sz > 0x7F:
+            buf[i] = (sz & 0x7F) | 0x80
+            sz >>= 7
+            i += 1
+        buf[i] = sz
+        return i + 1
+
+    def _wstr(self, i, s):
+        n = len(s)
+        struct.pack_into("!H", self._wbuf, i, n)
+        i += 2
+        self._wbuf[i : i + n] = s
+        return i + n
+
+    # Send the first n bytes of the write buffer followed by data.
+    # data is copied in when it fits, so the whole packet leaves in
+    # one write; larger payloads follow the header in a second write.
+    def _send(self, n, data=None):
+        if self.metrics is not None:
+            self.metrics.packet("tx", self._wbuf[0], n + (len(data) if data else 0))
+        if data:
+            m = len(data)
+            if n + m <= len(self._wbuf):
+                self._wbuf[n : n + m] = data
+                n += m
+                data = None
+        self._write(self._wbuf, n)
+        if data:
+            self._write(data, len(data))
+
+    def _write(self, buf, n):
+        self.sock.write(buf, n)
+        self._last_tx = time.ticks_ms()
+
+    def _next_pid(self):
+        self.pid = self.pid % 0xFFFF + 1
+        while self.pid in self.inflight:
+            self.pid = self.pid % 0xFFFF + 1
+        return self.pid
+
+    # Make sure at least need unparsed bytes are buffered. Whatever the
+    # socket already holds is taken in one non-blocking bulk read; only
+    # the remaining shortfall is waited for. Returns False if nothing at
+    # all is available, right away with block=False and after timeout_ms
+    # if given.
+    def _fill(self, need, block=True, timeout_ms=None):
+        have = self._rend - self._rpos
+        if have >= need:
+            return True
+        self._rspace(need)
+        end = len(self._rbuf)
+        if not self._recv(end, 0) and not have:
+            if not block or timeout_ms is not None and not self._recv(end, timeout_ms):
+                return False
+        timeout = None if self._rtimeout is None else self._rtimeout * 1000
+        while self._rend - self._rpos < need:
+            if not self._recv(self._rpos + need, timeout):
+                raise OSError(ETIMEDOUT)
+        return True
+
+    # Read what arrives into the buffer from _rend up to end and return
+    # the byte count, or None if nothing did within timeout_ms (0 does
+    # not wait, None waits as long as it takes). SSL sockets have no
+    # settimeout(), so timed reads poll; a TLS record without application
+    # data still makes the socket poll readable, so after each wakeup the
+    # read is non-blocking and polling goes on until the deadline.
+    def _recv(self, end, timeout_ms):
+        sock = self.sock
+        buf = self._rmv[self._rend : end]
+        if timeout_ms is None:
+            n = sock.readinto(buf)
+        else:
+            t = time.ticks_ms()
+            sock.setblocking(False)
+            try:
+                while 1:
+                    n = sock.readinto(buf)
+                    if n is not None:
+                        break
+                    left = int(timeout_ms) - time.ticks_diff(time.ticks_ms(), t)
+                    if left <= 0:
+                        break
+                    poller = select.poll()
+                    poller.register(sock, select.POLLIN)
+                    poller.poll(left)
+            finally:
+                sock.setblocking(True)
+        if n == 0:
+            raise OSError(-1)
+        if n:
+            self._rend += n
+        return n
+
+    # Make room for need contiguous bytes from _rpos on
+    def _rspace(self, need):
+        have = self._rend - self._rpos
+        assert need <= len(self._rbuf)
+        if not have:
+            self._rpos = self._rend = 0
+        elif self._rpos + need > len(self._rbuf):
+            self._rbuf[:have] = bytes(self._rmv[self._rpos : self._rend])
+            self._rpos = 0
+            self._rend = have
+
+    def _read(self, n):
+        if n <= len(self._rbuf):
+            self._fill(n)
+            i = self._rpos
+            self._rpos += n
+            return bytes(self._rmv[i : i + n])
+        head = bytes(self._rmv[self._rpos : self._rend])
+        self._rpos = self._rend
+        return head + self.sock.read(n - len(head))
 
-    def _send_str(self, s):
-        self.sock.write(struct.pack("!H", len(s)))
-        self.sock.write(s)
+    def _skip(self, n):
+        while n:
+            k = min(n, len(self._rbuf))
+            self._fill(k)
+            self._rpos += k
+            n -= k
 
+    def _read_u16(self):
+        self._fill(2)
+        i = self._rpos
+        self._rpos += 2
+        return self._rbuf[i] << 8 | self._rbuf[i + 1]
+
+    # Parse the remaining length of the buffered fixed header and
+    # consume the header
     def _recv_len(self):
         n = 0
         sh = 0
+        i = 1
         while 1:
-            b = self.sock.read(1)[0]
+            self._fill(i + 1)
+            b = self._rbuf[self._rpos + i]
             n |= (b & 0x7F) << sh
+            i += 1
             if not b & 0x80:
+                self._rpos += i
                 return n
             sh += 7
 
     def set_callback(self, f):
         self.cb = f
 
+    # f=None removes the route again
+    def route(self, topic_filter, f):
+        topic_filter = _b(topic_filter)
+        if topic_filter.endswith(b"/+"):
+            topic_filter = topic_filter[:-1]
+        if f is None:
+            self._routes.pop(topic_filter, None)
+        else:
+            self._routes[topic_filter] = f
+
+    def _dispatch(self, topic, msg):
+        if self._routes:
+            if self.zero_copy:
+                f = self._route_view(topic)
+            else:
+                f = self._routes.get(topic)
+                if f is None:
+                    f = self._routes.get(topic[: topic.rfind(b"/") + 1])
+            if f is not None:
+                return f(topic, msg)
+        self.cb(topic, msg)
+
+    # Route lookup for a memoryview topic, which cannot be a dict key:
+    # it is compared with the routes of matching length in place, so the
+    # topic is never copied
+    def _route_view(self, topic):
+        n = len(topic)
+        j = n
+        while j and topic[j - 1] != 0x2F:  # "/"
+            j -= 1
+        prefix = None
+        for key, f in self._routes.items():
+            k = len(key)
+            if k == n and topic == key:
+                return f
+            if k == j and prefix is None and topic[:j] == key:
+                prefix = f
+        return prefix
+
+    # f(pid) is called when the PUBACK for a QoS 1 publish arrives
+    def set_puback_callback(self, f):
+        self.puback_cb = f
+
     def set_last_will(self, topic, msg, retain=False, qos=0):
         assert 0 <= qos <= 2
         assert topic
@@ -61,157 +321,357 @@ class MQTTClient:
         self.lw_qos = qos
         self.lw_retain = retain
 
+    # A cached address is dropped when connecting to it fails, so the
+    # next attempt resolves the server again
     def connect(self, clean_session=True, timeout=5):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
         self.sock = socket.socket()
         self.sock.settimeout(timeout)
-        addr = socket.getaddrinfo(self.server, self.port)[0][-1]
-        self.sock.connect(addr)
+        try:
+            self.sock.connect(resolve(self.server, self.port, self.dns_ttl))
+        except OSError:
+            _addr_cache.pop((self.server, self.port), None)
+            raise
         if self.ssl:
             import ussl
 
-            self.sock = ussl.wrap_socket(self.sock, **self.ssl_params)
-        premsg = bytearray(b"\x10\0\0\0\0\0")
-        msg = bytearray(b"\x04MQTT\x04\x02\0\0")
+            params = self.ssl_params
+            key = (self.server, self.port) + tuple(params.get(name) for name in _TLS_KEY_PARAMS)
+            if _tls_sessions.get(key) is not None:
+                params = dict(params, session=_tls_sessions[key])
+            t = time.ticks_ms()
+            # A session the server no longer accepts is not offered again
+            try:
+                self.sock = ussl.wrap_socket(self.sock, **params)
+            except Exception:
+                _tls_sessions.pop(key, None)
+                raise
+            self.handshake_ms = time.ticks_diff(time.ticks_ms(), t)
+            _tls_sessions[key] = getattr(self.sock, "session", None)
+        self._rpos = self._rend = 0
+        self._ping_sent = None
+        if self.metrics is not None:
+            self.metrics.count("connects")
+        self._send_connect(clean_session)
+        self._rtimeout = timeout
+        op = self.wait_msg()
+        self._rtimeout = None
+        self.sock.setblocking(True)
+        return self._connack(op)
 
-        sz = 10 + 2 + len(self.client_id)
-        msg[6] = clean_session << 1
-        if self.user is not None:
-            sz += 2 + len(self.user) + 2 + len(self.pswd) if self.pswd else 0
-            msg[6] |= 0xC0
+    def _send_connect(self, clean_session):
+        client_id = _b(self.client_id)
+        user = _b(self.user)
+        pswd = _b(self.pswd)
+        lw_topic = _b(self.lw_topic)
+        lw_msg = _b(self.lw_msg)
+        flags = clean_session << 1
+        sz = 10 + 2 + len(client_id)
+        if user is not None:
+            sz += 2 + len(user)
+            flags |= 0x80
+        if pswd is not None:
+            sz += 2 + len(pswd)
+            flags |= 0x40
         if self.keepalive:
             assert self.keepalive < 65536
-            msg[7] |= self.keepalive >> 8
-            msg[8] |= self.keepalive & 0x00FF
-        if self.lw_topic:
-            sz += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
-            msg[6] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
-            msg[6] |= self.lw_retain << 5
+        if lw_topic:
+            sz += 2 + len(lw_topic) + 2 + len(lw_msg)
+            flags |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
+            flags |= self.lw_retain << 5
 
-        i = 1
-        while sz > 0x7F:
-            premsg[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        premsg[i] = sz
-
-        self.sock.write(premsg, i + 2)
-        self.sock.write(msg)
-        # print(hex(len(msg)), hexlify(msg, ":"))
-        self._send_str(self.client_id)
-        if self.lw_topic:
-            self._send_str(self.lw_topic)
-            self._send_str(self.lw_msg)
-        if self.user is not None:
-            self._send_str(self.user)
-        if self.pswd is not None:
-            self._send_str(self.pswd)
-        resp = self.sock.read(4)
-        assert resp[0] == 0x20 and resp[1] == 0x02
-        if resp[3] != 0:
-            raise MQTTException(resp[3])
-        return resp[2] & 1
+        buf = self._wreserve(sz + 5)
+        buf[0] = 0x10
+        i = self._wlen(1, sz)
+        buf[i : i + 7] = b"\0\x04MQTT\x04"
+        buf[i + 7] = flags
+        struct.pack_into("!H", buf, i + 8, self.keepalive)
+        i = self._wstr(i + 10, client_id)
+        if lw_topic:
+            i = self._wstr(i, lw_topic)
+            i = self._wstr(i, lw_msg)
+        if user is not None:
+            i = self._wstr(i, user)
+        if pswd is not None:
+            i = self._wstr(i, pswd)
+        self._send(i)
+
+    def _connack(self, op):
+        resp = self._rbuf
+        i = self._body
+        assert op == 0x20
+        if resp[i + 1] != 0:
+            raise MQTTException(resp[i + 1])
+        # Retransmit whatever was not acknowledged before the reconnect
+        for pid, (topic, msg, retain) in self.inflight.items():
+            self._publish(topic, msg, retain, 1, pid, 0x08)
+        return resp[i] & 1
 
     def disconnect(self):
+        if self.metrics is not None:
+            self.metrics.packet("tx", 0xE0, 2)
         self.sock.write(b"\xe0\0")
         self.sock.close()
 
     def ping(self):
-        self.sock.write(b"\xc0\0")
+        if self.metrics is not None:
+            self.metrics.packet("tx", 0xC0, 2)
+        self._write(b"\xc0\0", 2)
+        self._ping_sent = self._last_tx
 
-    def publish(self, topic, msg, retain=False, qos=0):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain
+    # Call periodically. Sends PINGREQ once nothing was sent or received
+    # for the keepalive period minus a margin of a few round trips, and
+    # raises OSError(ETIMEDOUT) if its PINGRESP is overdue, which means
+    # the link is dead. Returns ms until the next check is needed.
+    def check_keepalive(self):
+        if not self.keepalive:
+            return None
+        now = time.ticks_ms()
+        if self._ping_sent is not None:
+            left = self._ping_timeout() - time.ticks_diff(now, self._ping_sent)
+            if left < 0:
+                raise OSError(ETIMEDOUT)
+            return left
+        margin = 4 * self.rtt_ms if self.rtt_ms is not None else 5000
+        interval = max(self.keepalive * 1000 - margin, 1000)
+        idle = max(time.ticks_diff(now, self._last_tx), time.ticks_diff(now, self._last_rx))
+        if idle >= interval:
+            self.ping()
+            return self._ping_timeout()
+        return interval - idle
+
+    # A few round trips, but never less than half the keepalive period:
+    # the RTT measured on an idle link says little about a busy or
+    # congested one, and the server waits 1.5 periods anyway
+    def _ping_timeout(self):
+        rtt = 4 * self.rtt_ms if self.rtt_ms is not None else 10000
+        return max(rtt, self.keepalive * 500)
+
+    def _pingresp(self):
+        if self._ping_sent is None:
+            return
+        rtt = time.ticks_diff(self._last_rx, self._ping_sent)
+        if self.metrics is not None:
+            self.metrics.observe("ping_rtt_ms", rtt)
+        self.rtt_ms = rtt if self.rtt_ms is None else (7 * self.rtt_ms + rtt) // 8
+        self._ping_sent = None
+
+    def _publish(self, topic, msg, retain, qos, pid, dup=0):
         sz = 2 + len(topic) + len(msg)
         if qos > 0:
             sz += 2
         assert sz < 2097152
-        i = 1
-        while sz > 0x7F:
-            pkt[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        pkt[i] = sz
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt, i + 1)
-        self._send_str(topic)
+        buf = self._wreserve(len(topic) + 9)
+        buf[0] = 0x30 | dup | qos << 1 | retain
+        i = self._wlen(1, sz)
+        i = self._wstr(i, topic)
         if qos > 0:
-            self.pid += 1
-            pid = self.pid
-            struct.pack_into("!H", pkt, 0, pid)
-            self.sock.write(pkt, 2)
-        self.sock.write(msg)
-        if qos == 1:
-            while 1:
-                op = self.wait_msg()
-                if op == 0x40:
-                    sz = self.sock.read(1)
-                    assert sz == b"\x02"
-                    rcv_pid = self.sock.read(2)
-                    rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
-                    if pid == rcv_pid:
-                        return
-        elif qos == 2:
-            assert 0
+            struct.pack_into("!H", buf, i, pid)
+            i += 2
+        self._send(i, msg)
 
-    def subscribe(self, topic, qos=0):
-        assert self.cb is not None, "Subscribe callback is not set"
-        pkt = bytearray(b"\x82\0\0\0")
-        self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt)
-        self._send_str(topic)
-        self.sock.write(qos.to_bytes(1, "little"))
+    # Returns the packet id for QoS 1, which is later passed to the
+    # PUBACK callback.
+    def publish(self, topic, msg, retain=False, qos=0):
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.heap("heap_free_before_publish")
+        topic = _b(topic)
+        msg = _b(msg)
+        if qos == 0:
+            self._publish(topic, msg, retain, 0, 0)
+            if metrics is not None:
+                metrics.heap("heap_free_after_publish")
+            return
+        assert qos == 1
+        while self.max_inflight and len(self.inflight) >= self.max_inflight:
+            self.wait_msg()
+        pid = self._next_pid()
+        self.inflight[pid] = (topic, msg, retain)
+        if metrics is not None:
+            metrics.publish_sent(pid)
+        self._publish(topic, msg, retain, qos, pid)
+        if metrics is not None:
+            metrics.heap("heap_free_after_publish")
+        if not self.max_inflight:
+            while pid in self.inflight:
+                self.wait_msg()
+        return pid
+
+    # cb, if given, receives the messages matching topic instead of the
+    # callback from set_callback()
+    def subscribe(self, topic, qos=0, cb=None):
+        self.subscribe_many(((topic, qos, cb),))
+
+    # Subscribe to several (topic, qos, cb) filters with one SUBSCRIBE
+    # packet and a single round trip for the SUBACK
+    def subscribe_many(self, subscriptions):
+        pid = self._send_subscribe(subscriptions)
         while 1:
             op = self.wait_msg()
-            if op == 0x90:
-                resp = self.sock.read(4)
-                # print(resp)
-                assert resp[1] == pkt[2] and resp[2] == pkt[3]
-                if resp[3] == 0x80:
-                    raise MQTTException(resp[3])
+            if op == 0x90 and self._suback(pid):
                 return
 
+    def _send_subscribe(self, subscriptions):
+        assert self.cb is not None, "Subscribe callback is not set"
+        topics = []
+        sz = 2
+        for topic, qos, cb in subscriptions:
+            topic = _b(topic)
+            if cb is not None:
+                self.route(topic, cb)
+            topics.append((topic, qos))
+            sz += 2 + len(topic) + 1
+        buf = self._wreserve(sz + 5)
+        buf[0] = 0x82
+        i = self._wlen(1, sz)
+        pid = self._next_pid()
+        struct.pack_into("!H", buf, i, pid)
+        i += 2
+        for topic, qos in topics:
+            i = self._wstr(i, topic)
+            buf[i] = qos
+            i += 1
+        self._send(i)
+        return pid
+
+    # Check the SUBACK body left by wait_msg against pid; it carries one
+    # return code per requested filter
+    def _suback(self, pid):
+        resp = self._rbuf
+        i = self._body
+        assert resp[i] << 8 | resp[i + 1] == pid
+        for i in range(i + 2, i + self._body_len):
+            if resp[i] == 0x80:
+                raise MQTTException(resp[i])
+        return True
+
+    # Take a QoS 1 message out of the in-flight window without waiting
+    # for its PUBACK, so it is not retransmitted after a reconnect
+    def discard(self, pid):
+        self.inflight.pop(pid, None)
+        if self.metrics is not None:
+            self.metrics.publish_dropped(pid)
+
+    def _puback(self, pid):
+        if self.metrics is not None:
+            self.metrics.puback_received(pid)
+        if self.inflight.pop(pid, None) is not None and self.puback_cb:
+            self.puback_cb(pid)
+
     # Wait for a single incoming MQTT message and process it.
     # Subscribed messages are delivered to a callback previously
     # set by .set_callback() method. Other (internal) MQTT
     # messages processed internally.
-    def wait_msg(self):
-        res = self.sock.read(1)
-        self.sock.setblocking(True)
-        if res is None:
+    # Body of a control packet returned by wait_msg starts at
+    # self._rbuf[self._body] and stays there until the next read.
+    # With timeout_ms returns None if no packet started to arrive within
+    # that time.
+    def wait_msg(self, block=True, timeout_ms=None):
+        metrics = self.metrics
+        if metrics is None:
+            return self._wait_msg(block, timeout_ms)
+        t = time.ticks_us()
+        try:
+            return self._wait_msg(block, timeout_ms)
+        finally:
+            metrics.count("wait_msg_calls")
+            metrics.count("wait_msg_us", time.ticks_diff(time.ticks_us(), t))
+
+    def _wait_msg(self, block, timeout_ms=None):
+        if not self._fill(2, block, timeout_ms):
             return None
-        if res == b"":
-            raise OSError(-1)
-        if res == b"\xd0":  # PINGRESP
-            sz = self.sock.read(1)[0]
+        op = self._rbuf[self._rpos]
+        sz = self._recv_len()
+        self._last_rx = time.ticks_ms()
+        if self.metrics is not None:
+            self.metrics.packet("rx", op, sz + 2 + (sz > 0x7F) + (sz > 0x3FFF) + (sz > 0x1FFFFF))
+        if op == 0xD0:  # PINGRESP
             assert sz == 0
+            self._pingresp()
             return None
-        op = res[0]
         if op & 0xF0 != 0x30:
+            self._fill(sz)
+            self._body = self._rpos
+            self._body_len = sz
+            self._rpos += sz
+            if op == 0x40:
+                self._puback(self._rbuf[self._body] << 8 | self._rbuf[self._body + 1])
             return op
-        sz = self._recv_len()
-        topic_len = self.sock.read(2)
-        topic_len = (topic_len[0] << 8) | topic_len[1]
-        topic = self.sock.read(topic_len)
-        sz -= topic_len + 2
-        if op & 6:
-            pid = self.sock.read(2)
-            pid = pid[0] << 8 | pid[1]
-            sz -= 2
-        msg = self.sock.read(sz)
-        self.cb(topic, msg)
+        if self.max_msg_size and sz > self.max_msg_size:
+            self._drop(op, sz)
+            return op
+        if self.zero_copy:
+            self._fill(sz)
+            buf = self._rbuf
+            i = self._rpos
+            self._rpos += sz
+            topic_len = buf[i] << 8 | buf[i + 1]
+            topic = self._rmv[i + 2 : i + 2 + topic_len]
+            i += 2 + topic_len
+            if op & 6:
+                pid = buf[i] << 8 | buf[i + 1]
+                i += 2
+            msg = self._rmv[i : self._rpos]
+        else:
+            topic_len = self._read_u16()
+            topic = self._read(topic_len)
+            sz -= topic_len + 2
+            if op & 6:
+                pid = self._read_u16()
+                sz -= 2
+            msg = self._read(sz)
+        self._dispatch(topic, msg)
         if op & 6 == 2:
-            pkt = bytearray(b"\x40\x02\0\0")
-            struct.pack_into("!H", pkt, 2, pid)
-            self.sock.write(pkt)
+            self._send_puback(pid)
         elif op & 6 == 4:
             assert 0
         return op
 
+    def _send_puback(self, pid):
+        buf = self._wbuf
+        buf[0] = 0x40
+        buf[1] = 0x02
+        struct.pack_into("!H", buf, 2, pid)
+        self._send(4)
+
+    # Read past an oversized PUBLISH chunk by chunk, acknowledging it so
+    # the server does not redeliver it
+    def _drop(self, op, sz):
+        topic_len = self._read_u16()
+        self._skip(topic_len)
+        sz -= topic_len + 2
+        if op & 6:
+            pid = self._read_u16()
+            sz -= 2
+        self._skip(sz)
+        if op & 6 == 2:
+            self._send_puback(pid)
+
+    # True when a whole packet is already in the receive buffer, so
+    # wait_msg() handles it without reading. The socket does not poll
+    # readable for such packets, pollers have to check for them.
+    def msg_buffered(self):
+        buf = self._rbuf
+        end = self._rend
+        n = 0
+        sh = 0
+        i = self._rpos + 1
+        while i < end:
+            b = buf[i]
+            n |= (b & 0x7F) << sh
+            i += 1
+            if not b & 0x80:
+                return i + n <= end
+            sh += 7
+        return False
+
     # Checks whether a pending message from server is available.
     # If not, returns immediately with None. Otherwise, does
     # the same processing as wait_msg.
     def check_msg(self):
-        self.sock.setblocking(False)
-        return self.wait_msg()
+        return self.wait_msg(False)
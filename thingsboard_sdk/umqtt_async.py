@@ -0,0 +1,261 @@
+import uasyncio as asyncio
+import utime as time
+
+from .umqtt import MQTTClient, MQTTException, _b
+
+
+# uasyncio flavour of MQTTClient. Packets are built by the same code as
+# the blocking client; the socket is replaced by a uasyncio stream and a
+# background task started by connect() reads and dispatches every
+# incoming packet, so nothing else ever reads from the stream.
+class MQTTClientAsync(MQTTClient):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._ack = asyncio.Event()
+        self._subacks = {}
+        self._task = None
+
+    def _write(self, buf, n):
+        # Stream.write sends what it can and keeps a copy of the rest
+        self.sock.write(memoryview(buf)[:n])
+        self._last_tx = time.ticks_ms()
+
+    # Like _fill, but frames larger than the receive buffer grow it, so a
+    # whole frame is always buffered before it is parsed
+    async def _fill_async(self, need):
+        have = self._rend - self._rpos
+        if have >= need:
+            return
+        if need > len(self._rbuf):
+            buf = bytearray(need)
+            buf[:have] = self._rmv[self._rpos : self._rend]
+            self._rbuf = buf
+            self._rmv = memoryview(buf)
+            self._rpos = 0
+            self._rend = have
+        self._rspace(need)
+        while have < need:
+            n = await self.sock.readinto(self._rmv[self._rend :])
+            if not n:
+                raise OSError(-1)
+            self._rend += n
+            have += n
+
+    # asyncio streams take an SSLContext instead of wrap_socket()
+    # arguments; it is built from the ssl_params the blocking client would
+    # use. server_hostname is always the server, which asyncio passes on
+    # for SNI itself. Parameters it cannot express raise ValueError.
+    def _ssl_context(self):
+        import ssl
+
+        params = dict(self.ssl_params)
+        if params.pop("server_hostname", self.server) != self.server:
+            raise ValueError("server_hostname has to be the server")
+        params.pop("do_handshake", None)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        verify = params.pop("cert_reqs", ssl.CERT_NONE)
+        # CPython checks the hostname by default and refuses CERT_NONE then
+        if hasattr(context, "check_hostname"):
+            context.check_hostname = verify == ssl.CERT_REQUIRED
+        context.verify_mode = verify
+        cadata = params.pop("cadata", None)
+        if cadata:
+            context.load_verify_locations(cadata=cadata)
+        cert = params.pop("cert", None)
+        certfile = params.pop("certfile", None)
+        key = params.pop("key", None)
+        keyfile = params.pop("keyfile", None)
+        if cert is not None or certfile is not None:
+            context.load_cert_chain(cert if cert is not None else certfile, key if key is not None else keyfile)
+        if params:
+            raise ValueError("ssl_params not supported by the asyncio client: " + ", ".join(params))
+        return context
+
+    async def connect(self, clean_session=True, timeout=5):
+        kw = {"ssl": self._ssl_context()} if self.ssl else {}
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock, _ = await asyncio.wait_for(
+            asyncio.open_connection(self.server, self.port, **kw), timeout
+        )
+        self._rpos = self._rend = 0
+        self._subacks = {}
+        self._ping_sent = None
+        if self.metrics is not None:
+            self.metrics.count("connects")
+        self._send_connect(clean_session)
+        await self.sock.drain()
+        op = await asyncio.wait_for(self.wait_msg(), timeout)
+        present = self._connack(op)
+        await self.sock.drain()
+        self._task = asyncio.create_task(self._reader())
+        if self.keepalive:
+            asyncio.create_task(self._keepalive(self._task))
+        return present
+
+    async def disconnect(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self.metrics is not None:
+            self.metrics.packet("tx", 0xE0, 2)
+        self.sock.write(b"\xe0\0")
+        await self.sock.drain()
+        self.sock.close()
+        await self.sock.wait_closed()
+
+    async def _reader(self):
+        try:
+            while 1:
+                await self.wait_msg()
+                # Flush PUBACKs and anything published from callbacks
+                await self.sock.drain()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("MQTT reader stopped:", e)
+        self._task = None
+        self._ack.set()
+
+    # Pings on schedule and stops the reader when the link is found dead
+    async def _keepalive(self, reader):
+        while self._task is reader:
+            try:
+                wait = self.check_keepalive()
+                await self.sock.drain()
+            except OSError as e:
+                print("MQTT keepalive failed:", e)
+                reader.cancel()
+                self._task = None
+                self._ack.set()
+                return
+            await asyncio.sleep_ms(min(wait, 1000))
+
+    # Returns once the reader has stopped because the link was lost
+    async def lost(self):
+        while self._task is not None:
+            self._ack.clear()
+            await self._ack.wait()
+
+    # Wake up on the next control packet; raises once the reader is gone
+    async def _wait_ack(self):
+        if self._task is None:
+            raise OSError(-1)
+        self._ack.clear()
+        await self._ack.wait()
+
+    # Buffers the whole frame first, so the blocking parser never has to
+    # touch the stream
+    async def wait_msg(self):
+        await self._fill_async(2)
+        i = 1
+        while self._rbuf[self._rpos + i] & 0x80:
+            i += 1
+            await self._fill_async(i + 1)
+        sz = 0
+        for k in range(i, 0, -1):
+            sz = sz << 7 | self._rbuf[self._rpos + k] & 0x7F
+        if self.max_msg_size and sz > self.max_msg_size and self._rbuf[self._rpos] & 0xF0 == 0x30:
+            return await self._drop_async(i, sz)
+        await self._fill_async(i + 1 + sz)
+        return self._handle_buffered()
+
+    # Parse the frame at the front of the receive buffer, which has to be
+    # complete, and wake up whoever waits for a control packet
+    def _handle_buffered(self):
+        op = MQTTClient.wait_msg(self)
+        if op is not None and op & 0xF0 != 0x30:
+            if op == 0x90:
+                j = self._body
+                self._subacks[self._rbuf[j] << 8 | self._rbuf[j + 1]] = 0x80 in self._rbuf[j + 2 : j + self._body_len]
+            self._ack.set()
+        return op
+
+    # Counterpart of _drop for a frame whose fixed header is hdr bytes
+    async def _drop_async(self, hdr, sz):
+        op = self._rbuf[self._rpos]
+        if self.metrics is not None:
+            self.metrics.packet("rx", op, hdr + 1 + sz)
+        await self._fill_async(hdr + 3)
+        i = self._rpos + hdr + 1
+        skip = hdr + 3 + (self._rbuf[i] << 8 | self._rbuf[i + 1])
+        sz -= skip - hdr - 1
+        if op & 6:
+            await self._fill_async(skip + 2)
+            i = self._rpos + skip
+            pid = self._rbuf[i] << 8 | self._rbuf[i + 1]
+            skip += 2
+            sz -= 2
+        skip += sz
+        while skip:
+            k = min(skip, len(self._rbuf))
+            await self._fill_async(k)
+            self._rpos += k
+            skip -= k
+        if op & 6 == 2:
+            self._send_puback(pid)
+        return op
+
+    # Handles a packet already complete in the receive buffer, without
+    # reading from the stream; returns None if there is none. The reader
+    # task takes care of everything else.
+    def check_msg(self):
+        if not self.msg_buffered():
+            return None
+        return self._handle_buffered()
+
+    # Never blocks: QoS 1 messages stay in inflight until the reader task
+    # sees their PUBACK. Use publish_async() to wait for delivery.
+    def publish(self, topic, msg, retain=False, qos=0):
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.heap("heap_free_before_publish")
+        topic = _b(topic)
+        msg = _b(msg)
+        if qos == 0:
+            self._publish(topic, msg, retain, 0, 0)
+            if metrics is not None:
+                metrics.heap("heap_free_after_publish")
+            return
+        assert qos == 1
+        pid = self._next_pid()
+        self.inflight[pid] = (topic, msg, retain)
+        if metrics is not None:
+            metrics.publish_sent(pid)
+        self._publish(topic, msg, retain, qos, pid)
+        if metrics is not None:
+            metrics.heap("heap_free_after_publish")
+        return pid
+
+    async def publish_async(self, topic, msg, retain=False, qos=0):
+        while self.max_inflight and len(self.inflight) >= self.max_inflight:
+            await self._wait_ack()
+        pid = self.publish(topic, msg, retain, qos)
+        await self.delivered(pid)
+        return pid
+
+    # Wait until everything written so far left the device and, for a
+    # QoS 1 pid, until the server acknowledged it
+    async def delivered(self, pid=None):
+        await self.sock.drain()
+        while pid in self.inflight:
+            await self._wait_ack()
+
+    async def all_delivered(self):
+        await self.sock.drain()
+        while self.inflight:
+            await self._wait_ack()
+
+    async def subscribe(self, topic, qos=0, cb=None):
+        await self.subscribe_many(((topic, qos, cb),))
+
+    async def subscribe_many(self, subscriptions):
+        pid = self._send_subscribe(subscriptions)
+        await self.sock.drain()
+        while pid not in self._subacks:
+            await self._wait_ack()
+        if self._subacks.pop(pid):
+            raise MQTTException(0x80)
@@ -0,0 +1,284 @@
+"""
+Fleet simulator: runs N unmodified TBDeviceMqttClient instances, each with its own access token, from one
+select.poll loop (thingsboard_sdk.poller.Poller) in a single process, against a ThingsBoard server or
+tools/tb_emulator.py.
+
+All devices start connecting at once (a connect storm) unless --connect-rate limits them to so many per
+second. Connects run one after another, as MQTTClient.connect() waits for its CONNACK, so the connect latency
+of a device includes the time spent queued behind the others; that is the storm as a single host sees it.
+Devices whose connect failed, or whose connection dropped later, are reconnected by the SDK's own backoff.
+Once connected, each device publishes telemetry every --interval seconds (at a random phase) with a "ts",
+so the emulator can measure end-to-end latency, and answers server-side RPC requests.
+
+    python tools/fleet_sim.py --devices 1000 --interval 5 --duration 60 --emulator --latency-ms 20
+
+reports aggregate publish and acknowledgement rates as it runs and writes a JSON summary at the end.
+Thousands of devices need as many file descriptors; the soft limit is raised to the hard one on start.
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import upy_shim  # noqa: E402
+
+upy_shim.install()
+
+from tb_emulator import Emulator, Latency  # noqa: E402
+from thingsboard_sdk.poller import Poller  # noqa: E402
+from thingsboard_sdk.tb_device_mqtt import TBDeviceMqttClient  # noqa: E402
+
+
+class SimulatedDevice:
+    def __init__(self, sim, index, token):
+        self.sim = sim
+        self.index = index
+        self.token = token
+        self.client = TBDeviceMqttClient(sim.host, sim.port, access_token=token, client_id=token,
+                                         quality_of_service=sim.qos, max_inflight=sim.max_inflight)
+        self.client.enable_auto_reconnect(sim.min_backoff_ms, sim.max_backoff_ms)
+        self.client.set_delivery_callback(self._on_puback)
+        self.client.set_server_side_rpc_request_handler(self._on_rpc)
+        self.was_connected = False
+        self.first_connect_s = None
+        self.sent = 0
+
+    def _on_puback(self, pid):
+        self.sim.acked += 1
+
+    def _on_rpc(self, request_id, request):
+        self.sim.rpc_requests += 1
+        self.client.send_rpc_reply(request_id, {"device": self.index, "method": request.get("method")})
+
+    def connect(self):
+        sim = self.sim
+        sim.connect_attempts += 1
+        t = time.monotonic()
+        self.client.connect()
+        done = time.monotonic()
+        sim.connect_ms.record((done - t) * 1000)
+        sim.poller.register(self.client)
+        self.update(done)
+
+    # Tracks connection state changes
+    def update(self, now):
+        connected = self.client.connected
+        if connected and not self.was_connected:
+            if self.first_connect_s is None:
+                self.first_connect_s = now - self.sim.started
+                self.sim.first_connect.record(self.first_connect_s * 1000)
+            else:
+                self.sim.reconnects += 1
+        elif self.was_connected and not connected:
+            self.sim.disconnects += 1
+        self.was_connected = connected
+
+    def publish(self, now):
+        if not self.client.connected:
+            return
+        try:
+            self.client.send_telemetry({"ts": int(time.time() * 1000), "values": {
+                "temperature": round(random.uniform(18, 26), 2), "seq": self.sent}})
+        except OSError:
+            self.sim.publish_errors += 1
+            self.client.connected = False
+        else:
+            self.sent += 1
+            self.sim.sent += 1
+        self.update(now)
+
+
+class FleetSimulator:
+    def __init__(self, host, port, devices, token_prefix="sim-device-", interval=10.0, qos=1, max_inflight=16,
+                 connect_rate=0.0, min_backoff_ms=1000, max_backoff_ms=60000):
+        self.host = host
+        self.port = port
+        self.count = devices
+        self.token_prefix = token_prefix
+        self.interval = interval
+        self.qos = qos
+        self.max_inflight = max_inflight
+        self.connect_rate = connect_rate
+        self.min_backoff_ms = min_backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        # Reads, keepalives and reconnects of all devices
+        self.poller = Poller(housekeeping_ms=1000)
+        self.devices = []
+        self.connect_attempts = 0
+        self.connect_ms = Latency()
+        self.first_connect = Latency()
+        self.reconnects = 0
+        self.disconnects = 0
+        self.sent = 0
+        self.acked = 0
+        self.publish_errors = 0
+        self.rpc_requests = 0
+        self.started = None
+        self.fleet_connected_s = None
+
+    def connected(self):
+        return sum(1 for device in self.devices if device.client.connected)
+
+    def run(self, duration, report_interval=10.0, progress=None):
+        self.started = time.monotonic()
+        end = self.started + duration
+        waiting = [SimulatedDevice(self, i, "%s%d" % (self.token_prefix, i)) for i in range(self.count)]
+        waiting.reverse()
+        # (due time, device index) of the next telemetry publish
+        due = []
+        next_scan = next_report = self.started
+        last = (self.started, 0, 0)
+        while True:
+            now = time.monotonic()
+            if now >= end:
+                break
+            # The storm: start as many connects as the rate allows, but
+            # keep serving the connected devices in between
+            if waiting:
+                if self.connect_rate:
+                    allowed = int((now - self.started) * self.connect_rate) + 1 - len(self.devices)
+                else:
+                    allowed = 50
+                for _ in range(max(0, min(allowed, len(waiting)))):
+                    device = waiting.pop()
+                    self.devices.append(device)
+                    device.connect()
+                    phase = random.random() * self.interval
+                    heapq.heappush(due, (time.monotonic() + phase, device.index))
+            while due and due[0][0] <= now:
+                index = due[0][1]
+                heapq.heapreplace(due, (due[0][0] + self.interval, index))
+                self.devices[index].publish(now)
+            wait = 0 if waiting else min(due[0][0] if due else end, next_scan, end) - time.monotonic()
+            self.poller.poll(max(0, int(wait * 1000)))
+            if now >= next_scan:
+                next_scan = now + 0.2
+                for device in self.devices:
+                    device.update(now)
+            if self.fleet_connected_s is None and not waiting and self.connected() == self.count:
+                self.fleet_connected_s = now - self.started
+            if report_interval and now >= next_report:
+                next_report = now + report_interval
+                elapsed = now - last[0]
+                if progress is not None and elapsed > 0:
+                    progress("%6.1fs %6d/%d connected %9.1f publish/s %9.1f puback/s" % (
+                        now - self.started, self.connected(), self.count, (self.sent - last[1]) / elapsed,
+                        (self.acked - last[2]) / elapsed))
+                last = (now, self.sent, self.acked)
+        for device in self.devices:
+            if device.client.connected:
+                try:
+                    device.client.disconnect()
+                except OSError:
+                    pass
+        return self.summary(time.monotonic() - self.started)
+
+    def summary(self, elapsed):
+        result = {
+            "devices": self.count,
+            "duration_s": round(elapsed, 2),
+            "connect": {
+                "attempts": self.connect_attempts,
+                "devices_connected": sum(1 for d in self.devices if d.first_connect_s is not None),
+                "fleet_connected_s": None if self.fleet_connected_s is None else round(self.fleet_connected_s, 2),
+                "disconnects": self.disconnects,
+                "reconnects": self.reconnects,
+            },
+            "publish": {
+                "sent": self.sent,
+                "acked": self.acked,
+                "errors": self.publish_errors,
+                "sent_per_s": round(self.sent / elapsed, 1),
+                "acked_per_s": round(self.acked / elapsed, 1),
+            },
+            "rpc_requests": self.rpc_requests,
+        }
+        if self.connect_ms.count:
+            result["connect"]["connect_ms"] = self.connect_ms.as_dict()
+        if self.first_connect.count:
+            # Time from the start of the storm until each device was first connected
+            result["connect"]["time_to_connect_ms"] = self.first_connect.as_dict()
+        return result
+
+
+def _raise_fd_limit():
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+# Runs an Emulator on its own thread and event loop, so that the
+# simulator loop stays the only one driving clients
+def _start_emulator(args):
+    emulator = Emulator("127.0.0.1", 0, args.latency_ms, args.jitter_ms, args.loss, args.rpc_rate)
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(emulator.start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    ready.wait()
+    return emulator, loop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a fleet of TBDeviceMqttClient devices from one process")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("-n", "--devices", type=int, default=100)
+    parser.add_argument("--token-prefix", default="sim-device-", help="device i uses the token <prefix><i>")
+    parser.add_argument("--interval", type=float, default=10, help="seconds between telemetry of one device")
+    parser.add_argument("--qos", type=int, default=1, choices=(0, 1))
+    parser.add_argument("--inflight", type=int, default=16, help="unacknowledged QoS 1 messages per device")
+    parser.add_argument("--connect-rate", type=float, default=0, help="connects per second (default: all at once)")
+    parser.add_argument("--min-backoff-ms", type=int, default=1000)
+    parser.add_argument("--max-backoff-ms", type=int, default=60000)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--report-interval", type=float, default=5)
+    parser.add_argument("--emulator", action="store_true", help="run tools/tb_emulator.py in-process and use it")
+    parser.add_argument("--latency-ms", type=float, default=0, help="with --emulator")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="with --emulator")
+    parser.add_argument("--loss", type=float, default=0, help="with --emulator")
+    parser.add_argument("--rpc-rate", type=float, default=0, help="with --emulator, per device and second")
+    parser.add_argument("-o", "--output", help="write the summary as JSON to this file")
+    args = parser.parse_args()
+
+    _raise_fd_limit()
+    emulator = None
+    if args.emulator:
+        emulator, loop = _start_emulator(args)
+        args.host, args.port = "127.0.0.1", emulator.port
+    sim = FleetSimulator(args.host, args.port, args.devices, args.token_prefix, args.interval, args.qos,
+                         args.inflight, args.connect_rate, args.min_backoff_ms, args.max_backoff_ms)
+    summary = sim.run(args.duration, args.report_interval, lambda line: print(line, file=sys.stderr))
+    if emulator is not None:
+        summary["emulator"] = asyncio.run_coroutine_threadsafe(_report(emulator), loop).result()
+    report = json.dumps(summary, indent=1)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+async def _report(emulator):
+    return emulator.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,606 @@
+"""
+Local stand-in for a ThingsBoard server, for load and latency tests of the SDK without a real one. It speaks
+the MQTT 3.1.1 subset the SDK uses (QoS 0 and 1, no retained messages or wills) and implements the device API:
+
+- v1/devices/me/telemetry and v1/devices/me/attributes, stored per access token
+- attribute requests on v1/devices/me/attributes/request/+ and shared attribute updates (--attribute-rate)
+- server-side RPC (--rpc-rate requests per second and device) and client-side RPC, answered by echoing the
+  params back as the result
+- provisioning (username "provision", /provision/request) and firmware chunks on v2/fw/request/+/chunk/+
+  for the image given with --firmware
+
+Payloads are expected in JSON; protobuf payloads are counted but not interpreted. Every packet sent to a
+device is delayed by --latency-ms plus up to --jitter-ms, and --loss is the probability that a PUBLISH in
+either direction is dropped without an acknowledgement.
+
+Latencies are recorded per topic, with request ids replaced by "+":
+- telemetry and attributes carrying a "ts" (ms since the epoch): arrival time minus ts, which is end-to-end
+  when the devices run on the same host
+- server-side RPC: request sent until the response arrived
+- QoS 1 messages sent to devices: PUBLISH until PUBACK, reported separately as puback_ms
+
+    python tools/tb_emulator.py --port 1883 --latency-ms 30 --loss 0.01 --rpc-rate 0.5 --output stats.json
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import signal
+import struct
+import sys
+import time
+from binascii import crc32
+
+TELEMETRY_TOPIC = "v1/devices/me/telemetry"
+ATTRIBUTES_TOPIC = "v1/devices/me/attributes"
+ATTRIBUTES_REQUEST_TOPIC = ATTRIBUTES_TOPIC + "/request/"
+ATTRIBUTES_RESPONSE_TOPIC = ATTRIBUTES_TOPIC + "/response/"
+RPC_REQUEST_TOPIC = "v1/devices/me/rpc/request/"
+RPC_RESPONSE_TOPIC = "v1/devices/me/rpc/response/"
+PROVISION_REQUEST_TOPIC = "/provision/request"
+PROVISION_RESPONSE_TOPIC = "/provision/response"
+FW_REQUEST_TOPIC = "v2/fw/request/"
+FW_RESPONSE_TOPIC = "v2/fw/response/"
+
+CONNECT, CONNACK, PUBLISH, PUBACK, SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = (
+    1, 2, 3, 4, 8, 9, 10, 11, 12, 13, 14)
+
+
+def topic_key(topic):
+    return "/".join("+" if part.isdigit() else part for part in topic.split("/"))
+
+
+def topic_matches(topic_filter, topic):
+    parts = topic.split("/")
+    filters = topic_filter.split("/")
+    for i, f in enumerate(filters):
+        if f == "#":
+            return True
+        if i >= len(parts) or (f != "+" and f != parts[i]):
+            return False
+    return len(parts) == len(filters)
+
+
+def _encode_length(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        out.append(b | 0x80 if n else b)
+        if not n:
+            return bytes(out)
+
+
+def _string(data):
+    return struct.pack("!H", len(data)) + data
+
+
+class Latency:
+    SAMPLES = 10000
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        # Reservoir sample, for the percentiles
+        self._samples = []
+
+    def record(self, ms):
+        self.count += 1
+        self.sum += ms
+        self.max = max(self.max, ms)
+        if len(self._samples) < self.SAMPLES:
+            self._samples.append(ms)
+        else:
+            i = random.randrange(self.count)
+            if i < self.SAMPLES:
+                self._samples[i] = ms
+
+    def as_dict(self):
+        samples = sorted(self._samples)
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 2),
+            "p50": round(samples[len(samples) // 2], 2),
+            "p95": round(samples[int(len(samples) * 0.95)], 2),
+            "p99": round(samples[int(len(samples) * 0.99)], 2),
+            "max": round(self.max, 2),
+        }
+
+
+class TopicStats:
+    def __init__(self):
+        self.received = 0
+        self.sent = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.dropped = 0
+        # End-to-end or round-trip latency, and PUBLISH to PUBACK of QoS 1
+        # messages sent to the devices
+        self.latency = Latency()
+        self.puback = Latency()
+
+    def as_dict(self):
+        result = {"received": self.received, "sent": self.sent, "bytes_in": self.bytes_in,
+                  "bytes_out": self.bytes_out, "dropped": self.dropped}
+        if self.latency.count:
+            result["latency_ms"] = self.latency.as_dict()
+        if self.puback.count:
+            result["puback_ms"] = self.puback.as_dict()
+        return result
+
+
+class Device:
+    def __init__(self, token):
+        self.token = token
+        self.client_attributes = {}
+        self.shared_attributes = {}
+        self.latest_telemetry = {}
+        self.telemetry_messages = 0
+        self.connection = None
+        self._rpc_id = 0
+        # Server-side RPC id -> time it was sent
+        self.pending_rpc = {}
+
+    def next_rpc_id(self):
+        self._rpc_id += 1
+        return self._rpc_id
+
+
+class Firmware:
+    def __init__(self, data, title, version, algorithm="SHA256"):
+        self.data = data
+        self.attributes = {"fw_title": title, "fw_version": version, "fw_size": len(data),
+                           "fw_checksum_algorithm": algorithm, "fw_checksum": self.checksum(data, algorithm)}
+
+    @staticmethod
+    def checksum(data, algorithm):
+        if algorithm == "CRC32":
+            # Printed with the bytes in little-endian order, as ThingsBoard does
+            return crc32(data).to_bytes(4, "little").hex()
+        return hashlib.new(algorithm.lower(), data).hexdigest()
+
+    def chunk(self, index, size):
+        if size <= 0:
+            return self.data
+        return self.data[index * size:(index + 1) * size]
+
+
+class Connection:
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.device = None
+        self.provisioning = False
+        self.keepalive = 0
+        self.subscriptions = {}
+        self._pid = 0
+        # Packet id -> (topic key, time sent) of QoS 1 messages to the device
+        self._inflight = {}
+        # Packets are delayed, but never overtake each other
+        self._last_due = 0.0
+        self.closed = False
+
+    async def run(self):
+        try:
+            while not self.closed:
+                timeout = self.keepalive * 1.5 if self.keepalive else None
+                header = await asyncio.wait_for(self.reader.readexactly(1), timeout)
+                size = 0
+                shift = 0
+                while True:
+                    b = (await self.reader.readexactly(1))[0]
+                    size |= (b & 0x7F) << shift
+                    if not b & 0x80:
+                        break
+                    shift += 7
+                body = await self.reader.readexactly(size) if size else b""
+                self.handle(header[0], body)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.server.connections.discard(self)
+        if self.device is not None and self.device.connection is self:
+            self.device.connection = None
+        self.writer.close()
+
+    def send(self, packet):
+        server = self.server
+        delay = server.latency_ms / 1000
+        if server.jitter_ms:
+            delay += random.random() * server.jitter_ms / 1000
+        loop = asyncio.get_running_loop()
+        due = max(loop.time() + delay, self._last_due)
+        self._last_due = due
+        if due <= loop.time():
+            self._write(packet)
+        else:
+            loop.call_at(due, self._write, packet)
+
+    def _write(self, packet):
+        if not self.closed:
+            self.writer.write(packet)
+
+    # qos=None sends only if the device subscribed to topic, at the
+    # granted QoS; returns whether it was sent (or lost on the way)
+    def publish(self, topic, payload, qos=None):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        granted = max((q for f, q in self.subscriptions.items() if topic_matches(f, topic)), default=None)
+        if qos is None:
+            if granted is None:
+                return False
+            qos = granted
+        stats = self.server.stats(topic)
+        if self.server.lose():
+            stats.dropped += 1
+            return True
+        stats.sent += 1
+        stats.bytes_out += len(payload)
+        body = _string(topic.encode())
+        if qos:
+            self._pid = self._pid % 0xFFFF + 1
+            self._inflight[self._pid] = (topic_key(topic), time.monotonic())
+            body += struct.pack("!H", self._pid)
+        body += payload
+        self.send(bytes((PUBLISH << 4 | qos << 1,)) + _encode_length(len(body)) + body)
+        return True
+
+    def handle(self, header, body):
+        kind = header >> 4
+        if kind == CONNECT:
+            self._connect(body)
+        elif kind == PUBLISH:
+            self._publish(header, body)
+        elif kind == PUBACK:
+            sent = self._inflight.pop(struct.unpack_from("!H", body)[0], None)
+            if sent is not None:
+                self.server.stats(sent[0]).puback.record((time.monotonic() - sent[1]) * 1000)
+        elif kind == SUBSCRIBE:
+            self._subscribe(body)
+        elif kind == UNSUBSCRIBE:
+            i = 2
+            while i < len(body):
+                n = struct.unpack_from("!H", body, i)[0]
+                self.subscriptions.pop(body[i + 2:i + 2 + n].decode(), None)
+                i += 2 + n
+            self.send(bytes((UNSUBACK << 4, 2)) + body[:2])
+        elif kind == PINGREQ:
+            self.send(bytes((PINGRESP << 4, 0)))
+        elif kind == DISCONNECT:
+            self.close()
+
+    def _connect(self, body):
+        flags = body[7]
+        self.keepalive = struct.unpack_from("!H", body, 8)[0]
+        i = 10
+        fields = []
+        # Client id, will topic and message, user name, password
+        for present in (True, flags & 0x04, flags & 0x04, flags & 0x80, flags & 0x40):
+            if present:
+                n = struct.unpack_from("!H", body, i)[0]
+                fields.append(body[i + 2:i + 2 + n])
+                i += 2 + n
+            else:
+                fields.append(None)
+        user = fields[3].decode() if fields[3] else None
+        server = self.server
+        server.connects += 1
+        if user == "provision":
+            self.provisioning = True
+        elif not user or (server.tokens is not None and user not in server.tokens):
+            server.rejected += 1
+            self.send(bytes((CONNACK << 4, 2, 0, 5)))
+            # Closed once the delayed CONNACK is out
+            loop = asyncio.get_running_loop()
+            return loop.call_at(max(self._last_due, loop.time()), self.close)
+        else:
+            self.device = server.device(user)
+            if self.device.connection is not None:
+                # A second connection with the same token takes over
+                self.device.connection.close()
+            self.device.connection = self
+        self.send(bytes((CONNACK << 4, 2, 0, 0)))
+
+    def _subscribe(self, body):
+        pid = body[:2]
+        codes = bytearray()
+        i = 2
+        while i < len(body):
+            n = struct.unpack_from("!H", body, i)[0]
+            topic_filter = body[i + 2:i + 2 + n].decode()
+            qos = min(body[i + 2 + n], 1)
+            self.subscriptions[topic_filter] = qos
+            codes.append(qos)
+            i += 3 + n
+        self.send(bytes((SUBACK << 4,)) + _encode_length(2 + len(codes)) + pid + codes)
+
+    def _publish(self, header, body):
+        qos = header >> 1 & 3
+        n = struct.unpack_from("!H", body)[0]
+        topic = body[2:2 + n].decode()
+        i = 2 + n
+        if qos:
+            pid = body[i:i + 2]
+            i += 2
+        payload = body[i:]
+        stats = self.server.stats(topic)
+        if self.server.lose():
+            stats.dropped += 1
+            return
+        stats.received += 1
+        stats.bytes_in += len(payload)
+        if qos:
+            self.send(bytes((PUBACK << 4, 2)) + pid)
+        self.server.handle_publish(self, topic, payload, stats)
+
+
+class Emulator:
+    def __init__(self, host="0.0.0.0", port=1883, latency_ms=0, jitter_ms=0, loss=0.0, rpc_rate=0.0,
+                 attribute_rate=0.0, tokens=None, firmware=None, shared_attributes=None, provision_key=None,
+                 provision_secret=None):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.loss = loss
+        self.rpc_rate = rpc_rate
+        self.attribute_rate = attribute_rate
+        # None accepts any token
+        self.tokens = tokens
+        self.firmware = firmware
+        self.shared_attributes = shared_attributes or {}
+        self.provision_key = provision_key
+        self.provision_secret = provision_secret
+        self.devices = {}
+        self.connections = set()
+        self.topics = {}
+        self.connects = 0
+        self.rejected = 0
+        self.started = time.monotonic()
+        self._server = None
+        self._tasks = []
+
+    def lose(self):
+        return self.loss and random.random() < self.loss
+
+    def stats(self, topic):
+        key = topic_key(topic)
+        stats = self.topics.get(key)
+        if stats is None:
+            stats = self.topics[key] = TopicStats()
+        return stats
+
+    def device(self, token):
+        device = self.devices.get(token)
+        if device is None:
+            device = self.devices[token] = Device(token)
+            device.shared_attributes.update(self.shared_attributes)
+            if self.firmware is not None:
+                device.shared_attributes.update(self.firmware.attributes)
+        return device
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._accept, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.started = time.monotonic()
+        if self.rpc_rate:
+            self._tasks.append(asyncio.create_task(self._generate(self.rpc_rate, self.send_rpc_request)))
+        if self.attribute_rate:
+            self._tasks.append(asyncio.create_task(self._generate(self.attribute_rate, self._update_attributes)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._server.close()
+        for connection in list(self.connections):
+            connection.close()
+        await self._server.wait_closed()
+
+    async def _accept(self, reader, writer):
+        connection = Connection(self, reader, writer)
+        self.connections.add(connection)
+        await connection.run()
+
+    # Calls action(device) on each connected device rate times per second
+    # on average, at random times so that the devices are not in step
+    async def _generate(self, rate, action):
+        tick = 0.05
+        while True:
+            await asyncio.sleep(tick)
+            for device in list(self.devices.values()):
+                calls = rate * tick
+                while device.connection is not None and random.random() < calls:
+                    action(device)
+                    calls -= 1
+
+    def send_rpc_request(self, device, method="getState", params=None):
+        request_id = device.next_rpc_id()
+        payload = json.dumps({"method": method, "params": params or {}})
+        if device.connection.publish(RPC_REQUEST_TOPIC + str(request_id), payload):
+            device.pending_rpc[request_id] = time.monotonic()
+        return request_id
+
+    def _update_attributes(self, device):
+        self.update_shared_attributes(device, {"setpoint": round(random.uniform(18, 24), 1)})
+
+    def update_shared_attributes(self, device, attributes):
+        device.shared_attributes.update(attributes)
+        if device.connection is not None:
+            device.connection.publish(ATTRIBUTES_TOPIC, json.dumps(attributes))
+
+    def handle_publish(self, connection, topic, payload, stats):
+        device = connection.device
+        if connection.provisioning:
+            if topic == PROVISION_REQUEST_TOPIC:
+                self._provision(connection, payload)
+            return
+        if topic == TELEMETRY_TOPIC:
+            device.telemetry_messages += 1
+            for ts, values in self._time_series(payload, stats):
+                device.latest_telemetry.update(values)
+        elif topic == ATTRIBUTES_TOPIC:
+            for ts, values in self._time_series(payload, stats):
+                device.client_attributes.update(values)
+        elif topic.startswith(ATTRIBUTES_REQUEST_TOPIC):
+            request = self._json(payload) or {}
+            response = {}
+            for scope, keys, values in (("client", "clientKeys", device.client_attributes),
+                                        ("shared", "sharedKeys", device.shared_attributes)):
+                if keys in request:
+                    wanted = request[keys].split(",")
+                    response[scope] = {k: values[k] for k in wanted if k in values}
+            connection.publish(ATTRIBUTES_RESPONSE_TOPIC + topic[len(ATTRIBUTES_REQUEST_TOPIC):], json.dumps(response))
+        elif topic.startswith(RPC_REQUEST_TOPIC):
+            request = self._json(payload) or {}
+            response = {"method": request.get("method"), "result": request.get("params")}
+            connection.publish(RPC_RESPONSE_TOPIC + topic[len(RPC_REQUEST_TOPIC):], json.dumps(response))
+        elif topic.startswith(RPC_RESPONSE_TOPIC):
+            sent = device.pending_rpc.pop(int(topic[len(RPC_RESPONSE_TOPIC):]), None)
+            if sent is not None:
+                self.stats(RPC_REQUEST_TOPIC + "+").latency.record((time.monotonic() - sent) * 1000)
+        elif topic.startswith(FW_REQUEST_TOPIC) and self.firmware is not None:
+            parts = topic.split("/")
+            try:
+                size = int(payload or 0)
+            except ValueError:
+                size = 0
+            chunk = self.firmware.chunk(int(parts[-1]), size)
+            connection.publish("%s%s/chunk/%s" % (FW_RESPONSE_TOPIC, parts[3], parts[-1]), chunk)
+
+    def _provision(self, connection, payload):
+        request = self._json(payload) or {}
+        if self.provision_key is not None and (request.get("provisionDeviceKey") != self.provision_key
+                                               or request.get("provisionDeviceSecret") != self.provision_secret):
+            response = {"status": "NOT_FOUND", "errorMsg": "Failed to provision device!"}
+        else:
+            token = request.get("token") or "%s-%08x" % (request.get("deviceName", "device"),
+                                                        random.getrandbits(32))
+            if self.tokens is not None:
+                self.tokens.add(token)
+            self.device(token)
+            response = {"status": "SUCCESS", "credentialsType": "ACCESS_TOKEN", "credentialsValue": token}
+        # Sent whether or not the device subscribed, as ThingsBoard does
+        connection.publish(PROVISION_RESPONSE_TOPIC, json.dumps(response), qos=1)
+
+    @staticmethod
+    def _json(payload):
+        try:
+            return json.loads(payload)
+        except ValueError:
+            return None
+
+    # (ts, values) pairs of a telemetry or attributes payload; records
+    # the latency of entries that carry a ts
+    def _time_series(self, payload, stats):
+        data = self._json(payload)
+        if data is None:
+            return ()
+        entries = data if isinstance(data, list) else [data]
+        now = time.time() * 1000
+        result = []
+        for entry in entries:
+            if isinstance(entry, dict) and "ts" in entry and isinstance(entry.get("values"), dict):
+                stats.latency.record(now - entry["ts"])
+                result.append((entry["ts"], entry["values"]))
+            elif isinstance(entry, dict):
+                result.append((None, entry))
+        return result
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        telemetry = self.topics.get(TELEMETRY_TOPIC)
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "devices": len(self.devices),
+            "connected": sum(1 for d in self.devices.values() if d.connection is not None),
+            "connects": self.connects,
+            "rejected": self.rejected,
+            "telemetry_per_s": round(telemetry.received / elapsed, 1) if telemetry and elapsed else 0,
+            "topics": {key: stats.as_dict() for key, stats in sorted(self.topics.items())},
+        }
+
+
+def _shared_attribute(text):
+    key, _, value = text.partition("=")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+async def _main(args):
+    firmware = None
+    if args.firmware:
+        with open(args.firmware, "rb") as f:
+            firmware = Firmware(f.read(), args.fw_title, args.fw_version, args.fw_checksum_algorithm)
+    emulator = Emulator(args.host, args.port, args.latency_ms, args.jitter_ms, args.loss, args.rpc_rate,
+                        args.attribute_rate, set(args.token) if args.token else None, firmware,
+                        dict(_shared_attribute(a) for a in args.shared or ()), args.provision_key,
+                        args.provision_secret)
+    await emulator.start()
+    print("ThingsBoard emulator listening on %s:%d" % (args.host, emulator.port), file=sys.stderr)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    deadline = loop.time() + args.duration if args.duration else None
+    while not stop.is_set():
+        timeout = args.report_interval or None
+        if deadline is not None:
+            timeout = min(timeout or args.duration, max(deadline - loop.time(), 0))
+        try:
+            await asyncio.wait_for(stop.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        if deadline is not None and loop.time() >= deadline:
+            break
+        if args.report_interval and not stop.is_set():
+            report = emulator.report()
+            print("%6.0fs %5d devices connected, %8.1f telemetry msg/s" % (
+                report["elapsed_s"], report["connected"], report["telemetry_per_s"]), file=sys.stderr)
+    await emulator.stop()
+    report = json.dumps(emulator.report(), indent=1)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local ThingsBoard MQTT device API emulator")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=1883, help="0 picks a free port")
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay added to every packet sent")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="random extra delay, up to this much")
+    parser.add_argument("--loss", type=float, default=0, help="probability that a PUBLISH is dropped")
+    parser.add_argument("--rpc-rate", type=float, default=0, help="server-side RPC requests per second and device")
+    parser.add_argument("--attribute-rate", type=float, default=0,
+                        help="shared attribute updates per second and device")
+    parser.add_argument("--token", action="append", help="accepted access token (default: any), repeatable")
+    parser.add_argument("--shared", action="append", metavar="KEY=VALUE", help="shared attribute, repeatable")
+    parser.add_argument("--firmware", help="firmware image served to the devices")
+    parser.add_argument("--fw-title", default="firmware")
+    parser.add_argument("--fw-version", default="1.0")
+    parser.add_argument("--fw-checksum-algorithm", default="SHA256", choices=("SHA256", "SHA384", "SHA512",
+                                                                                "MD5", "CRC32"))
+    parser.add_argument("--provision-key", help="required provisionDeviceKey (default: any)")
+    parser.add_argument("--provision-secret")
+    parser.add_argument("--duration", type=float, default=0, help="stop after this many seconds (default: Ctrl-C)")
+    parser.add_argument("--report-interval", type=float, default=10, help="seconds between progress lines")
+    parser.add_argument("-o", "--output", help="write the final statistics as JSON to this file")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
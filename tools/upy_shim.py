@@ -0,0 +1,213 @@
+"""
+Stand-ins for the MicroPython-only modules the SDK imports, so that it runs unmodified on desktop CPython.
+Call install() before importing anything from thingsboard_sdk.
+
+usocket sockets behave like MicroPython's: write() and readinto(buf, n), readinto() returning None when a
+non-blocking socket has nothing to read, and timeouts raised as OSError(ETIMEDOUT). ussl.wrap_socket()
+accepts the MicroPython arguments plus session=, and exposes the TLS session as .session for resumption;
+like on MicroPython, the SSL socket it returns has setblocking() but no settimeout().
+"""
+
+import binascii
+import errno
+import hashlib
+import io
+import json
+import os
+import random
+import select
+import socket
+import ssl
+import struct
+import sys
+import time
+import types
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALFPERIOD = _TICKS_PERIOD // 2
+
+
+def ticks_ms():
+    return int(time.monotonic() * 1000) & _TICKS_MAX
+
+
+def ticks_us():
+    return int(time.monotonic() * 1000000) & _TICKS_MAX
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + _TICKS_HALFPERIOD) & _TICKS_MAX) - _TICKS_HALFPERIOD
+
+
+def sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+
+def sleep_us(us):
+    time.sleep(us / 1000000)
+
+
+# Stream methods shared by plain and SSL sockets. fileno() is only there
+# because CPython's select.poll() needs it; MicroPython polls the objects.
+class _Stream:
+    def fileno(self):
+        return self._sock.fileno()
+
+    def setblocking(self, flag):
+        self._sock.setblocking(flag)
+
+    def close(self):
+        self._sock.close()
+
+    def write(self, buf, n=None):
+        data = memoryview(buf)
+        if n is not None:
+            data = data[:n]
+        try:
+            self._sock.sendall(data)
+        except socket.timeout:
+            raise OSError(errno.ETIMEDOUT)
+        return len(data)
+
+    def send(self, buf):
+        return self.write(buf)
+
+    def readinto(self, buf, n=None):
+        try:
+            return self._sock.recv_into(buf, n or 0)
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return None
+        except socket.timeout:
+            raise OSError(errno.ETIMEDOUT)
+
+    # Reads until n bytes or the end of the stream, like a blocking
+    # MicroPython stream read
+    def read(self, n=-1):
+        if n < 0:
+            chunks = []
+            while True:
+                chunk = self.recv(4096)
+                if not chunk:
+                    return b"".join(chunks)
+                chunks.append(chunk)
+        buf = bytearray(n)
+        view = memoryview(buf)
+        got = 0
+        while got < n:
+            k = self.readinto(view[got:])
+            if not k:
+                if got or k == 0:
+                    break
+                return None
+            got += k
+        return bytes(buf[:got])
+
+    def recv(self, n):
+        try:
+            return self._sock.recv(n)
+        except socket.timeout:
+            raise OSError(errno.ETIMEDOUT)
+
+
+class Socket(_Stream):
+    def __init__(self, af=socket.AF_INET, type=socket.SOCK_STREAM, proto=0):
+        self._sock = socket.socket(af, type, proto)
+
+    def connect(self, addr):
+        try:
+            self._sock.connect(addr)
+        except socket.timeout:
+            raise OSError(errno.ETIMEDOUT)
+
+    def settimeout(self, timeout):
+        self._sock.settimeout(timeout)
+
+    def setsockopt(self, level, option, value):
+        self._sock.setsockopt(level, option, value)
+
+
+# Like MicroPython's SSL socket it has no settimeout(); timed reads have
+# to poll
+class SSLSocket(_Stream):
+    def __init__(self, sock):
+        self._sock = sock
+
+    # Decrypted bytes already buffered by the TLS layer; the OS socket
+    # does not poll readable for them
+    def pending(self):
+        return self._sock.pending()
+
+    @property
+    def session(self):
+        return self._sock.session
+
+
+# IPv4 stream addresses only, as the default socket() is AF_INET
+def getaddrinfo(host, port, af=0, type=0, proto=0, flags=0):
+    return socket.getaddrinfo(host, port, af or socket.AF_INET, type or socket.SOCK_STREAM, proto, flags)
+
+
+# CPython resumes a TLS session only on the context that created it,
+# so contexts are shared between sockets with the same parameters
+_contexts = {}
+
+
+def _context(server_side, keyfile, certfile, cert_reqs, cadata, check_hostname):
+    key = (server_side, keyfile, certfile, cert_reqs, cadata, check_hostname)
+    context = _contexts.get(key)
+    if context is not None:
+        return context
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER if server_side else ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = check_hostname
+    context.verify_mode = cert_reqs
+    if cadata:
+        context.load_verify_locations(cadata=cadata.decode() if isinstance(cadata, bytes) else cadata)
+    elif cert_reqs != ssl.CERT_NONE:
+        context.load_default_certs()
+    if certfile is not None:
+        context.load_cert_chain(certfile, keyfile)
+    _contexts[key] = context
+    return context
+
+
+def wrap_socket(sock, server_side=False, keyfile=None, certfile=None, cert_reqs=ssl.CERT_NONE, cadata=None,
+                server_hostname=None, do_handshake=True, key=None, cert=None, session=None):
+    if key is not None or cert is not None:
+        raise ValueError("pass keyfile/certfile paths on CPython")
+    context = _context(server_side, keyfile, certfile, cert_reqs, cadata,
+                       bool(server_hostname) and cert_reqs == ssl.CERT_REQUIRED)
+    kwargs = {} if server_side else {"server_hostname": server_hostname, "session": session}
+    wrapped = context.wrap_socket(sock._sock, server_side=server_side, do_handshake_on_connect=do_handshake,
+                                  **kwargs)
+    return SSLSocket(wrapped)
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+def install():
+    # The SDK also uses the ticks functions through the plain time module
+    for f in (ticks_ms, ticks_us, ticks_add, ticks_diff, sleep_ms, sleep_us):
+        setattr(time, f.__name__, f)
+    usocket = _module("usocket", socket=Socket, getaddrinfo=getaddrinfo, AF_INET=socket.AF_INET,
+                      AF_INET6=socket.AF_INET6, SOCK_STREAM=socket.SOCK_STREAM, SOCK_DGRAM=socket.SOCK_DGRAM,
+                      SOL_SOCKET=socket.SOL_SOCKET, SO_REUSEADDR=socket.SO_REUSEADDR,
+                      IPPROTO_TCP=socket.IPPROTO_TCP)
+    ussl = _module("ussl", wrap_socket=wrap_socket, CERT_NONE=ssl.CERT_NONE, CERT_OPTIONAL=ssl.CERT_OPTIONAL,
+                   CERT_REQUIRED=ssl.CERT_REQUIRED)
+    for name, module in (("utime", time), ("usocket", usocket), ("ussl", ussl), ("ustruct", struct),
+                         ("uerrno", errno), ("ubinascii", binascii), ("uhashlib", hashlib), ("uio", io),
+                         ("ujson", json), ("uos", os), ("urandom", random), ("uselect", select)):
+        sys.modules.setdefault(name, module)
+    # Make thingsboard_sdk and the sdk_core submodule importable from a checkout
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)